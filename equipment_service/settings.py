@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'equipments',
 
@@ -106,6 +107,16 @@ DATABASES = {
 }
 
 MEDIA_ROOT = BASE_DIR 
+MEDIA_URL = '/'
+
+# Only these upload directories of MEDIA_ROOT are served, see equipments/media.py.
+# Set MEDIA_ACCEL_REDIRECT to the internal nginx location mapped to MEDIA_ROOT
+# to have nginx stream the files instead of the workers.
+MEDIA_SERVING = {
+    'PREFIXES': ['contracts/', 'equipment_images/'],
+    'MAX_AGE': 3600,
+    'ACCEL_REDIRECT': os.environ.get('MEDIA_ACCEL_REDIRECT') or None,
+}
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -125,3 +136,94 @@ USE_TZ = True
 STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Tracking events (item views, cart activity) are written in batches, and
+# with EVENT_INGESTION_BUFFERED=1 buffered per process and accepted with a
+# 202 instead of a 201 with the created events, see equipments/ingest.py.
+EVENT_INGESTION = {
+    'BUFFERED': os.environ.get('EVENT_INGESTION_BUFFERED', '0') == '1',
+    'MAX_BATCH': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_PENDING': 20000,
+}
+
+# Review events are stored in an outbox table with the review and published
+# to RabbitMQ by `manage.py publish_events`, see equipments/outbox.py.
+EVENT_PUBLISHER = {
+    'HOST': os.environ.get('RABBITMQ_HOST', 'host.docker.internal'),
+    'PORT': int(os.environ.get('RABBITMQ_PORT', '5672')),
+    'EXCHANGE': 'review_events',
+    'BATCH_SIZE': 100,
+    'POLL_INTERVAL': 1.0,
+    'RETRY_DELAY': 5,
+    'MAX_RETRY_DELAY': 3600,
+    'MAX_ATTEMPTS': 10,
+}
+
+# Shared, cached client of the user service, see equipments/users.py.
+USER_DIRECTORY = {
+    'URL': os.environ.get('USER_SERVICE_URL', 'http://192.168.1.120:8000'),
+    'TIMEOUT': 5,
+    'MAX_CONNECTIONS': 20,
+    'CACHE_SIZE': 10000,
+    'TTL': 300,
+    'NEGATIVE_TTL': 30,
+    'BULK_CONCURRENCY': 8,
+}
+
+# Thumbnails and WebP sizes of the equipment images, see equipments/images.py.
+IMAGE_VARIANTS = {
+    'ASYNC': True,
+    'WORKERS': 2,
+    'THUMBNAIL': 200,
+    'WIDTHS': [400, 800, 1600],
+    'QUALITY': 80,
+}
+
+# Cached catalog read responses, see equipments/response_cache.py. Point
+# RESPONSE_CACHE_REDIS_URL at a Redis server (needs the redis package) to
+# share the cache, and its invalidations, between the worker processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    } if not os.environ.get('RESPONSE_CACHE_REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['RESPONSE_CACHE_REDIS_URL'],
+    },
+}
+
+RESPONSE_CACHE = {
+    'ENABLED': True,
+    'CACHE': 'responses',
+    'TIMEOUT': 300,
+}
+
+# Monthly partitions of the tracking event tables, see equipments/partitions.py.
+# `manage.py expire_events` creates the coming months' partitions and drops
+# the expired ones, after rolling their item views up into the daily stats.
+EVENT_RETENTION = {
+    'KEEP_MONTHS': 13,
+    'MONTHS_AHEAD': 3,
+}
+
+# Related items of each item from co-views and co-favorites, rebuilt by
+# `manage.py build_related`, see equipments/related.py.
+RELATED_ITEMS = {
+    'TOP_K': 10,
+    'DAYS': 180,
+    'FAVORITE_WEIGHT': 3.0,
+    'MAX_ITEMS_PER_USER': 500,
+}
+
+# Time-decayed trending score of the items behind ?ordering=trending, see
+# equipments/trending.py. Run `manage.py rebuild_trending` after changing it.
+TRENDING = {
+    'HALF_LIFE_HOURS': 48,
+    'WEIGHTS': {'view': 1, 'cart': 3, 'favorite': 5, 'rental': 10},
+    'REBUILD_HALF_LIVES': 20,
+}
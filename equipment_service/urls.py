@@ -15,13 +15,14 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path,include
-from django.conf.urls.static import static
-from django.conf import settings
+from django.urls import path,include,re_path
+
+from equipments.media import media_pattern, serve_media
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/',include("equipments.urls"))
-
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('api/',include("equipments.urls")),
+    # Uploaded files only, with caching and range support (not the rest of MEDIA_ROOT).
+    re_path(media_pattern(), serve_media, name='media'),
+]
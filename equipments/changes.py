@@ -0,0 +1,95 @@
+"""
+Change feed of the catalog, for clients keeping a copy of it in sync.
+
+A trigger stamps every write of an item's representation with the id of its
+transaction (Stuff.change_txid) and records every delete as a
+StuffTombstone. Updates of only the counters, the trending score or the
+search vector, made on every tracking event, keep the previous stamp. A feed
+token covers the transactions with ids in [lower, upper): upper is the
+oldest transaction still running when the window was opened, so every
+transaction of the window has finished and none is ever skipped, however
+they commit; the next window starts at upper. A long transaction holds the
+feed back until it ends.
+
+An item appears at most once per window, as it is now, however many times
+it changed. The first sync (no token) returns the whole catalog and no
+tombstones, as the client had none of the deleted items.
+"""
+import base64
+import binascii
+import heapq
+import json
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Stuff, StuffTombstone
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def horizon():
+    """Id of the oldest transaction still running: all older ones have finished."""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint')
+        return cursor.fetchone()[0]
+
+
+def encode_token(lower, upper=None, after=None):
+    token = {'l': lower}
+    if upper is not None:
+        token.update(u=upper, a=after)
+    return base64.urlsafe_b64encode(json.dumps(token, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """(lower, upper or None, (txid, id) read up to in the window or None)."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        lower, upper, after = int(data['l']), data.get('u'), data.get('a')
+        if upper is not None:
+            upper = int(upper)
+        if after is not None:
+            after = (int(after[0]), int(after[1]))
+    except (binascii.Error, TypeError, ValueError, KeyError, IndexError):
+        raise InvalidToken(token)
+    return lower, upper, after
+
+
+def _window(lower, upper, after, id_field):
+    condition = Q(change_txid__gte=lower, change_txid__lt=upper)
+    if after is not None:
+        condition &= Q(change_txid__gt=after[0]) | Q(change_txid=after[0], **{f'{id_field}__gt': after[1]})
+    return condition
+
+
+def read_changes(token=None, limit=100, stuffs=None):
+    """
+    The changes after token, at most limit of them. Returns (changes, next
+    token, whether more changes are available right away); each change is a
+    Stuff, or a StuffTombstone for a deleted item. stuffs is the queryset the
+    items are loaded from, e.g. with their related rows.
+    """
+    lower, upper, after = decode_token(token) if token else (0, None, None)
+    if upper is None:
+        upper = max(horizon(), lower)
+    stuffs = Stuff.objects.all() if stuffs is None else stuffs
+    rows = stuffs.filter(_window(lower, upper, after, 'id')).order_by('change_txid', 'id')[:limit + 1]
+    tombstones = []
+    if lower:
+        tombstones = StuffTombstone.objects.filter(
+            _window(lower, upper, after, 'stuff_id')
+        ).order_by('change_txid', 'stuff_id')[:limit + 1]
+
+    # A tombstone's primary key is the id of the deleted item.
+    changes = list(heapq.merge(rows, tombstones, key=lambda change: (change.change_txid, change.pk)))
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if has_more:
+        last = changes[-1]
+        next_token = encode_token(lower, upper, (last.change_txid, last.pk))
+    else:
+        next_token = encode_token(upper)
+    return changes, next_token, has_more
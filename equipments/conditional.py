@@ -0,0 +1,59 @@
+"""
+Conditional GET for the catalog reads.
+
+Responses carry an ETag derived from the updated_at of the rows they show,
+single rows a Last-Modified as well, and ask clients to revalidate. Views
+compute these validators from the rows they load anyway, before fetching the
+related rows and serializing, so a request whose If-None-Match or
+If-Modified-Since still matches is answered 304 for the cost of that one
+query. Items' updated_at also moves when their management row or images
+change (see equipments.signals). The denormalized counters (num_views,
+avg_rating, ...) are not part of the validators: they change with every
+event, which would defeat revalidation for the most popular items, so a 304
+may carry counters that are behind.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control')
+
+
+def _validators(tag, updated_at):
+    headers = {'ETag': quote_etag(tag), 'Cache-Control': 'no-cache'}
+    if updated_at is not None:
+        headers['Last-Modified'] = http_date(int(updated_at.timestamp()))
+    return headers
+
+
+def object_validators(instance):
+    """Validator headers of one row."""
+    return _validators(f'{instance.pk}-{instance.updated_at.timestamp():.6f}', instance.updated_at)
+
+
+def list_validators(rows, *state):
+    """
+    Validator headers of a list of rows: an ETag changing whenever a row is
+    added, removed, reordered or changed. state holds anything else the
+    response shows, such as whether there is a next page. There is no
+    Last-Modified: the newest updated_at of the rows does not move when a
+    row is deleted or leaves the list.
+    """
+    digest = hashlib.sha256(repr([(row.pk, row.updated_at.timestamp()) for row in rows] + list(state)).encode())
+    return _validators(digest.hexdigest()[:32], None)
+
+
+def respond(request, headers, build):
+    """
+    304 if the request's validators match headers, else build()'s response;
+    a 200 or 304 carries headers.
+    """
+    last_modified = parse_http_date_safe(headers.get('Last-Modified', ''))
+    response = get_conditional_response(request, etag=headers['ETag'], last_modified=last_modified)
+    if response is None:
+        response = build()
+    if response.status_code in (200, 304):
+        for name, value in headers.items():
+            response[name] = value
+    return response
@@ -0,0 +1,106 @@
+"""
+Atomic maintenance of the denormalized counters stored on Stuff.
+
+Every change is a single UPDATE built from F-expressions, so concurrent
+writers never lose increments and no row is read back into Python. The
+counters change with every event, so they leave Stuff.updated_at, and with
+it the item's HTTP validators (equipments.conditional) and its place in
+the change feed (equipments.changes), alone.
+"""
+from collections import defaultdict
+
+from django.db.models import Avg, Case, Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Abs, Cast, Coalesce, Greatest
+
+from .models import Favorite, ItemView, Rental, Review, Stuff
+
+# Plain event counters and the model whose rows they count.
+EVENT_COUNTERS = {
+    'num_views': ItemView,
+    'num_favorites': Favorite,
+    'num_rentals': Rental,
+}
+
+# Stored and recomputed revenues are float sums added up in a different
+# order, so they are only compared to the cent.
+REVENUE_TOLERANCE = 0.005
+
+
+def _add(field, delta):
+    """F(field) + delta, never below zero: the counters are unsigned."""
+    if delta >= 0:
+        return F(field) + delta
+    return Greatest(F(field) + delta, Value(0), output_field=Stuff._meta.get_field(field))
+
+
+def increment(stuff_id, field, delta=1):
+    """Add delta to one counter of one item."""
+    Stuff.objects.filter(pk=stuff_id).update(**{field: _add(field, delta)})
+
+
+def increment_many(field, deltas):
+    """
+    Apply a {stuff_id: delta} mapping to one counter, with one UPDATE per
+    distinct delta rather than one per item.
+    """
+    by_delta = defaultdict(list)
+    for stuff_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(stuff_id)
+    for delta, stuff_ids in by_delta.items():
+        Stuff.objects.filter(pk__in=stuff_ids).update(**{field: _add(field, delta)})
+
+
+def change_rating(stuff_id, rating_delta, count_delta):
+    """
+    Fold a review into the rating counters: count_delta is +1 for a new review,
+    -1 for a deleted one and 0 when an existing review changed its rating.
+    """
+    rating_sum = _add('rating_sum', rating_delta)
+    num_reviews = _add('num_reviews', count_delta)
+    # Every right-hand side of an UPDATE sees the old row, so the average is
+    # computed from the same new sum and count that are being written; the
+    # condition reads "old count + count_delta > 0".
+    Stuff.objects.filter(pk=stuff_id).update(
+        rating_sum=rating_sum,
+        num_reviews=num_reviews,
+        avg_rating=Case(
+            When(num_reviews__gt=-count_delta, then=Cast(rating_sum, FloatField()) / num_reviews),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+    )
+
+
+def _per_stuff(model, aggregate, stuff_field='stuff', default=0):
+    grouped = model.objects.filter(**{stuff_field: OuterRef('pk')}).order_by().values(stuff_field)
+    return Coalesce(Subquery(grouped.annotate(value=aggregate).values('value')), Value(default))
+
+
+def expected_counters():
+    """Expressions recomputing every integer counter from the event tables."""
+    expressions = {field: _per_stuff(model, Count('id')) for field, model in EVENT_COUNTERS.items()}
+    expressions['num_reviews'] = _per_stuff(Review, Count('id'), 'product')
+    expressions['rating_sum'] = _per_stuff(Review, Sum('rating'), 'product')
+    expressions['revenue'] = _per_stuff(Rental, Sum('total_price'), default=0.0)
+    return expressions
+
+
+def reconcile(queryset=None):
+    """
+    Recompute the counters of every item in queryset whose stored values
+    drifted from the event tables, in one UPDATE. Returns the repaired count.
+    """
+    queryset = Stuff.objects.all() if queryset is None else queryset
+    expressions = expected_counters()
+    drift = Q(revenue_drift__gt=REVENUE_TOLERANCE)
+    for field in expressions:
+        if field != 'revenue':
+            drift |= ~Q(**{field: F(f'expected_{field}')})
+    drifted = queryset.annotate(
+        **{f'expected_{field}': expression for field, expression in expressions.items()}
+    ).annotate(revenue_drift=Abs(F('revenue') - F('expected_revenue'))).filter(drift)
+    return Stuff.objects.filter(pk__in=drifted.values('pk')).update(
+        avg_rating=_per_stuff(Review, Avg('rating', output_field=FloatField()), 'product', 0.0),
+        **expressions,
+    )
@@ -0,0 +1,149 @@
+"""
+Derived sizes of the EquipmentImage uploads.
+
+Once an image is committed, a worker pool builds a square thumbnail and
+WebP copies at a few widths (never wider than the original) with Pillow,
+stores them under equipment_images/variants/ and records them in
+EquipmentImage.variants, which EquipmentImageSerializer exposes as a srcset
+map. Configured through the IMAGE_VARIANTS setting:
+
+    IMAGE_VARIANTS = {
+        'ASYNC': True,     # False builds the variants in the saving thread
+        'WORKERS': 2,
+        'THUMBNAIL': 200,  # side of the square, center-cropped thumbnail
+        'WIDTHS': [400, 800, 1600],
+        'QUALITY': 80,     # WebP quality
+    }
+
+Jobs still queued when a process exits are lost; the build_image_variants
+command rebuilds whatever is missing.
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import response_cache
+from .models import EquipmentImage, Stuff
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ASYNC': True,
+    'WORKERS': 2,
+    'THUMBNAIL': 200,
+    'WIDTHS': [400, 800, 1600],
+    'QUALITY': 80,
+}
+
+VARIANTS_DIR = 'equipment_images/variants'
+
+
+def variant_settings():
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_VARIANTS', {})}
+
+
+def render_variants(source, thumbnail=200, widths=(400, 800, 1600), quality=80):
+    """
+    Resize the image file source. Returns {label: (WebP bytes, width, height)},
+    with 'thumb' for the thumbnail and '<width>w' for each width.
+    """
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    rendered = {}
+
+    def encode(label, resized):
+        buffer = io.BytesIO()
+        resized.save(buffer, 'WEBP', quality=quality, method=4)
+        rendered[label] = (buffer.getvalue(), resized.width, resized.height)
+
+    encode('thumb', ImageOps.fit(image, (thumbnail, thumbnail), Image.LANCZOS))
+    for width in sorted(widths):
+        if width >= image.width:
+            break
+        encode(f'{width}w', image.resize((width, round(image.height * width / image.width)), Image.LANCZOS))
+    return rendered
+
+
+def build_variants(image_id):
+    """(Re)build the variants of one EquipmentImage and record them. Returns the labels built."""
+    image = EquipmentImage.objects.filter(pk=image_id).first()
+    if image is None or not image.url:
+        return []
+    config = variant_settings()
+    # Variants are rebuilt in place, so they use plain storage, not the
+    # content-addressed one of the originals.
+    storage = default_storage
+    stem = os.path.splitext(os.path.basename(image.url.name))[0]
+    try:
+        with image.url.open('rb') as source:
+            rendered = render_variants(source, config['THUMBNAIL'], config['WIDTHS'], config['QUALITY'])
+    except OSError as exc:
+        logger.warning("Cannot build the variants of image %s (%s): %s", image.id, image.url.name, exc)
+        return []
+
+    variants = {}
+    for label, (content, width, height) in rendered.items():
+        name = f'{VARIANTS_DIR}/{image.id}/{stem}_{label}.webp'
+        if storage.exists(name):
+            storage.delete(name)
+        variants[label] = {'name': storage.save(name, ContentFile(content)), 'width': width, 'height': height}
+    built = {entry['name'] for entry in variants.values()}
+    # .update() so the signal that scheduled this job does not fire again, and
+    # only if the original was not replaced in the meantime.
+    recorded = EquipmentImage.objects.filter(pk=image.id, url=image.url.name).update(
+        variants=variants, updated_at=timezone.now(),
+    )
+    if not recorded:
+        delete_files(built - {entry['name'] for entry in image.variants.values()}, storage)
+        return []
+    delete_files([entry['name'] for entry in image.variants.values() if entry['name'] not in built], storage)
+    Stuff.objects.filter(pk=image.stuff_id).touch()
+    response_cache.invalidate(f'stuff:{image.stuff_id}', f'images:{image.stuff_id}')
+    return list(variants)
+
+
+def delete_files(names, storage=None):
+    storage = storage or default_storage
+    for name in names:
+        try:
+            storage.delete(name)
+        except OSError:
+            logger.warning("Could not delete image variant %s", name)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def run_job(image_id):
+    """Worker entry point: build_variants() in a thread of its own."""
+    try:
+        build_variants(image_id)
+    except Exception:
+        logger.exception("Building the variants of image %s failed", image_id)
+    finally:
+        connection.close()
+
+
+def schedule(image_id):
+    """Build the variants of an image on the worker pool, or right away when ASYNC is off."""
+    global _executor
+    config = variant_settings()
+    if not config['ASYNC']:
+        build_variants(image_id)
+        return
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(config['WORKERS'], thread_name_prefix='image-variants')
+    _executor.submit(run_job, image_id)
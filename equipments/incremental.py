@@ -0,0 +1,203 @@
+"""
+Watermark-based incremental aggregation into the daily stat tables.
+
+fold_new_events() reads only the ItemView and Rental rows created since the
+last run (ids above the StatWatermark rows), and adds their contribution to
+the existing SiteStat, TrafficSource, DeviceStat and CategoryStat rows with
+additive upserts. The watermarks move forward in the same transaction, so
+no event is counted twice. Cost grows with new traffic, not with the size
+of the day.
+
+Ids are taken before commit, so the watermark only passes events at least
+SETTLE_SECONDS old: an event whose transaction commits later than that (a
+long ingestion flush, a stalled worker) falls below the watermark unseen
+and is missing from the stats until the next rollup_range() of its day,
+which reads every event up to the watermarks.
+
+Distinct visitors are kept exact through SeenVisitor: only users not yet
+recorded for a (day, source) or (day, device) pair increment the counts.
+The new views' users are also added to the day's HyperLogLog sketches
+(equipments.sketches), for unique visitors over longer ranges.
+"""
+import datetime
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import rollups, sketches
+from .models import (
+    CategoryStat, DeviceStat, ItemView, Rental, SeenVisitor, SiteStat, StatWatermark, TrafficSource,
+    Visitor,
+)
+
+# Events younger than this are left for the next run, so rows from
+# transactions that are still committing are normally not skipped by the
+# watermark; see the module docstring for the ones that are.
+SETTLE_SECONDS = 5
+
+
+def _settled_max_id(model, time_field, after_id, cutoff):
+    return model.objects.filter(
+        id__gt=after_id, **{f'{time_field}__lte': cutoff}
+    ).aggregate(last=Max('id'))['last'] or after_id
+
+
+def _column(model, name):
+    return model._meta.get_field(name).column
+
+
+def _upsert_adding(model, keys, rows, additive, extra_assignments=()):
+    """
+    INSERT rows (dicts holding every column of model except the id); on
+    conflict with an existing (keys) row, add the additive columns to it.
+    """
+    if not rows:
+        return
+    table = model._meta.db_table
+    names = list(rows[0])
+    columns = [_column(model, name) for name in names]
+    placeholders = ', '.join(['(' + ', '.join(['%s'] * len(names)) + ')'] * len(rows))
+    assignments = [f'{_column(model, name)} = {table}.{_column(model, name)} + EXCLUDED.{_column(model, name)}'
+                   for name in additive]
+    assignments.extend(extra_assignments)
+    sql = (
+        f'INSERT INTO {table} ({", ".join(columns)}) VALUES {placeholders} '
+        f'ON CONFLICT ({", ".join(_column(model, key) for key in keys)}) DO UPDATE SET {", ".join(assignments)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [row[name] for row in rows for name in names])
+
+
+def _new_seen_visitors(after_id, upto_id):
+    """Record the new events' users in SeenVisitor; return {(day, dimension, value): newly seen}."""
+    conditions, params = rollups._id_range('v.id', after_id, upto_id)
+    sql = f"""
+        WITH inserted AS ({rollups.seen_visitors_sql(conditions)} RETURNING date, dimension, value)
+        SELECT date, dimension, value, COUNT(*) FROM inserted GROUP BY date, dimension, value
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [timezone.get_current_timezone_name()] + params)
+        return {(day, dimension, value): count for day, dimension, value, count in cursor.fetchall()}
+
+
+def _initialize(now):
+    """First run: start the watermarks at the settled events and roll up the recent days from scratch."""
+    cutoff = now - datetime.timedelta(seconds=SETTLE_SECONDS)
+    StatWatermark.objects.bulk_create([
+        StatWatermark(name=rollups.VIEWS_MARK, last_id=_settled_max_id(ItemView, 'timestamp', 0, cutoff)),
+        StatWatermark(name=rollups.RENTALS_MARK, last_id=_settled_max_id(Rental, 'created_at', 0, cutoff)),
+    ], ignore_conflicts=True)
+    today = timezone.localdate(now)
+    rollups.rollup_range(today - datetime.timedelta(days=rollups.SEEN_VISITOR_DAYS - 1), today)
+
+
+@transaction.atomic
+def fold_new_events():
+    """Add every settled event past the watermarks to the daily stats. Returns {table: events folded}."""
+    rollups.lock_stats()
+    now = timezone.now()
+    marks = {mark.name: mark for mark in StatWatermark.objects.select_for_update()}
+    if set(marks) != {rollups.VIEWS_MARK, rollups.RENTALS_MARK}:
+        _initialize(now)
+        return {}
+
+    cutoff = now - datetime.timedelta(seconds=SETTLE_SECONDS)
+    views_after = marks[rollups.VIEWS_MARK].last_id
+    rentals_after = marks[rollups.RENTALS_MARK].last_id
+    views_upto = _settled_max_id(ItemView, 'timestamp', views_after, cutoff)
+    rentals_upto = _settled_max_id(Rental, 'created_at', rentals_after, cutoff)
+
+    def zero_site(day):
+        return {'date': day, 'total_visitors': 0, 'total_page_views': 0, 'total_rentals': 0,
+                'total_revenue': 0.0, 'avg_order_value': 0.0, 'conversion_rate': 0.0}
+
+    folded = {'itemview': 0, 'rental': 0}
+    site = {}
+    sources = defaultdict(lambda: {'visitors': 0, 'rentals': 0, 'revenue': 0.0})
+    devices = defaultdict(lambda: {'visitors': 0, 'rentals': 0, 'revenue': 0.0})
+    categories = defaultdict(lambda: {'views': 0, 'rentals': 0, 'revenue': 0.0})
+
+    if views_upto > views_after:
+        new_views = (
+            ItemView.objects.filter(id__gt=views_after, id__lte=views_upto)
+            .annotate(day=TruncDate('timestamp'), category=F('stuff__category'))
+            .order_by().values('day', 'category').annotate(views=Count('id'))
+        )
+        for row in new_views:
+            folded['itemview'] += row['views']
+            site.setdefault(row['day'], zero_site(row['day']))['total_page_views'] += row['views']
+            if row['category'] is not None:
+                categories[row['day'], row['category']]['views'] += row['views']
+        for (day, dimension, value), count in _new_seen_visitors(views_after, views_upto).items():
+            (sources if dimension == 'source' else devices)[day, value]['visitors'] += count
+        sketches.add_views(*rollups._id_range('v.id', views_after, views_upto))
+
+    if rentals_upto > rentals_after:
+        for row in rollups._rental_rows(after_id=rentals_after, upto_id=rentals_upto):
+            day, count, revenue = row['day'], row['rentals'], row['revenue'] or 0
+            folded['rental'] += count
+            stat = site.setdefault(day, zero_site(day))
+            stat['total_rentals'] += count
+            stat['total_revenue'] += revenue
+            targets = []
+            if row['source']:
+                targets.append(sources[day, row['source']])
+            if row['device_type']:
+                targets.append(devices[day, row['device_type']])
+            if row['category'] is not None:
+                targets.append(categories[day, row['category']])
+            for target in targets:
+                target['rentals'] += count
+                target['revenue'] += revenue
+
+    for stat in site.values():
+        stat['avg_order_value'] = stat['total_revenue'] / stat['total_rentals'] if stat['total_rentals'] else 0.0
+        stat['conversion_rate'] = (
+            stat['total_rentals'] / stat['total_page_views'] * 100 if stat['total_page_views'] else 0.0
+        )
+
+    table = SiteStat._meta.db_table
+    _upsert_adding(
+        SiteStat, ['date'], list(site.values()),
+        ['total_page_views', 'total_rentals', 'total_revenue'],
+        [
+            f'avg_order_value = CASE WHEN {table}.total_rentals + EXCLUDED.total_rentals > 0 '
+            f'THEN ({table}.total_revenue + EXCLUDED.total_revenue) / ({table}.total_rentals + EXCLUDED.total_rentals) '
+            f'ELSE 0 END',
+            f'conversion_rate = CASE WHEN {table}.total_page_views + EXCLUDED.total_page_views > 0 '
+            f'THEN ({table}.total_rentals + EXCLUDED.total_rentals) * 100.0 '
+            f'/ ({table}.total_page_views + EXCLUDED.total_page_views) ELSE 0 END',
+        ],
+    )
+    _upsert_adding(
+        TrafficSource, ['date', 'source'],
+        [{'date': day, 'source': source, **values} for (day, source), values in sources.items()],
+        ['visitors', 'rentals', 'revenue'],
+    )
+    _upsert_adding(
+        DeviceStat, ['date', 'device_type'],
+        [{'date': day, 'device_type': device_type, **values} for (day, device_type), values in devices.items()],
+        ['visitors', 'rentals', 'revenue'],
+    )
+    _upsert_adding(
+        CategoryStat, ['date', 'category'],
+        [{'date': day, 'category': category, **values} for (day, category), values in categories.items()],
+        ['views', 'rentals', 'revenue'],
+    )
+
+    # Visitor sessions are not events with ids: recount them for the touched days only.
+    for day in site:
+        lower, upper = rollups.day_bounds(day, day)
+        SiteStat.objects.filter(date=day).update(
+            total_visitors=Visitor.objects.filter(last_visit__gte=lower, last_visit__lt=upper).count()
+        )
+
+    StatWatermark.objects.filter(name=rollups.VIEWS_MARK).update(last_id=views_upto, updated_at=now)
+    StatWatermark.objects.filter(name=rollups.RENTALS_MARK).update(last_id=rentals_upto, updated_at=now)
+    SeenVisitor.objects.filter(
+        date__lt=timezone.localdate(now) - datetime.timedelta(days=rollups.SEEN_VISITOR_DAYS - 1)
+    ).delete()
+    return folded
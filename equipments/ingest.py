@@ -0,0 +1,250 @@
+"""
+Buffered ingestion of high-volume tracking events (ItemView, CartActivity).
+
+Events are written with one bulk_create per batch. When BUFFERED, accepted
+events are kept in a per-process buffer instead and written by a background
+thread, either when MAX_BATCH events are pending or FLUSH_INTERVAL seconds
+have passed; the API then answers 202 with the number of events accepted
+rather than 201 with the created events. Configured through the
+EVENT_INGESTION setting:
+
+    EVENT_INGESTION = {
+        'BUFFERED': False,      # True queues events and writes them in the background
+        'MAX_BATCH': 500,       # size flush threshold and rows per INSERT
+        'FLUSH_INTERVAL': 1.0,  # time flush threshold, in seconds
+        'MAX_PENDING': 20000,   # events held before new ones are dropped
+    }
+
+Timestamps are auto_now_add, so buffered events record the flush time, at
+most FLUSH_INTERVAL seconds after the event.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+
+from . import counters, ops, trending
+from .models import CartActivity, ItemView, Stuff, Visitor
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BUFFERED': False,
+    'MAX_BATCH': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_PENDING': 20000,
+}
+
+
+def ingestion_settings():
+    return {**DEFAULTS, **getattr(settings, 'EVENT_INGESTION', {})}
+
+
+class EventBuffer:
+    def __init__(self, model, on_write=None, max_batch=500, flush_interval=1.0, max_pending=20000):
+        self.model = model
+        self.on_write = on_write
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self._stats = Counter()
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+
+    def add(self, events):
+        """Queue unsaved model instances. Returns how many were accepted."""
+        with self._cond:
+            room = max(self.max_pending - len(self._pending), 0)
+            accepted = events[:room]
+            self._pending.extend(accepted)
+            self._stats['accepted'] += len(accepted)
+            self._stats['dropped_overflow'] += len(events) - len(accepted)
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        self._ensure_started()
+        return len(accepted)
+
+    def flush(self):
+        """Write everything pending now. Safe to call from any thread."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            started = time.monotonic()
+            done = 0
+            try:
+                for offset in range(0, len(batch), self.max_batch):
+                    done += self._write(batch[offset:offset + self.max_batch])
+            except DatabaseError:
+                logger.exception("Flushing %s events failed, keeping them for the next flush", self.model.__name__)
+                with self._cond:
+                    self._stats['failed_flushes'] += 1
+                self._requeue(batch[done:])
+                connection.close()
+            self._record_flush(started)
+            return done
+
+    def stop(self):
+        """Write everything pending and end the background thread."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        return self.flush()
+
+    def write(self, events):
+        """Write events synchronously in the caller's thread, bypassing the buffer."""
+        started = time.monotonic()
+        with self._cond:
+            self._stats['accepted'] += len(events)
+        for offset in range(0, len(events), self.max_batch):
+            self._write(events[offset:offset + self.max_batch])
+        self._record_flush(started)
+        return len(events)
+
+    def stats(self):
+        with self._cond:
+            flushes = self._stats['flushes']
+            return {
+                'pending': len(self._pending),
+                'accepted': self._stats['accepted'],
+                'written': self._stats['written'],
+                'dropped_overflow': self._stats['dropped_overflow'],
+                'dropped_invalid': self._stats['dropped_invalid'],
+                'flushes': flushes,
+                'failed_flushes': self._stats['failed_flushes'],
+                'last_flush_ms': round(self._last_flush_ms, 3),
+                'avg_flush_ms': round(self._stats['flush_ms_total'] / flushes, 3) if flushes else 0.0,
+                'max_flush_ms': round(self._max_flush_ms, 3),
+            }
+
+    def _record_flush(self, started):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._cond:
+            self._stats['flushes'] += 1
+            self._stats['flush_ms_total'] += elapsed_ms
+            self._last_flush_ms = elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+
+    def _write(self, chunk):
+        try:
+            with transaction.atomic():
+                created = self.model.objects.bulk_create(chunk)
+                if self.on_write:
+                    self.on_write(created)
+        except IntegrityError:
+            # A referenced row disappeared while the events were buffered:
+            # drop only the orphans and write the rest.
+            for event in chunk:
+                event.pk = None
+            valid = self._without_orphans(chunk)
+            with self._cond:
+                self._stats['dropped_invalid'] += len(chunk) - len(valid)
+            with transaction.atomic():
+                created = self.model.objects.bulk_create(valid)
+                if self.on_write:
+                    self.on_write(created)
+        with self._cond:
+            self._stats['written'] += len(created)
+        return len(chunk)
+
+    def _without_orphans(self, chunk):
+        stuff_ids = set(Stuff.objects.filter(pk__in={e.stuff_id for e in chunk}).values_list('pk', flat=True))
+        valid = [e for e in chunk if e.stuff_id in stuff_ids]
+        if self.model is CartActivity:
+            visitor_ids = set(
+                Visitor.objects.filter(pk__in={e.visitor_id for e in valid}).values_list('pk', flat=True)
+            )
+            valid = [e for e in valid if e.visitor_id in visitor_ids]
+        return valid
+
+    def _requeue(self, events):
+        for event in events:
+            event.pk = None
+        with self._cond:
+            room = max(self.max_pending - len(self._pending), 0)
+            self._pending[:0] = events[:room]
+            self._stats['dropped_overflow'] += max(len(events) - room, 0)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(
+                    target=self._run, name=f'{self.model.__name__}-flusher', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopped or len(self._pending) >= self.max_batch, timeout=self.flush_interval,
+                )
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Unexpected error in the %s flusher", self.model.__name__)
+        connection.close()
+
+
+def _count_views(views):
+    counters.increment_many('num_views', Counter(view.stuff_id for view in views))
+    trending.record_many('view', [(view.stuff_id, view.timestamp) for view in views])
+
+
+def _score_cart_adds(activities):
+    trending.record_many('cart', [(event.stuff_id, event.timestamp) for event in activities if event.action == 'add'])
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_buffer(model):
+    """The process-wide buffer for model, created on first use."""
+    if model not in _buffers:
+        with _buffers_lock:
+            if model not in _buffers:
+                config = ingestion_settings()
+                _buffers[model] = EventBuffer(
+                    model,
+                    on_write=_count_views if model is ItemView else _score_cart_adds,
+                    max_batch=config['MAX_BATCH'],
+                    flush_interval=config['FLUSH_INTERVAL'],
+                    max_pending=config['MAX_PENDING'],
+                )
+    return _buffers[model]
+
+
+def ingest(model, events):
+    """
+    Store unsaved events, buffered or synchronously depending on settings.
+    Returns the number of events accepted.
+    """
+    buffer = get_buffer(model)
+    if not ingestion_settings()['BUFFERED']:
+        return buffer.write(events)
+    return buffer.add(events)
+
+
+@atexit.register
+def flush_all():
+    for buffer in list(_buffers.values()):
+        buffer.flush()
+
+
+ops.register('ingestion', lambda: {model.__name__: buffer.stats() for model, buffer in _buffers.items()})
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from equipments.incremental import fold_new_events
+
+
+class Command(BaseCommand):
+    help = "Fold ItemView and Rental rows created since the last run into the daily stat tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep running, folding every --interval seconds.")
+        parser.add_argument('--interval', type=float, default=60, help="Seconds between runs with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            folded = fold_new_events()
+            if folded:
+                self.stdout.write(f"Folded {folded['itemview']} view(s) and {folded['rental']} rental(s).")
+            else:
+                self.stdout.write("Initialized the stats watermarks.")
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
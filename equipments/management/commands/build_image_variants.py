@@ -0,0 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from equipments.images import run_job
+from equipments.models import EquipmentImage
+
+
+class Command(BaseCommand):
+    help = "Build the thumbnail and WebP sizes of the equipment images that have none yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Rebuild the variants of every image.")
+        parser.add_argument('--workers', type=int, default=4, help="Images processed in parallel.")
+
+    def handle(self, *args, **options):
+        images = EquipmentImage.objects.order_by('id')
+        if not options['all']:
+            images = images.filter(variants={})
+        image_ids = list(images.values_list('id', flat=True))
+        with ThreadPoolExecutor(options['workers']) as executor:
+            list(executor.map(run_job, image_ids))
+        built = EquipmentImage.objects.filter(id__in=image_ids).exclude(variants={}).count()
+        self.stdout.write(self.style.SUCCESS(f"Built the variants of {built} of {len(image_ids)} image(s)."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from equipments.related import build_related
+
+
+class Command(BaseCommand):
+    help = "Recompute the related items of every item from the co-views and co-favorites of their users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, help="Related items stored per item, default RELATED_ITEMS['TOP_K'].")
+        parser.add_argument('--days', type=int, help="Days of item views considered, default RELATED_ITEMS['DAYS'].")
+
+    def handle(self, *args, **options):
+        items = build_related(top_k=options['top_k'], days=options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Stored the related items of {items} item(s)."))
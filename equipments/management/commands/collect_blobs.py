@@ -0,0 +1,22 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from equipments.storage import collect_garbage, recount
+
+
+class Command(BaseCommand):
+    help = "Delete the uploaded files (blobs) no longer referenced by any contract or equipment image."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=float, default=1,
+            help="Keep unreferenced blobs younger than this, as their upload may still be committing.",
+        )
+        parser.add_argument('--recount', action='store_true', help="Recompute the refcounts from the tables first.")
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.stdout.write(f"Fixed the refcount of {recount()} blob(s).")
+        blobs, size = collect_garbage(datetime.timedelta(hours=options['grace_hours']))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {blobs} blob(s), {size} byte(s)."))
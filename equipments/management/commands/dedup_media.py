@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from equipments.storage import acquire, blob_storage, is_blob, referencing_fields
+
+
+class Command(BaseCommand):
+    help = "Move the files uploaded before content-addressed storage into blobs, storing duplicates once."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--purge-orphans', action='store_true',
+            help="Also delete the old-style files of the upload directories that no row references.",
+        )
+
+    def handle(self, *args, **options):
+        moved = missing = 0
+        directories = set()
+        for model, field in referencing_fields():
+            directories.add(model._meta.get_field(field).upload_to.rstrip('/'))
+            names = (
+                model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                .order_by().values_list(field, flat=True).distinct()
+            )
+            for name in [name for name in names if not is_blob(name)]:
+                if not blob_storage.exists(name):
+                    missing += 1
+                    self.stderr.write(f"Missing file {name}, left as is.")
+                    continue
+                with blob_storage.open(name) as content:
+                    blob_name = blob_storage.save(name, content)
+                with transaction.atomic():
+                    count = model.objects.filter(**{field: name}).update(**{field: blob_name})
+                    acquire(blob_name, count)
+                blob_storage.delete(name)
+                moved += 1
+
+        purged = 0
+        if options['purge_orphans']:
+            referenced = {
+                name
+                for model, field in referencing_fields()
+                for name in model.objects.values_list(field, flat=True)
+            }
+            for directory in directories:
+                if not blob_storage.exists(directory):
+                    continue
+                _, files = blob_storage.listdir(directory)
+                for file_name in files:
+                    name = f'{directory}/{file_name}'
+                    if not file_name.startswith('.') and name not in referenced:
+                        blob_storage.delete(name)
+                        purged += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved} file(s) into blobs, {missing} missing, {purged} orphan(s) deleted."
+        ))
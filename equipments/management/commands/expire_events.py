@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from equipments.partitions import ensure_partitions, expire, retention_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the coming monthly partitions of the tracking event tables and remove the expired ones, "
+        "rolling their item views up into the daily stat tables first."
+    )
+
+    def add_arguments(self, parser):
+        config = retention_settings()
+        parser.add_argument(
+            '--keep-months', type=int, default=config['KEEP_MONTHS'],
+            help="Full months of events kept before the current one.",
+        )
+        parser.add_argument(
+            '--ahead', type=int, default=config['MONTHS_AHEAD'],
+            help="Months after the current one to create partitions for.",
+        )
+        parser.add_argument(
+            '--detach', action='store_true',
+            help="Detach the expired partitions, leaving them as tables to archive, instead of dropping them.",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Only list the partitions that would be removed.")
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            for name in ensure_partitions(options['ahead']):
+                self.stdout.write(f"Created {name}.")
+        report = expire(options['keep_months'], detach_only=options['detach'], dry_run=options['dry_run'])
+        for name, outcome in report:
+            self.stdout.write(f"{name}: {outcome}")
+        removed = sum(outcome in ('detached', 'dropped') for _, outcome in report)
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} partition(s)."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from equipments.outbox import OutboxPublisher
+
+
+class Command(BaseCommand):
+    help = "Publish the events stored in the outbox to RabbitMQ, over one connection with publisher confirms."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Stop once no event is due instead of polling.")
+        parser.add_argument('--batch-size', type=int, help="Events published per transaction.")
+
+    def handle(self, *args, **options):
+        config = {'BATCH_SIZE': options['batch_size']} if options['batch_size'] else {}
+        publisher = OutboxPublisher(**config)
+        try:
+            publisher.run(once=options['once'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            publisher.close()
+            stats = publisher.stats
+            self.stdout.write(
+                f"Published {stats['published']} event(s), rescheduled {stats['retried']}, "
+                f"gave up on {stats['failed']}."
+            )
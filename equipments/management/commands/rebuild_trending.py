@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from equipments.trending import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the trending score of every item from ItemView, CartActivity, Favorite and Rental."
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f"Rescored {rebuild()} item(s)."))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from equipments.counters import reconcile
+from equipments.models import Stuff
+
+
+class Command(BaseCommand):
+    help = "Recompute Stuff counters from Review, ItemView, Favorite and Rental and fix any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Number of consecutive Stuff ids repaired per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Stuff.objects.aggregate(last=Max('id'))['last'] or 0
+        repaired = 0
+        for start in range(1, last_id + 1, batch_size):
+            with transaction.atomic():
+                repaired += reconcile(Stuff.objects.filter(id__gte=start, id__lt=start + batch_size))
+        self.stdout.write(self.style.SUCCESS(f"Repaired counters on {repaired} item(s)."))
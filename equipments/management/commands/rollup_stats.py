@@ -0,0 +1,58 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from equipments.rollups import days_between, first_retained_day, rollup_range
+
+
+def _date(value):
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+def _rollup_day(day):
+    try:
+        return day, rollup_range(day, day)
+    finally:
+        # Worker threads own their connection; don't leave it open.
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Recompute SiteStat, TrafficSource, DeviceStat and CategoryStat for a date range."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', type=_date, help="First day (YYYY-MM-DD), default today.")
+        parser.add_argument('--to', dest='end', type=_date, help="Last day (YYYY-MM-DD), default --from.")
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help="Days processed in parallel. 1 rolls up the whole range in a single pass.",
+        )
+
+    def handle(self, *args, **options):
+        start = options['start'] or timezone.localdate()
+        end = options['end'] or start
+        if end < start:
+            raise CommandError("--to must not be before --from.")
+
+        if options['workers'] <= 1:
+            rolled = rollup_range(start, end)
+        else:
+            rolled = 0
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                for day, count in pool.map(_rollup_day, days_between(start, end)):
+                    rolled += count
+                    if count:
+                        self.stdout.write(f"Rolled up {day.isoformat()}")
+        total = (end - start + datetime.timedelta(days=1)).days
+        if rolled < total:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {total - rolled} day(s) before {first_retained_day()}: their events have expired."
+            ))
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {rolled} day(s) from {start} to {end}."))
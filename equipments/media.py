@@ -0,0 +1,161 @@
+"""
+Serving of the uploaded files (contracts, equipment images and their variants).
+
+Only the upload directories listed in MEDIA_SERVING['PREFIXES'] are served,
+never the rest of MEDIA_ROOT. Responses carry an ETag and Last-Modified and
+answer conditional requests with 304. Content-addressed blobs (see
+equipments.storage) never change, so they are cached as immutable; other
+files are revalidated after MAX_AGE seconds. Configured through the
+MEDIA_SERVING setting:
+
+    MEDIA_SERVING = {
+        'PREFIXES': ['contracts/', 'equipment_images/'],
+        'MAX_AGE': 3600,                     # seconds, for files that can change
+        'ACCEL_REDIRECT': '/protected-media/',  # hand the body to nginx
+    }
+
+With ACCEL_REDIRECT set, the worker only checks the request and adds the
+caching headers: nginx streams the file from an internal location mapped
+to MEDIA_ROOT (and handles Range itself). Otherwise whole files go through
+FileResponse, which the WSGI server can send with sendfile(), and single
+byte ranges are streamed from the requested offset.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .storage import is_blob
+
+DEFAULTS = {
+    'PREFIXES': ['contracts/', 'equipment_images/'],
+    'MAX_AGE': 3600,
+    'ACCEL_REDIRECT': None,
+}
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+CHUNK_SIZE = 64 * 1024
+
+
+def media_settings():
+    return {**DEFAULTS, **getattr(settings, 'MEDIA_SERVING', {})}
+
+
+def media_pattern():
+    """URL regex matching the served upload directories under MEDIA_URL."""
+    prefixes = '|'.join(re.escape(prefix) for prefix in media_settings()['PREFIXES'])
+    return rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>(?:{prefixes}).+)$'
+
+
+def _validators(path, file_stat):
+    if is_blob(path):
+        # The name is the SHA-256 of the content: a strong validator.
+        etag = '"%s"' % os.path.splitext(os.path.basename(path))[0]
+    else:
+        etag = 'W/"%x-%x"' % (file_stat.st_mtime_ns, file_stat.st_size)
+    return etag, int(file_stat.st_mtime)
+
+
+def _byte_range(request, etag, last_modified, size):
+    """
+    The (first, last) byte positions requested by a single-range Range header,
+    None to send the whole file, or 'unsatisfiable'. If-Range only lets the
+    range through on an exact match of a strong ETag or of Last-Modified.
+    """
+    match = _RANGE.match(request.headers.get('Range', '').strip())
+    if not match or size == 0:
+        return None
+    if_range = request.headers.get('If-Range', '').strip()
+    if if_range.startswith(('"', 'W/')):
+        if if_range != etag or etag.startswith('W/'):
+            return None
+    elif if_range and parse_http_date_safe(if_range) != last_modified:
+        return None
+    first, last = match.groups()
+    if first:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+        if first > last or first >= size:
+            return 'unsatisfiable'
+    elif last:
+        if int(last) == 0:
+            return 'unsatisfiable'
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        return None
+    return first, last
+
+
+def _read_range(path, first, length):
+    with open(path, 'rb') as handle:
+        handle.seek(first)
+        while length > 0:
+            chunk = handle.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _with_headers(response, headers):
+    for name, value in headers.items():
+        response[name] = value
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    config = media_settings()
+    path = posixpath.normpath(path).lstrip('/')
+    if not any(path.startswith(prefix) for prefix in config['PREFIXES']):
+        raise Http404
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        file_stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404
+
+    etag, last_modified = _validators(path, file_stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': IMMUTABLE if is_blob(path) else f"public, max-age={config['MAX_AGE']}",
+        'Accept-Ranges': 'bytes',
+    }
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return _with_headers(response, headers)
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if config['ACCEL_REDIRECT']:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = config['ACCEL_REDIRECT'].rstrip('/') + '/' + path
+    else:
+        size = file_stat.st_size
+        byte_range = _byte_range(request, etag, last_modified, size)
+        if byte_range == 'unsatisfiable':
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif byte_range:
+            first, last = byte_range
+            response = StreamingHttpResponse(
+                _read_range(full_path, first, last - first + 1), status=206, content_type=content_type,
+            )
+            response['Content-Range'] = f'bytes {first}-{last}/{size}'
+            response['Content-Length'] = str(last - first + 1)
+        else:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    return _with_headers(response, headers)
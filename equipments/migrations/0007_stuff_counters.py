@@ -0,0 +1,64 @@
+# Generated by Django 4.2.16 on 2026-10-18 15:57
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Stuff = apps.get_model('equipments', 'Stuff')
+
+    def per_stuff(model_name, aggregate, stuff_field='stuff', default=0):
+        model = apps.get_model('equipments', model_name)
+        grouped = model.objects.filter(**{stuff_field: OuterRef('pk')}).order_by().values(stuff_field)
+        return Coalesce(Subquery(grouped.annotate(value=aggregate).values('value')), Value(default))
+
+    Stuff.objects.update(
+        num_views=per_stuff('ItemView', Count('id')),
+        num_favorites=per_stuff('Favorite', Count('id')),
+        num_rentals=per_stuff('Rental', Count('id')),
+        num_reviews=per_stuff('Review', Count('id'), 'product'),
+        rating_sum=per_stuff('Review', Sum('rating'), 'product'),
+        avg_rating=per_stuff('Review', Avg('rating', output_field=FloatField()), 'product', 0.0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0006_stuff_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stuff',
+            name='avg_rating',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='stuff',
+            name='num_favorites',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='stuff',
+            name='num_rentals',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='stuff',
+            name='num_reviews',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='stuff',
+            name='num_views',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='stuff',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0007_stuff_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='itemview',
+            index=models.Index(fields=['timestamp'], name='itemview_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='itemview',
+            index=models.Index(fields=['stuff', 'user', 'timestamp'], name='itemview_attribution_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['created_at'], name='rental_created_at_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0008_stats_rollup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='visitor',
+            name='last_visit',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='SeenVisitor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('dimension', models.CharField(max_length=10)),
+                ('value', models.CharField(max_length=20)),
+                ('user', models.CharField(max_length=255)),
+            ],
+            options={
+                'unique_together': {('date', 'dimension', 'value', 'user')},
+            },
+        ),
+    ]
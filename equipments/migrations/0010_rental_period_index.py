@@ -0,0 +1,36 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:03
+
+import logging
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import equipments.models
+
+logger = logging.getLogger(__name__)
+
+
+def swap_inverted_dates(apps, schema_editor):
+    """daterange() rejects an end before the start: swap the dates of such rentals."""
+    Rental = apps.get_model('equipments', 'Rental')
+    for rental in Rental.objects.filter(end_date__lt=models.F('start_date')):
+        logger.warning(
+            "Rental %s: end_date %s before start_date %s, swapped", rental.pk, rental.end_date, rental.start_date,
+        )
+        Rental.objects.filter(pk=rental.pk).update(start_date=rental.end_date, end_date=rental.start_date)
+    # Run the deferred foreign key checks now: the table is indexed next.
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0009_stats_watermarks'),
+    ]
+
+    operations = [
+        migrations.RunPython(swap_inverted_dates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='rental',
+            index=django.contrib.postgres.indexes.GistIndex(equipments.models.DateRange('start_date', 'end_date', models.Value('[)')), condition=models.Q(('status', 'cancelled'), _negated=True), name='rental_period_gist'),
+        ),
+    ]
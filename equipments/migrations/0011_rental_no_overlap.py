@@ -0,0 +1,57 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:04
+
+import logging
+
+import django.contrib.postgres.constraints
+from django.db import migrations, models
+import equipments.models
+
+logger = logging.getLogger(__name__)
+
+# Statuses holding the item, as in equipments.models.BOOKED_STATUSES.
+BOOKED_STATUSES = ['pending', 'confirmed', 'active']
+
+
+def repair_rentals(apps, schema_editor):
+    """
+    Make the existing rentals satisfy rental_no_overlap: of live rentals
+    overlapping on the same item, the ones booked later are cancelled.
+    Inverted periods were already repaired by migration 0010.
+    """
+    Rental = apps.get_model('equipments', 'Rental')
+    cancelled = []
+    kept = {}
+    live = Rental.objects.filter(status__in=BOOKED_STATUSES, end_date__gt=models.F('start_date'))
+    for rental in live.order_by('stuff_id', 'created_at', 'id').iterator():
+        periods = kept.setdefault(rental.stuff_id, [])
+        clash = next((pk for pk, start, end in periods if start < rental.end_date and rental.start_date < end), None)
+        if clash is None:
+            periods.append((rental.pk, rental.start_date, rental.end_date))
+            continue
+        logger.warning(
+            "Rental %s of item %s (%s to %s) overlaps rental %s booked before it, cancelled",
+            rental.pk, rental.stuff_id, rental.start_date, rental.end_date, clash,
+        )
+        cancelled.append(rental.pk)
+    Rental.objects.filter(pk__in=cancelled).update(status='cancelled')
+    # Run the deferred foreign key checks now: the table is altered next.
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0010_rental_period_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(repair_rentals, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rental',
+            constraint=models.CheckConstraint(check=models.Q(('end_date__gte', models.F('start_date'))), name='rental_dates_ordered'),
+        ),
+        migrations.AddConstraint(
+            model_name='rental',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('status__in', ['pending', 'confirmed', 'active'])), expressions=[(equipments.models.Int8Range('stuff', 'stuff', models.Value('[]')), '='), (equipments.models.DateRange('start_date', 'end_date', models.Value('[)')), '&&')], name='rental_no_overlap'),
+        ),
+    ]
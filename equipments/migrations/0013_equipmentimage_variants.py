@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0012_outbox_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipmentimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
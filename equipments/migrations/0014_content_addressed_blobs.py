@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:12
+
+from django.db import migrations, models
+import django.utils.timezone
+import equipments.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0013_equipmentimage_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='equipmentimage',
+            name='url',
+            field=models.ImageField(storage=equipments.storage.ContentAddressedStorage(), upload_to='equipment_images/'),
+        ),
+        migrations.AlterField(
+            model_name='stuffmanagement',
+            name='contract_required',
+            field=models.FileField(blank=True, null=True, storage=equipments.storage.ContentAddressedStorage(), upload_to='contracts/'),
+        ),
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('sha256', models.CharField(max_length=64)),
+                ('size', models.BigIntegerField()),
+                ('refcount', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['refcount', 'last_used_at'], name='blob_unreferenced_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0014_content_addressed_blobs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cartactivity',
+            index=models.Index(fields=['timestamp'], name='cartactivity_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['created_at', 'id'], name='review_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stuff',
+            index=models.Index(fields=['created_at', 'id'], name='stuff_created_at_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:16
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Stuff.search_vector is computed by the database so every write path (ORM,
+# bulk updates, raw SQL) keeps it current. A category rename re-touches its items.
+SEARCH_TRIGGERS = """
+CREATE FUNCTION equipments_stuff_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.stuffname, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.brand, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(
+            (SELECT name FROM equipments_category WHERE id = NEW.category_id), '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(NEW.short_description, '')), 'C') ||
+        setweight(to_tsvector('simple', coalesce(NEW.detailed_description, '')), 'D');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER stuff_search_vector
+    BEFORE INSERT OR UPDATE OF stuffname, brand, category_id, short_description, detailed_description
+    ON equipments_stuff FOR EACH ROW EXECUTE FUNCTION equipments_stuff_search_vector();
+
+CREATE FUNCTION equipments_category_search_vector() RETURNS trigger AS $$
+BEGIN
+    UPDATE equipments_stuff SET category_id = category_id WHERE category_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER category_search_vector
+    AFTER UPDATE OF name ON equipments_category FOR EACH ROW
+    WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION equipments_category_search_vector();
+
+UPDATE equipments_stuff SET stuffname = stuffname;
+"""
+
+DROP_SEARCH_TRIGGERS = """
+DROP TRIGGER category_search_vector ON equipments_category;
+DROP FUNCTION equipments_category_search_vector();
+DROP TRIGGER stuff_search_vector ON equipments_stuff;
+DROP FUNCTION equipments_stuff_search_vector();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0015_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stuff',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='stuff',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='stuff_search_idx'),
+        ),
+        migrations.RunSQL(SEARCH_TRIGGERS, DROP_SEARCH_TRIGGERS),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+# Every write of an item records the id of its transaction, and every delete
+# leaves a tombstone, whatever the write path (ORM, bulk updates, raw SQL).
+CHANGE_TRIGGERS = """
+CREATE FUNCTION equipments_stuff_change_txid() RETURNS trigger AS $$
+BEGIN
+    NEW.change_txid := pg_current_xact_id()::text::bigint;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER stuff_change_txid
+    BEFORE INSERT OR UPDATE ON equipments_stuff
+    FOR EACH ROW EXECUTE FUNCTION equipments_stuff_change_txid();
+
+CREATE FUNCTION equipments_stuff_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO equipments_stufftombstone (stuff_id, change_txid, deleted_at)
+    VALUES (OLD.id, pg_current_xact_id()::text::bigint, now())
+    ON CONFLICT (stuff_id) DO UPDATE
+        SET change_txid = EXCLUDED.change_txid, deleted_at = EXCLUDED.deleted_at;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER stuff_tombstone
+    AFTER DELETE ON equipments_stuff
+    FOR EACH ROW EXECUTE FUNCTION equipments_stuff_tombstone();
+
+UPDATE equipments_stuff SET change_txid = pg_current_xact_id()::text::bigint;
+"""
+
+DROP_CHANGE_TRIGGERS = """
+DROP TRIGGER stuff_tombstone ON equipments_stuff;
+DROP FUNCTION equipments_stuff_tombstone();
+DROP TRIGGER stuff_change_txid ON equipments_stuff;
+DROP FUNCTION equipments_stuff_change_txid();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0017_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stuff',
+            name='change_txid',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='StuffTombstone',
+            fields=[
+                ('stuff_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('change_txid', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['change_txid', 'stuff_id'], name='stufftombstone_change_idx')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stuff',
+            index=models.Index(fields=['change_txid', 'id'], name='stuff_change_idx'),
+        ),
+        migrations.RunSQL(CHANGE_TRIGGERS, DROP_CHANGE_TRIGGERS),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 4.2.16 on 2026-10-18 20:02
+
+import datetime
+import re
+
+from django.db import migrations
+
+# ItemView and CartActivity become tables range-partitioned on timestamp by
+# month (see equipments/partitions.py), with a partition for every month
+# holding rows, the current month and the next MONTHS_AHEAD ones, and a
+# default partition. PostgreSQL 16 has no identity columns on partitioned
+# tables, so ids come from a plain sequence owned by the column. The model
+# state does not change.
+TABLES = ('equipments_itemview', 'equipments_cartactivity')
+MONTHS_AHEAD = 3
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def _utc(month):
+    return datetime.datetime(month.year, month.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def _rebuild(cursor, table, partitioned):
+    """Recreate table, partitioned or not, with its rows, indexes and foreign keys."""
+    legacy = f'{table}_legacy'
+    cursor.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+    cursor.execute('SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s', [legacy, f'{table}_pkey'])
+    indexes = [
+        re.sub(rf' ON (?:ONLY )?(?:\S+\.)?{legacy} ', f' ON {table} ', definition)
+        for definition, in cursor.fetchall()
+    ]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [legacy],
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute(f'SELECT min("timestamp"), coalesce(max(id), 0) FROM {legacy}')
+    oldest, last_id = cursor.fetchone()
+
+    if partitioned:
+        cursor.execute(f'CREATE TABLE {table} (LIKE {legacy}) PARTITION BY RANGE ("timestamp")')
+        now = datetime.datetime.now(datetime.timezone.utc).date().replace(day=1)
+        month = min(oldest.astimezone(datetime.timezone.utc).date().replace(day=1), now) if oldest else now
+        while month <= _add_months(now, MONTHS_AHEAD):
+            cursor.execute(
+                f'CREATE TABLE {table}_p{month:%Y_%m} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)',
+                [_utc(month), _utc(_add_months(month, 1))],
+            )
+            month = _add_months(month, 1)
+        cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+    else:
+        cursor.execute(f'CREATE TABLE {table} (LIKE {legacy})')
+    cursor.execute(f'INSERT INTO {table} SELECT * FROM {legacy}')
+    # Dropping the old table frees the names of its constraints, indexes and sequence.
+    cursor.execute(f'DROP TABLE {legacy} CASCADE')
+
+    if partitioned:
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, "timestamp")')
+        cursor.execute(f'CREATE SEQUENCE {table}_id_seq OWNED BY {table}.id')
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')")
+        cursor.execute(f"SELECT setval('{table}_id_seq', %s, %s)", [max(last_id, 1), last_id > 0])
+    else:
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)')
+        cursor.execute(f'ALTER TABLE {table} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY')
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), %s, %s)", [max(last_id, 1), last_id > 0])
+    for definition in indexes:
+        cursor.execute(definition)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+
+
+def partition(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            _rebuild(cursor, table, partitioned=True)
+
+
+def unpartition(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            _rebuild(cursor, table, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0018_stuff_change_feed'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
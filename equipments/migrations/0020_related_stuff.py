@@ -0,0 +1,31 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0019_partition_tracking_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedStuff',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_to', to='equipments.stuff')),
+                ('stuff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_items', to='equipments.stuff')),
+            ],
+            options={
+                'ordering': ['stuff', 'rank'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='relatedstuff',
+            constraint=models.UniqueConstraint(fields=('stuff', 'rank'), name='relatedstuff_rank_uniq'),
+        ),
+    ]
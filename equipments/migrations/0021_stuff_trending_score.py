@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0020_related_stuff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stuff',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='stuff',
+            index=models.Index(fields=['trending_score', 'id'], name='stuff_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stuff',
+            index=models.Index(fields=['category', 'trending_score', 'id'], name='stuff_category_trending_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0021_stuff_trending_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('dimension', models.CharField(max_length=10)),
+                ('value', models.CharField(blank=True, default='', max_length=20)),
+                ('registers', models.BinaryField()),
+            ],
+            options={
+                'unique_together': {('date', 'dimension', 'value')},
+            },
+        ),
+    ]
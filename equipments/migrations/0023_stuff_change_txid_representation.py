@@ -0,0 +1,47 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:12
+
+from django.db import migrations
+
+# Columns written on every tracking event or by other triggers, which don't
+# put the item back in the change feed: the denormalized counters, the
+# trending score, the search vector and change_txid itself. Any other column,
+# including updated_at (moved when the item's images or management row
+# change) and columns added later, does.
+VOLATILE_COLUMNS = (
+    'num_views', 'num_favorites', 'num_rentals', 'num_reviews', 'rating_sum', 'avg_rating',
+    'trending_score', 'search_vector', 'change_txid',
+)
+
+CHANGE_TXID_FUNCTION = """
+CREATE OR REPLACE FUNCTION equipments_stuff_change_txid() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND to_jsonb(NEW) - %(volatile)s::text[] = to_jsonb(OLD) - %(volatile)s::text[] THEN
+        NEW.change_txid := OLD.change_txid;
+    ELSE
+        NEW.change_txid := pg_current_xact_id()::text::bigint;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+""" % {'volatile': "'{" + ','.join(VOLATILE_COLUMNS) + "}'"}
+
+PREVIOUS_CHANGE_TXID_FUNCTION = """
+CREATE OR REPLACE FUNCTION equipments_stuff_change_txid() RETURNS trigger AS $$
+BEGIN
+    NEW.change_txid := pg_current_xact_id()::text::bigint;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0022_visitor_sketch'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CHANGE_TXID_FUNCTION, PREVIOUS_CHANGE_TXID_FUNCTION),
+    ]
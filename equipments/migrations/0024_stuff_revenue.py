@@ -0,0 +1,54 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:51
+
+from django.db import migrations, models
+
+# revenue is a counter like those of migration 0023: updating it must not put
+# the item back in the change feed.
+PREVIOUS_VOLATILE_COLUMNS = (
+    'num_views', 'num_favorites', 'num_rentals', 'num_reviews', 'rating_sum', 'avg_rating',
+    'trending_score', 'search_vector', 'change_txid',
+)
+VOLATILE_COLUMNS = PREVIOUS_VOLATILE_COLUMNS + ('revenue',)
+
+CHANGE_TXID_FUNCTION = """
+CREATE OR REPLACE FUNCTION equipments_stuff_change_txid() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND to_jsonb(NEW) - %(volatile)s::text[] = to_jsonb(OLD) - %(volatile)s::text[] THEN
+        NEW.change_txid := OLD.change_txid;
+    ELSE
+        NEW.change_txid := pg_current_xact_id()::text::bigint;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+FILL_REVENUE = """
+UPDATE equipments_stuff s SET revenue = r.total
+FROM (SELECT stuff_id, SUM(total_price) AS total FROM equipments_rental GROUP BY stuff_id) r
+WHERE r.stuff_id = s.id
+"""
+
+
+def _change_txid_function(columns):
+    return CHANGE_TXID_FUNCTION % {'volatile': "'{" + ','.join(columns) + "}'"}
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0023_stuff_change_txid_representation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stuff',
+            name='revenue',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunSQL(
+            _change_txid_function(VOLATILE_COLUMNS), _change_txid_function(PREVIOUS_VOLATILE_COLUMNS),
+        ),
+        migrations.RunSQL(FILL_REVENUE, migrations.RunSQL.noop),
+    ]
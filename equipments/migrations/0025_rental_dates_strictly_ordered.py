@@ -0,0 +1,43 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:57
+
+from django.db import migrations, models
+
+# Rentals ending the day they start have an empty [start_date, end_date)
+# period: they occupy no day and escape rental_no_overlap. They become
+# one-day rentals, the ones whose day another live rental already holds
+# being cancelled first so the exclusion constraint keeps holding.
+FIX_EMPTY_RENTALS = """
+UPDATE equipments_rental r SET status = 'cancelled'
+WHERE r.end_date = r.start_date AND r.status IN ('pending', 'confirmed', 'active')
+  AND EXISTS (
+      SELECT 1 FROM equipments_rental other
+      WHERE other.stuff_id = r.stuff_id AND other.id <> r.id
+        AND other.status IN ('pending', 'confirmed', 'active')
+        AND (
+            (other.start_date <= r.start_date AND other.end_date > r.start_date)
+            OR (other.start_date = r.start_date AND other.end_date = r.start_date AND other.id < r.id)
+        )
+  );
+UPDATE equipments_rental SET end_date = start_date + 1 WHERE end_date = start_date;
+-- Run the deferred foreign key checks now: the table is altered next.
+SET CONSTRAINTS ALL IMMEDIATE;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('equipments', '0024_stuff_revenue'),
+    ]
+
+    operations = [
+        migrations.RunSQL(FIX_EMPTY_RENTALS, migrations.RunSQL.noop),
+        migrations.RemoveConstraint(
+            model_name='rental',
+            name='rental_dates_ordered',
+        ),
+        migrations.AddConstraint(
+            model_name='rental',
+            constraint=models.CheckConstraint(check=models.Q(('end_date__gt', models.F('start_date'))), name='rental_dates_ordered'),
+        ),
+    ]
@@ -1,9 +1,59 @@
-from django.db import models
-from django.db.models import Sum, Avg, Count
+import datetime
+import re
+
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import BigIntegerRangeField, DateRangeField, RangeOperators
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, models
+from django.db.models import Sum, Avg, Count, Case, When, Exists, F, FloatField, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast, Coalesce
 from django.utils import timezone
 
+from .storage import blob_storage
+
+
+def _as_datetime(value):
+    """Return an aware datetime for a date or datetime bound."""
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return timezone.make_aware(datetime.datetime.combine(value, datetime.time.min))
+
+
+class DateRange(models.Func):
+    """Postgres daterange(lower, upper, bounds)."""
+    function = 'daterange'
+    output_field = DateRangeField()
+
+
+class Int8Range(models.Func):
+    """Postgres int8range(lower, upper, bounds)."""
+    function = 'int8range'
+    output_field = BigIntegerRangeField()
+
+
+def rental_period():
+    """
+    The days a rental occupies its item: start_date included, end_date
+    excluded, matching Rental.duration. Indexed by rental_period_gist.
+    """
+    return DateRange('start_date', 'end_date', Value('[)'))
+
+
+def _metric_subquery(queryset, aggregate, output_field, stuff_field='stuff'):
+    """Correlate a per-stuff grouped aggregate with the outer Stuff row."""
+    grouped = queryset.filter(**{stuff_field: OuterRef('pk')}).order_by().values(stuff_field)
+    return Coalesce(
+        Subquery(grouped.annotate(value=aggregate).values('value'), output_field=output_field),
+        Value(0),
+        output_field=output_field,
+    )
+
+
 class Category(models.Model):
     name = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -27,19 +77,261 @@ class StuffManagement(models.Model):
     availability = models.CharField(max_length=255, blank=True, null=True)
     rental_zone = models.CharField(max_length=255, blank=True, null=True)
     location = models.CharField(max_length=255, blank=True, null=True)
-    contract_required = models.FileField(upload_to='contracts/', blank=True, null=True)
+    contract_required = models.FileField(upload_to='contracts/', storage=blob_storage, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
-    def utilization_rate(self):
-        # Calculate what percentage of time this equipment is rented
-        rented_days = self.rental_set.filter(
-            start_date__lte=timezone.now(),
-            end_date__gte=timezone.now()
-        ).aggregate(total_days=Sum('duration'))['total_days'] or 0
-        total_days = (timezone.now() - self.created_at).days
-        return (rented_days / total_days) * 100 if total_days > 0 else 0
+    def utilization_rate(self, start=None, end=None):
+        """Percentage of the days start..end (default: the last 365) its items were rented."""
+        from .utilization import fleet_utilization
+        end = end or timezone.localdate()
+        start = start or end - datetime.timedelta(days=364)
+        return fleet_utilization(start, end, self.managed_stuffs.all())['fleet']['utilization']
+
+# Text search configuration of Stuff.search_vector: no stemming, as listings
+# mix French, Arabic and English.
+SEARCH_CONFIG = 'simple'
+
+# Annotation names added by StuffQuerySet.with_metrics(); all of them can be used with order_by().
+STUFF_METRICS = ('rentals_count', 'revenue_total', 'rating_avg', 'views_count', 'conversion_pct')
+
+# Dimensions counted by StuffQuerySet.facets(), and the default upper bounds
+# of its price_per_day buckets (the last bucket is open-ended).
+FACET_DIMENSIONS = ('category', 'brand', 'rental_zone', 'state', 'price')
+PRICE_BUCKETS = (10, 25, 50, 100, 250)
+
+# Groupings of StuffQuerySet.funnel(): the grouping key and its label. Cart
+# activity is recorded per visitor session, which carries no traffic source
+# or device, so the source and device funnels have no cart stage.
+FUNNEL_DIMENSIONS = {
+    'stuff': ('e.stuff_id', 'items.stuffname'),
+    'category': ('items.category_id', 'items.category_name'),
+    'source': ('e.source', None),
+    'device': ('e.device_type', None),
+}
+FUNNEL_STAGES = ('views', 'cart_adds', 'rentals')
+
+
+class StuffQuerySet(models.QuerySet):
+    def with_metrics(self, since=None, until=None):
+        """
+        Annotate every item with its rental, revenue, rating, view and conversion
+        metrics for the half-open period [since, until), in a single query.
+        Bounds may be dates or datetimes; either may be omitted.
+        """
+        since, until = _as_datetime(since), _as_datetime(until)
+        rentals = Rental.objects.all()
+        views = ItemView.objects.all()
+        reviews = Review.objects.all()
+        if since is not None:
+            rentals = rentals.filter(created_at__gte=since)
+            views = views.filter(timestamp__gte=since)
+            reviews = reviews.filter(created_at__gte=since.date())
+        if until is not None:
+            rentals = rentals.filter(created_at__lt=until)
+            views = views.filter(timestamp__lt=until)
+            reviews = reviews.filter(created_at__lt=until.date())
+
+        return self.annotate(
+            rentals_count=_metric_subquery(rentals, Count('id'), models.IntegerField()),
+            revenue_total=_metric_subquery(rentals, Sum('total_price'), FloatField()),
+            rating_avg=_metric_subquery(reviews, Avg('rating'), FloatField(), 'product'),
+            views_count=_metric_subquery(views, Count('id'), models.IntegerField()),
+        ).annotate(
+            conversion_pct=Case(
+                When(views_count__gt=0, then=Cast('rentals_count', FloatField()) * 100 / F('views_count')),
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+        )
+
+
+    def available_between(self, start, end):
+        """
+        Items with no non-cancelled rental overlapping the days start..end
+        (both included), leaving out items manually marked unavailable.
+        """
+        overlapping = Rental.objects.exclude(status='cancelled').alias(period=rental_period()).filter(
+            stuff=OuterRef('pk'),
+            period__overlap=DateRange(Value(start), Value(end), Value('[]')),
+        )
+        return self.exclude(stuff_management__availability='Unavailable').filter(~Exists(overlapping))
+
+    def search(self, text):
+        """
+        Items matching every word of text (the last one as a prefix, for
+        search-as-you-type), annotated with their search_rank.
+        """
+        words = re.findall(r'[^\W_]+', text.lower())
+        if not words:
+            return self.none()
+        terms = [f"'{word}'" for word in words]
+        terms[-1] += ':*'
+        query = SearchQuery(' & '.join(terms), search_type='raw', config=SEARCH_CONFIG)
+        # ts_rank() is a float4: widen it so the value read back (e.g. into a
+        # pagination cursor) compares equal to the one in the database.
+        rank = Cast(SearchRank(F('search_vector'), query), FloatField())
+        return self.filter(search_vector=query).annotate(search_rank=rank)
+
+    def touch(self):
+        """Mark the items as changed, e.g. when one of their images or their management row is."""
+        return self.update(updated_at=timezone.now())
+
+    def facets(self, price_buckets=PRICE_BUCKETS):
+        """
+        Number of items per category, brand, rental zone, state and price
+        bucket, in a single GROUPING SETS query over this queryset. Returns
+        {'total': n, dimension: [{'value': ..., 'count': n}, ...]} with the
+        values of each dimension most frequent first; categories also carry
+        their label, price buckets their [min, max) bounds.
+        """
+        price_bucket = Case(
+            *[When(price_per_day__lt=bound, then=Value(index)) for index, bound in enumerate(price_buckets)],
+            default=Value(len(price_buckets)),
+            output_field=IntegerField(),
+        )
+        rows = self.order_by().annotate(
+            facet_category=F('category_id'),
+            facet_category_label=F('category__name'),
+            facet_rental_zone=F('stuff_management__rental_zone'),
+            facet_price=price_bucket,
+        ).values('facet_category', 'facet_category_label', 'brand', 'facet_rental_zone', 'state', 'facet_price')
+        result = {'total': 0, **{dimension: [] for dimension in FACET_DIMENSIONS}}
+        try:
+            sql, params = rows.query.sql_with_params()
+        except EmptyResultSet:
+            return result
+
+        # GROUPING() sets the bit of every column a row is not grouped by,
+        # the first column being the most significant.
+        everything = (1 << len(FACET_DIMENSIONS)) - 1
+        grouped_by = {everything ^ (1 << (len(FACET_DIMENSIONS) - 1 - index)): index
+                      for index in range(len(FACET_DIMENSIONS))}
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(f"""
+                SELECT GROUPING(facet_category, brand, facet_rental_zone, state, facet_price),
+                       facet_category, facet_category_label, brand, facet_rental_zone, state, facet_price,
+                       COUNT(*)
+                FROM ({sql}) AS items
+                GROUP BY GROUPING SETS (
+                    (), (facet_category, facet_category_label), (brand), (facet_rental_zone), (state), (facet_price)
+                )
+            """, params)
+            for grouping, category, label, *values, count in cursor.fetchall():
+                if grouping == everything:
+                    result['total'] = count
+                    continue
+                index = grouped_by[grouping]
+                dimension = FACET_DIMENSIONS[index]
+                if dimension == 'category':
+                    entry = {'value': category, 'label': label}
+                elif dimension == 'price':
+                    bucket = values[-1]
+                    entry = {
+                        'value': bucket,
+                        'min': price_buckets[bucket - 1] if bucket else 0,
+                        'max': price_buckets[bucket] if bucket < len(price_buckets) else None,
+                    }
+                else:
+                    entry = {'value': values[index - 1]}
+                entry['count'] = count
+                result[dimension].append(entry)
+        for dimension in FACET_DIMENSIONS:
+            result[dimension].sort(key=lambda entry: (-entry['count'], entry['value'] is None, str(entry['value'])))
+        result['price'].sort(key=lambda entry: entry['value'])
+        return result
+
+    def funnel(self, since, until, by='category', limit=None):
+        """
+        The views -> cart adds -> rentals funnel of the items of this queryset
+        over [since, until), per FUNNEL_DIMENSIONS value of by, in a single
+        grouped query. Rentals are counted unless cancelled and attributed to
+        the source and device of the customer's last view of the item before
+        renting it (see RentalQuerySet.with_attribution()). Returns
+        {'totals': {...}, 'results': [{'value', 'label', stage counts,
+        'cart_rate', 'rental_rate', 'conversion_rate', 'share'}, ...]}, most
+        viewed first; share is the part of all views. limit keeps that many.
+        """
+        since, until = _as_datetime(since), _as_datetime(until)
+        key, label = FUNNEL_DIMENSIONS[by]
+        has_cart = by in ('stuff', 'category')
+        totals = dict.fromkeys(FUNNEL_STAGES, 0)
+        result = {'totals': totals, 'results': []}
+        items = self.order_by().annotate(category_name=F('category__name')).values(
+            'id', 'stuffname', 'category_id', 'category_name',
+        )
+        try:
+            items_sql, params = items.query.sql_with_params()
+        except EmptyResultSet:
+            return result
+
+        params = [*params, since, until]
+        cart_events = ''
+        if has_cart:
+            cart_events = f"""
+                UNION ALL
+                SELECT c.stuff_id, NULL, NULL, 2 FROM {CartActivity._meta.db_table} c
+                WHERE c.action = 'add' AND c.timestamp >= %s AND c.timestamp < %s
+            """
+            params += [since, until]
+        params += [since, until]
+        group = f'{key}, {label}' if label else key
+        ratio = 'ROUND((({0})::numeric / NULLIF({1}, 0)), 4)::float8'
+        sql = f"""
+            WITH items AS ({items_sql}),
+            events AS (
+                SELECT v.stuff_id, v.source, v.device_type, 1 AS stage FROM {ItemView._meta.db_table} v
+                WHERE v.timestamp >= %s AND v.timestamp < %s
+                {cart_events}
+                UNION ALL
+                SELECT r.stuff_id, touch.source, touch.device_type, 3 FROM {Rental._meta.db_table} r
+                LEFT JOIN LATERAL (
+                    SELECT v.source, v.device_type FROM {ItemView._meta.db_table} v
+                    WHERE v.stuff_id = r.stuff_id AND v."user" = r.customer::text AND v.timestamp <= r.created_at
+                    ORDER BY v.timestamp DESC LIMIT 1
+                ) touch ON true
+                WHERE r.status <> 'cancelled' AND r.created_at >= %s AND r.created_at < %s
+            ),
+            grouped AS (
+                SELECT GROUPING({key}) AS grouping, {key} AS value, {label or 'NULL'} AS label,
+                       COUNT(*) FILTER (WHERE e.stage = 1) AS views,
+                       COUNT(*) FILTER (WHERE e.stage = 2) AS cart_adds,
+                       COUNT(*) FILTER (WHERE e.stage = 3) AS rentals
+                FROM events e JOIN items ON items.id = e.stuff_id
+                GROUP BY GROUPING SETS (({group}), ())
+            )
+            SELECT grouping, value, label, views, cart_adds, rentals,
+                   {ratio.format('cart_adds', 'views')}, {ratio.format('rentals', 'cart_adds')},
+                   {ratio.format('rentals', 'views')},
+                   {ratio.format('views', 'MAX(views) FILTER (WHERE grouping > 0) OVER ()')}
+            FROM grouped
+            ORDER BY grouping DESC, views DESC, rentals DESC, value
+        """
+        if limit:
+            # The totals row comes first.
+            sql += ' LIMIT %s'
+            params.append(limit + 1)
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        for grouping, value, label, views, cart_adds, rentals, cart_rate, rental_rate, conversion, share in rows:
+            entry = {
+                'views': views,
+                'cart_adds': cart_adds if has_cart else None,
+                'rentals': rentals,
+                'cart_rate': cart_rate,
+                'rental_rate': rental_rate,
+                'conversion_rate': conversion,
+            }
+            if grouping:
+                totals.update(entry)
+            else:
+                result['results'].append({'value': value, 'label': label, **entry, 'share': share or 0.0})
+        return result
+
 
 class Stuff(models.Model):
     stuffname = models.CharField(max_length=100)
@@ -55,35 +347,104 @@ class Stuff(models.Model):
     stuff_management = models.ForeignKey(StuffManagement, null=True, blank=True, on_delete=models.SET_NULL, related_name='managed_stuffs')
     user = models.CharField(max_length=255,null=True)
     created_at = models.DateField(auto_now_add=True,null=True)
+    # Last change of the item's representation, including its management row
+    # and its images but not its counters: the Last-Modified of /api/stuffs/{id}/.
+    updated_at = models.DateTimeField(auto_now=True)
+    # Id of the last transaction that changed the item's representation (not
+    # its counters or trending score), set by a trigger: the position of the
+    # item in the change feed (see equipments/changes.py).
+    change_txid = models.BigIntegerField(null=True, editable=False)
+
+    # Denormalized counters, kept in step by equipments.counters and repaired
+    # in bulk by the reconcile_counters management command.
+    num_views = models.PositiveIntegerField(default=0, db_index=True)
+    num_favorites = models.PositiveIntegerField(default=0, db_index=True)
+    num_rentals = models.PositiveIntegerField(default=0, db_index=True)
+    num_reviews = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    avg_rating = models.FloatField(default=0, db_index=True)
+    # Sum of the total_price of the item's rentals.
+    revenue = models.FloatField(default=0)
+    # Time-decayed activity of the item, kept by equipments.trending: the
+    # higher, the hotter right now. Only comparable with other items' scores.
+    trending_score = models.FloatField(default=0, editable=False)
+
+    # Weighted name, brand, category and descriptions, maintained by a database
+    # trigger (see migration 0016) and queried by StuffQuerySet.search().
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = StuffQuerySet.as_manager()
 
     def __str__(self):
         return self.stuffname
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of the catalog: ORDER BY created_at DESC, id DESC.
+            models.Index(fields=['created_at', 'id'], name='stuff_created_at_idx'),
+            models.Index(fields=['change_txid', 'id'], name='stuff_change_idx'),
+            # ?ordering=trending, over the catalog or within a category.
+            models.Index(fields=['trending_score', 'id'], name='stuff_trending_idx'),
+            models.Index(fields=['category', 'trending_score', 'id'], name='stuff_category_trending_idx'),
+            GinIndex(fields=['search_vector'], name='stuff_search_idx'),
+        ]
+
+    # Only ever changed by UPDATEs with F() expressions (equipments.counters,
+    # equipments.trending): saving an instance loaded earlier would write its
+    # stale values back over the increments made since.
+    COUNTER_FIELDS = (
+        'num_views', 'num_favorites', 'num_rentals', 'num_reviews', 'rating_sum', 'avg_rating', 'revenue',
+        'trending_score',
+    )
+
+    def save(self, *args, **kwargs):
+        """Save the item; updates leave COUNTER_FIELDS out unless update_fields names them."""
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    # The methods below reuse the values annotated by Stuff.objects.with_metrics()
+    # when present, and fall back to the all-time counters otherwise.
 
     def total_rentals(self):
-        return self.rental_set.count()
+        if hasattr(self, 'rentals_count'):
+            return self.rentals_count
+        return self.num_rentals
 
     def total_revenue(self):
-        return self.rental_set.aggregate(total=Sum('total_price'))['total'] or 0
+        if hasattr(self, 'revenue_total'):
+            return self.revenue_total
+        return self.revenue
 
     def average_rating(self):
-        return self.reviews.aggregate(avg_rating=Avg('rating'))['avg_rating'] or 0
+        if hasattr(self, 'rating_avg'):
+            return self.rating_avg
+        return self.avg_rating
 
     def view_count(self):
-        return self.itemview_set.count()
+        if hasattr(self, 'views_count'):
+            return self.views_count
+        return self.num_views
 
     def conversion_rate(self):
+        if hasattr(self, 'conversion_pct'):
+            return self.conversion_pct
         views = self.view_count()
         rentals = self.total_rentals()
         return (rentals / views) * 100 if views > 0 else 0
 
 class EquipmentImage(models.Model):
     stuff = models.ForeignKey(Stuff, related_name='equipment_images',null=True, on_delete=models.CASCADE)
-    url = models.ImageField(upload_to='equipment_images/')
+    url = models.ImageField(upload_to='equipment_images/', storage=blob_storage)
     alt = models.CharField(max_length=255, blank=True, null=True)
     position = models.PositiveIntegerField()
+    # Resized WebP copies built by equipments.images: {label: {'name', 'width', 'height'}}.
+    variants = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Image {self.id} - Position {self.position}"
@@ -100,6 +461,10 @@ class Review(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # created_at is a date, so most pages break ties on id.
+            models.Index(fields=['created_at', 'id'], name='review_created_at_idx'),
+        ]
 
 # ====================== E-COMMERCE STATISTICS MODELS ======================
 
@@ -108,7 +473,7 @@ class Visitor(models.Model):
     ip_address = models.CharField(max_length=45)
     user_agent = models.TextField()
     first_visit = models.DateTimeField(auto_now_add=True)
-    last_visit = models.DateTimeField(auto_now=True)
+    last_visit = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Visitor {self.session_key}"
@@ -116,6 +481,8 @@ class Favorite(models.Model):
     stuff = models.ForeignKey(Stuff, on_delete=models.CASCADE)
     user = models.CharField(max_length=255,null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
+# ItemView and CartActivity are partitioned by month of timestamp, see
+# equipments/partitions.py.
 class ItemView(models.Model):
     stuff = models.ForeignKey(Stuff, on_delete=models.CASCADE)
     user = models.CharField(max_length=255,null=True)
@@ -136,6 +503,11 @@ class ItemView(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp'], name='itemview_timestamp_idx'),
+            # Last-touch attribution of rentals, see RentalQuerySet.with_attribution().
+            models.Index(fields=['stuff', 'user', 'timestamp'], name='itemview_attribution_idx'),
+        ]
 
 class CartActivity(models.Model):
     visitor = models.ForeignKey(Visitor, on_delete=models.CASCADE)
@@ -146,6 +518,33 @@ class CartActivity(models.Model):
     ])
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp'], name='cartactivity_timestamp_idx'),
+        ]
+
+# Rental statuses that hold the item's dates; two of them may never overlap.
+BOOKED_STATUSES = ['pending', 'confirmed', 'active']
+
+
+class RentalQuerySet(models.QuerySet):
+    def with_attribution(self):
+        """
+        Annotate each rental with the `source` and `device_type` of the customer's
+        last view of the rented item before the rental was created (last-touch
+        attribution). Both are None when no such view exists.
+        """
+        last_view = ItemView.objects.filter(
+            stuff=OuterRef('stuff'),
+            user=Cast(OuterRef('customer'), models.CharField()),
+            timestamp__lte=OuterRef('created_at'),
+        ).order_by('-timestamp')
+        return self.annotate(
+            source=Subquery(last_view.values('source')[:1]),
+            device_type=Subquery(last_view.values('device_type')[:1]),
+        )
+
+
 class Rental(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -154,6 +553,7 @@ class Rental(models.Model):
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled')
     ]
+    BOOKED_STATUSES = BOOKED_STATUSES
 
     stuff = models.ForeignKey(Stuff, on_delete=models.CASCADE)
     customer = models.IntegerField()  # User ID
@@ -165,6 +565,29 @@ class Rental(models.Model):
     payment_method = models.CharField(max_length=20, blank=True, null=True)
     transaction_id = models.CharField(max_length=100, blank=True, null=True)
 
+    objects = RentalQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='rental_created_at_idx'),
+            # Availability search: overlap (&&) on the occupied days of live rentals.
+            GistIndex(rental_period(), name='rental_period_gist', condition=~Q(status='cancelled')),
+        ]
+        constraints = [
+            models.CheckConstraint(check=Q(end_date__gt=F('start_date')), name='rental_dates_ordered'),
+            # No double booking. The item is compared as a one-point int8range
+            # so the whole constraint uses the built-in GiST range operator
+            # class and does not need the btree_gist extension.
+            ExclusionConstraint(
+                name='rental_no_overlap',
+                expressions=[
+                    (Int8Range('stuff', 'stuff', Value('[]')), RangeOperators.EQUAL),
+                    (rental_period(), RangeOperators.OVERLAPS),
+                ],
+                condition=Q(status__in=BOOKED_STATUSES),
+            ),
+        ]
+
     @property
     def duration(self):
         return (self.end_date - self.start_date).days
@@ -188,34 +611,11 @@ class SiteStat(models.Model):
 
     @classmethod
     def update_daily_stats(cls):
-        today = timezone.now().date()
-        stats, created = cls.objects.get_or_create(date=today)
-        
-        # Update visitor stats
-        stats.total_visitors = Visitor.objects.filter(
-            last_visit__date=today
-        ).count()
-        
-        # Update view stats
-        stats.total_page_views = ItemView.objects.filter(
-            timestamp__date=today
-        ).count()
-        
-        # Update rental stats
-        today_rentals = Rental.objects.filter(created_at__date=today)
-        stats.total_rentals = today_rentals.count()
-        stats.total_revenue = today_rentals.aggregate(
-            total=Sum('total_price')
-        )['total'] or 0
-        
-        # Calculate conversion rate
-        views_today = ItemView.objects.filter(timestamp__date=today).count()
-        stats.conversion_rate = (stats.total_rentals / views_today * 100) if views_today > 0 else 0
-        
-        # Calculate average order value
-        stats.avg_order_value = stats.total_revenue / stats.total_rentals if stats.total_rentals > 0 else 0
-        
-        stats.save()
+        """Recompute today's site, source, device and category statistics."""
+        from .rollups import rollup_range
+
+        today = timezone.localdate()
+        rollup_range(today, today)
 
 class TrafficSource(models.Model):
     date = models.DateField()
@@ -259,4 +659,133 @@ class CategoryStat(models.Model):
 
     class Meta:
         unique_together = ('date', 'category')
-        ordering = ['-date', 'category']
\ No newline at end of file
+        ordering = ['-date', 'category']
+
+
+class StatWatermark(models.Model):
+    """Highest event id already folded into the daily stat tables, per source table."""
+    name = models.CharField(max_length=50, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} up to #{self.last_id}"
+
+
+class SeenVisitor(models.Model):
+    """
+    Users already counted in a recent day's TrafficSource/DeviceStat visitors,
+    so incremental aggregation can count only first-time visitors exactly.
+    Only the last couple of days are kept.
+    """
+    date = models.DateField(db_index=True)
+    dimension = models.CharField(max_length=10)
+    value = models.CharField(max_length=20)
+    user = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ('date', 'dimension', 'value', 'user')
+
+
+class OutboxEvent(models.Model):
+    """
+    Message to publish to RabbitMQ, written in the same transaction as the
+    change it announces and removed once the broker confirmed it.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('failed', 'Failed'),
+    ]
+
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.id} ({self.status})"
+
+
+class Blob(models.Model):
+    """
+    A file stored once by ContentAddressedStorage, with the number of rows
+    referencing it. Unreferenced blobs are removed by the collect_blobs command.
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    sha256 = models.CharField(max_length=64)
+    size = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['refcount', 'last_used_at'], name='blob_unreferenced_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} reference(s))"
+
+
+class StuffTombstone(models.Model):
+    """A deleted item, recorded by a trigger for the change feed."""
+    stuff_id = models.BigIntegerField(primary_key=True)
+    change_txid = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['change_txid', 'stuff_id'], name='stufftombstone_change_idx'),
+        ]
+
+    def __str__(self):
+        return f"Deleted item {self.stuff_id}"
+
+
+class RelatedStuff(models.Model):
+    """
+    One of the items most often viewed or favorited by the users of another
+    item, ranked from 0 (closest). Rebuilt by the build_related command, see
+    equipments/related.py.
+    """
+    stuff = models.ForeignKey(Stuff, on_delete=models.CASCADE, related_name='related_items')
+    related = models.ForeignKey(Stuff, on_delete=models.CASCADE, related_name='related_to')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['stuff', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['stuff', 'rank'], name='relatedstuff_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.related_id} #{self.rank} for {self.stuff_id}"
+
+
+class VisitorSketch(models.Model):
+    """
+    HyperLogLog sketch of the identified users who viewed items on a day,
+    site-wide (empty value) or per item, category, source or device. Kept by
+    the incremental aggregation and merged at query time, see
+    equipments/sketches.py.
+    """
+    date = models.DateField()
+    dimension = models.CharField(max_length=10)
+    value = models.CharField(max_length=20, blank=True, default='')
+    registers = models.BinaryField()
+
+    class Meta:
+        unique_together = ('date', 'dimension', 'value')
+
+    def __str__(self):
+        return f"{self.dimension} {self.value} visitors on {self.date}"
@@ -0,0 +1,17 @@
+"""
+Registry of in-process operational statistics.
+
+Components register a zero-argument callable returning a JSON-serializable
+dict; OpsStatsView reports all of them from /api/ops/stats/. Values are per
+worker process.
+"""
+
+_providers = {}
+
+
+def register(name, provider):
+    _providers[name] = provider
+
+
+def collect():
+    return {name: provider() for name, provider in sorted(_providers.items())}
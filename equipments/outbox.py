@@ -0,0 +1,267 @@
+"""
+Transactional outbox for the events published to RabbitMQ.
+
+enqueue() stores an OutboxEvent in the caller's transaction, so an event
+exists if and only if the change it announces was committed, and requests
+never wait for the broker. The publish_events command runs an
+OutboxPublisher: it drains due events in batches over one persistent
+channel with publisher confirms, deletes the confirmed ones and retries the
+others with exponential backoff. Configured through the EVENT_PUBLISHER
+setting:
+
+    EVENT_PUBLISHER = {
+        'HOST': 'host.docker.internal',
+        'PORT': 5672,
+        'EXCHANGE': 'review_events',  # durable topic exchange, routing key = event type
+        'BATCH_SIZE': 100,            # events locked and published per transaction
+        'POLL_INTERVAL': 1.0,         # seconds between polls once the outbox is drained
+        'RETRY_DELAY': 5,             # seconds before the first retry, doubled per attempt
+        'MAX_RETRY_DELAY': 3600,
+        'MAX_ATTEMPTS': 10,           # then the event is left with status 'failed'
+    }
+
+Outages of the broker or of a service a message needs (DependencyUnavailable)
+charge no attempt: the events wait, backing off with their age up to
+MAX_RETRY_DELAY, for as long as the outage lasts. Events that can never be
+published (EventObsolete, e.g. the review was deleted) fail at once.
+
+Delivery is at least once: a crash between the broker's confirm and the
+commit republishes the batch, so consumers should deduplicate on the
+message_id property (the outbox id). A retried event may be published after
+newer ones.
+"""
+import datetime
+import json
+import logging
+import time
+from collections import Counter
+
+import pika
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from . import ops, users
+from .models import OutboxEvent, Review
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'HOST': 'host.docker.internal',
+    'PORT': 5672,
+    'EXCHANGE': 'review_events',
+    'BATCH_SIZE': 100,
+    'POLL_INTERVAL': 1.0,
+    'RETRY_DELAY': 5,
+    'MAX_RETRY_DELAY': 3600,
+    'MAX_ATTEMPTS': 10,
+}
+
+
+def publisher_settings():
+    return {**DEFAULTS, **getattr(settings, 'EVENT_PUBLISHER', {})}
+
+
+def enqueue(event_type, payload):
+    """Record an event to publish once the current transaction commits."""
+    return OutboxEvent.objects.create(event_type=event_type, payload=payload)
+
+
+class EventNotReady(Exception):
+    """The message for an event cannot be built yet; it is retried later."""
+
+
+class DependencyUnavailable(EventNotReady):
+    """A service the message needs is down; retried without charging an attempt."""
+
+
+class EventObsolete(Exception):
+    """The message for an event can never be built; the event fails at once."""
+
+
+def _review_created(payload):
+    if not Review.objects.filter(pk=payload['review_id']).exists():
+        raise EventObsolete(f"Review {payload['review_id']} no longer exists")
+    # Consumers expect the owner's email, resolved here rather than on the
+    # review request so the user service is off the write path.
+    try:
+        user_info = users.get_user_info(payload['owner'], raise_errors=True)
+    except users.UserServiceError as exc:
+        raise DependencyUnavailable(str(exc)) from exc
+    if user_info is None:
+        raise EventNotReady(f"No user info for {payload['owner']}")
+    if not user_info.get('email'):
+        raise EventNotReady(f"No email in the user info of {payload['owner']}")
+    return {'email': user_info['email'], 'review_id': payload['review_id']}
+
+
+# Builders turning a stored payload into the published one, per event type.
+MESSAGE_BUILDERS = {
+    'review.created': _review_created,
+}
+
+
+def build_message(event):
+    builder = MESSAGE_BUILDERS.get(event.event_type)
+    payload = builder(event.payload) if builder else event.payload
+    return json.dumps({'event': event.event_type, 'payload': payload})
+
+
+class OutboxPublisher:
+    def __init__(self, **config):
+        self.config = {**publisher_settings(), **config}
+        self._connection = None
+        self._channel = None
+        self.stats = Counter()
+
+    def publish_batch(self):
+        """
+        Publish one batch of due events. Returns the number of events handled,
+        published or rescheduled. Raises pika.exceptions.AMQPError when the
+        broker cannot be reached; the events already confirmed stay deleted.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            events = list(
+                OutboxEvent.objects.select_for_update(skip_locked=True)
+                .filter(status='pending', next_attempt_at__lte=now)
+                .order_by('id')[:self.config['BATCH_SIZE']]
+            )
+            if not events:
+                return 0
+            channel = self._open_channel()
+            # Resolve the batch's owners with parallel requests up front;
+            # the message builders then read them from the directory's cache.
+            users.get_users({event.payload['owner'] for event in events if 'owner' in event.payload})
+            published, failures, broker_error = [], [], None
+            for event in events:
+                try:
+                    body = build_message(event)
+                except Exception as exc:
+                    failures.append((event, exc))
+                    continue
+                try:
+                    channel.basic_publish(
+                        exchange=self.config['EXCHANGE'],
+                        routing_key=event.event_type,
+                        body=body,
+                        properties=pika.BasicProperties(
+                            delivery_mode=2, content_type='application/json', message_id=str(event.id),
+                        ),
+                    )
+                except (pika.exceptions.NackError, pika.exceptions.UnroutableError) as exc:
+                    failures.append((event, exc))
+                except pika.exceptions.AMQPError as exc:
+                    # The connection or channel is gone: keep the rest for later
+                    # without charging them an attempt.
+                    broker_error = exc
+                    break
+                else:
+                    published.append(event.id)
+
+            OutboxEvent.objects.filter(pk__in=published).delete()
+            for event, exc in failures:
+                self._reschedule(event, exc, now)
+        self.stats['published'] += len(published)
+        self.stats['retried'] += len(failures)
+        if broker_error is not None:
+            self.close()
+            raise broker_error
+        return len(published) + len(failures)
+
+    def run(self, once=False):
+        """Publish until interrupted, or with once until no event is due."""
+        delay = self.config['POLL_INTERVAL']
+        while True:
+            try:
+                handled = self.publish_batch()
+            except pika.exceptions.AMQPError as exc:
+                self.stats['broker_errors'] += 1
+                if once:
+                    raise
+                logger.warning("RabbitMQ unavailable (%s), retrying in %ss", exc, delay)
+                self.close()
+                handled = 0
+                delay = min(delay * 2, self.config['MAX_RETRY_DELAY'])
+            else:
+                delay = self.config['POLL_INTERVAL']
+            if handled:
+                continue
+            if once:
+                return
+            close_old_connections()
+            self._sleep(delay)
+
+    def close(self):
+        if self._connection is not None and self._connection.is_open:
+            try:
+                self._connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+        self._connection = self._channel = None
+
+    def _open_channel(self):
+        if self._channel is None or not self._channel.is_open:
+            self.close()
+            self._connection = pika.BlockingConnection(
+                pika.ConnectionParameters(
+                    host=self.config['HOST'],
+                    port=self.config['PORT'],
+                    heartbeat=600,
+                    blocked_connection_timeout=300,
+                )
+            )
+            channel = self._connection.channel()
+            channel.exchange_declare(exchange=self.config['EXCHANGE'], exchange_type='topic', durable=True)
+            channel.confirm_delivery()
+            self._channel = channel
+        return self._channel
+
+    def _reschedule(self, event, exc, now):
+        event.last_error = f'{type(exc).__name__}: {exc}'
+        if isinstance(exc, DependencyUnavailable):
+            # Waiting as long as the event's age doubles the delay at each
+            # retry without the attempt counter an outage must not consume.
+            self.stats['deferred'] += 1
+            age = (now - event.created_at).total_seconds()
+            delay = min(max(age, self.config['RETRY_DELAY']), self.config['MAX_RETRY_DELAY'])
+            event.next_attempt_at = now + datetime.timedelta(seconds=delay)
+            event.save(update_fields=['last_error', 'next_attempt_at'])
+            return
+        event.attempts += 1
+        if isinstance(exc, EventObsolete) or event.attempts >= self.config['MAX_ATTEMPTS']:
+            event.status = 'failed'
+            self.stats['failed'] += 1
+            logger.error("Giving up on outbox event %s after %s attempts: %s", event.id, event.attempts, exc)
+        else:
+            delay = min(self.config['RETRY_DELAY'] * 2 ** (event.attempts - 1), self.config['MAX_RETRY_DELAY'])
+            event.next_attempt_at = now + datetime.timedelta(seconds=delay)
+        event.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+    def _sleep(self, seconds):
+        # Sleeping through the connection keeps answering the broker's heartbeats.
+        if self._connection is not None and self._connection.is_open:
+            try:
+                self._connection.sleep(seconds)
+                return
+            except pika.exceptions.AMQPError:
+                self.close()
+        time.sleep(seconds)
+
+
+def backlog():
+    """Outbox size per status and the age of the oldest pending event, in seconds."""
+    rows = {
+        row['status']: row
+        for row in OutboxEvent.objects.order_by().values('status').annotate(count=Count('id'), oldest=Min('created_at'))
+    }
+    pending = rows.get('pending')
+    return {
+        'pending': pending['count'] if pending else 0,
+        'failed': rows['failed']['count'] if 'failed' in rows else 0,
+        'oldest_pending_age_s': round((timezone.now() - pending['oldest']).total_seconds(), 1) if pending else 0.0,
+    }
+
+
+ops.register('outbox', backlog)
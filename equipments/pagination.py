@@ -0,0 +1,191 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are fetched with a WHERE clause continuing from the sort key of the
+last row served, never with OFFSET, so page N costs the same as page 1 when
+the ordering is backed by an index. The ordering is the queryset's own
+(e.g. from ?ordering=, or by search rank), else the pagination class's,
+else Meta.ordering, with the primary key appended as a tie-breaker so rows
+sharing a sort value are neither skipped nor repeated. Cursors are opaque
+base64 tokens; a cursor issued under one ordering is rejected under another.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def _flip(field):
+    return field[1:] if field.startswith('-') else '-' + field
+
+
+def _nullable(model, name):
+    try:
+        return model._meta.get_field(name).null
+    except FieldDoesNotExist:
+        # An annotation, such as a search rank.
+        return False
+
+
+def _after(model, fields, values):
+    """
+    Q selecting the rows that follow values in the order of fields, with
+    PostgreSQL's NULL placement (last ascending, first descending).
+    """
+    field, rest = fields[0], fields[1:]
+    name, descending = field.lstrip('-'), field.startswith('-')
+    value = values[0]
+    if value is None:
+        beyond = Q(**{f'{name}__isnull': False}) if descending else Q(pk__in=[])
+        equal = Q(**{f'{name}__isnull': True})
+    else:
+        beyond = Q(**{f'{name}__lt' if descending else f'{name}__gt': value})
+        if not descending and _nullable(model, name):
+            beyond |= Q(**{f'{name}__isnull': True})
+        equal = Q(**{name: value})
+    if not rest:
+        return beyond
+    condition = beyond | (equal & _after(model, rest, values[1:]))
+    if value is not None and not _nullable(model, name):
+        # Redundant bound on the leading column so the index scan starts at the cursor.
+        condition &= Q(**{f'{name}__lte' if descending else f'{name}__gte': value})
+    return condition
+
+
+class KeysetPagination(BasePagination):
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    # Used when the queryset is not explicitly ordered, before Meta.ordering.
+    ordering = None
+    invalid_cursor_message = 'Invalid cursor.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.model = queryset.model
+        self.annotations = queryset.query.annotations
+        self.page_size = self.get_page_size(request)
+        self.fields = self.get_ordering(queryset)
+        values, reverse = self.decode_cursor(request)
+
+        fields = [_flip(field) for field in self.fields] if reverse else self.fields
+        queryset = queryset.order_by(*fields)
+        if values is not None:
+            queryset = queryset.filter(_after(self.model, fields, values))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+        # Walking backwards, the extra row lies before the page and the cursor
+        # row after it; walking forwards it is the other way round.
+        self.has_next = values is not None if reverse else has_more
+        self.has_previous = has_more if reverse else values is not None
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(size, self.max_page_size) if size > 0 else self.page_size
+
+    def get_ordering(self, queryset):
+        fields = list(queryset.query.order_by or self.ordering or queryset.model._meta.ordering or [])
+        for field in fields:
+            if not isinstance(field, str) or '__' in field or field.startswith('?'):
+                raise ImproperlyConfigured(f"Keyset pagination cannot order by {field!r}.")
+        pk = queryset.model._meta.pk.name
+        fields = [field.replace('pk', pk) if field.lstrip('-') == 'pk' else field for field in fields]
+        if pk not in [field.lstrip('-') for field in fields]:
+            fields.append('-' + pk if fields and fields[-1].startswith('-') else pk)
+        return fields
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, row, reverse):
+        values = []
+        for field in self.fields:
+            name = field.lstrip('-')
+            if name in self.annotations:
+                values.append(getattr(row, name))
+                continue
+            model_field = self.model._meta.get_field(name)
+            value = getattr(row, model_field.attname)
+            values.append(None if value is None else model_field.value_to_string(row))
+        token = json.dumps({'o': self.fields, 'v': values, 'r': reverse}, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(token.encode()).decode().rstrip('=')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """(sort values of the row to continue from, whether to walk backwards), or (None, False)."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            token = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            if token['o'] != self.fields or len(token['v']) != len(self.fields):
+                raise ValueError
+            values = [
+                None if value is None else self._field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.fields, token['v'])
+            ]
+        except (binascii.Error, TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, bool(token['r'])
+
+    def _field(self, name):
+        if name in self.annotations:
+            return self.annotations[name].output_field
+        return self.model._meta.get_field(name)
+
+
+class EventPagination(KeysetPagination):
+    """Tracking events: newest first, in large pages for exports."""
+    page_size = 100
+    max_page_size = 1000
+    ordering = ('-timestamp',)
+
+
+class RentalPagination(KeysetPagination):
+    ordering = ('-created_at',)
+
+
+class CatalogPagination(KeysetPagination):
+    page_size = 24
+    max_page_size = 100
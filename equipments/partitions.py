@@ -0,0 +1,176 @@
+"""
+Monthly partitions of the tracking event tables, ItemView and CartActivity.
+
+Both tables are range-partitioned on timestamp by calendar month (UTC), see
+migration 0019: equipments_itemview_p2025_06 holds the views of June 2025.
+Their primary key is (id, timestamp), as PostgreSQL requires of a
+partitioned table; ids still come from a single sequence. A default
+partition receives the rows no monthly partition covers, and
+create_partition() moves them to the partition it creates. A query bounded
+on timestamp, as the daily rollups are, only reads the partitions of its
+range, and an expired month is dropped as a whole instead of DELETEd.
+
+The expire_events command keeps MONTHS_AHEAD partitions ready and removes
+the months older than KEEP_MONTHS, once their item views are rolled up into
+the daily stat tables. Configured through the EVENT_RETENTION setting:
+
+    EVENT_RETENTION = {
+        'KEEP_MONTHS': 13,   # full months kept before the current one
+        'MONTHS_AHEAD': 3,   # partitions created in advance
+    }
+"""
+import datetime
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import rollups
+from .models import CartActivity, ItemView, StatWatermark
+
+DEFAULTS = {
+    'KEEP_MONTHS': 13,
+    'MONTHS_AHEAD': 3,
+}
+
+# Item views are rolled up before their partition goes; cart activity is
+# not part of the daily stats.
+PARTITIONED_MODELS = (ItemView, CartActivity)
+
+_MONTH_SUFFIX = re.compile(r'_p(\d{4})_(\d{2})$')
+
+
+def retention_settings():
+    return {**DEFAULTS, **getattr(settings, 'EVENT_RETENTION', {})}
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month):
+    """Aware datetimes delimiting the (UTC) month starting on the date month."""
+    following = add_months(month, 1)
+    return (
+        datetime.datetime(month.year, month.month, 1, tzinfo=datetime.timezone.utc),
+        datetime.datetime(following.year, following.month, 1, tzinfo=datetime.timezone.utc),
+    )
+
+
+def current_month():
+    return timezone.now().astimezone(datetime.timezone.utc).date().replace(day=1)
+
+
+def partition_name(model, month):
+    return f'{model._meta.db_table}_p{month:%Y_%m}'
+
+
+def default_partition_name(model):
+    return f'{model._meta.db_table}_default'
+
+
+def monthly_partitions(model):
+    """{first day of the month: partition name} of the monthly partitions of model."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass',
+            [model._meta.db_table],
+        )
+        names = [name for name, in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        match = _MONTH_SUFFIX.search(name)
+        if match:
+            partitions[datetime.date(int(match[1]), int(match[2]), 1)] = name
+    return dict(sorted(partitions.items()))
+
+
+@transaction.atomic
+def create_partition(model, month):
+    """
+    Create the partition of model for month, moving into it the rows the
+    default partition holds for that month. False if it already exists.
+    """
+    if month in monthly_partitions(model):
+        return False
+    table, name = model._meta.db_table, partition_name(model, month)
+    lower, upper = month_bounds(month)
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {name} (LIKE {table})')
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {default_partition_name(model)} '
+            f'WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+            f'INSERT INTO {name} SELECT * FROM moved',
+            [lower, upper],
+        )
+        # Attaching builds the partition's share of the table's indexes and foreign keys.
+        cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', [lower, upper])
+    return True
+
+
+def ensure_partitions(months_ahead, start=None):
+    """Create the missing partitions from start (default: this month) to months_ahead later. Returns their names."""
+    start = start or current_month()
+    created = []
+    for model in PARTITIONED_MODELS:
+        for offset in range(months_ahead + 1):
+            month = add_months(start, offset)
+            if create_partition(model, month):
+                created.append(partition_name(model, month))
+    return created
+
+
+def roll_up_month(month):
+    """
+    Recompute the daily stats of the days of month from its item views.
+    False, without doing so, if some of them are past the incremental
+    aggregation watermark, i.e. not counted yet.
+    """
+    lower, upper = month_bounds(month)
+    mark = StatWatermark.objects.filter(name=rollups.VIEWS_MARK).values_list('last_id', flat=True).first()
+    if mark is not None and ItemView.objects.filter(timestamp__gte=lower, timestamp__lt=upper, id__gt=mark).exists():
+        return False
+    # A local day straddling the start of the month was rolled up with the
+    # previous month, while both halves of it still existed.
+    first = timezone.localtime(lower)
+    start = first.date() if first.time() == datetime.time.min else first.date() + datetime.timedelta(days=1)
+    end = timezone.localtime(upper - datetime.timedelta(microseconds=1)).date()
+    # Visitor sessions only keep their last visit, so the visitor counts of
+    # past days cannot be recomputed and are left as they are.
+    rollups.rollup_range(start, end, visitors=False)
+    return True
+
+
+@transaction.atomic
+def remove_partition(model, month, detach_only=False):
+    """Detach the partition of model for month, and drop it unless detach_only."""
+    name = partition_name(model, month)
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {model._meta.db_table} DETACH PARTITION {name}')
+        if not detach_only:
+            cursor.execute(f'DROP TABLE {name}')
+
+
+def expire(keep_months, detach_only=False, dry_run=False):
+    """
+    Remove the partitions of the months before the last keep_months, rolling
+    their item views up first. Returns [(partition name, outcome)].
+    """
+    oldest_kept = add_months(current_month(), -keep_months)
+    report = []
+    for model in PARTITIONED_MODELS:
+        for month, name in monthly_partitions(model).items():
+            if month >= oldest_kept:
+                continue
+            if dry_run:
+                report.append((name, 'expired'))
+                continue
+            if model is ItemView and not roll_up_month(month):
+                report.append((name, 'kept: not aggregated yet'))
+                continue
+            remove_partition(model, month, detach_only)
+            report.append((name, 'detached' if detach_only else 'dropped'))
+    return report
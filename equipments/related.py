@@ -0,0 +1,137 @@
+"""
+"People who looked at this also looked at": related items from co-views and
+co-favorites.
+
+build_related() loads the distinct (user, item) pairs of the recent item
+views and of the favorites with two queries, as a sparse users x items
+matrix in coordinate form (NumPy arrays of row, column and weight; a
+favorite weighs more than a view). The item x item co-occurrence matrix is
+its Gram matrix, computed from the nonzero entries only: every pair of
+entries of the same user's row contributes the product of their weights.
+Scores are cosine similarities, so popular items do not end up related to
+everything, and the TOP_K best of each item are stored as RelatedStuff rows
+the /api/stuffs/{id}/related/ endpoint reads with one indexed query.
+Configured through the RELATED_ITEMS setting:
+
+    RELATED_ITEMS = {
+        'TOP_K': 10,                 # related items stored per item
+        'DAYS': 180,                 # days of item views considered
+        'FAVORITE_WEIGHT': 3.0,      # weight of a favorite, a view weighs 1
+        'MAX_ITEMS_PER_USER': 500,   # users who touched more items (crawlers) are ignored
+    }
+"""
+import datetime
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Favorite, ItemView, RelatedStuff, Stuff
+
+DEFAULTS = {
+    'TOP_K': 10,
+    'DAYS': 180,
+    'FAVORITE_WEIGHT': 3.0,
+    'MAX_ITEMS_PER_USER': 500,
+}
+
+BATCH_SIZE = 5000
+
+
+def related_settings():
+    return {**DEFAULTS, **getattr(settings, 'RELATED_ITEMS', {})}
+
+
+def interactions(since, favorite_weight):
+    """
+    (users, items, weights): one entry per user and item the user viewed
+    since since or favorited, weighing the strongest of the two. users are
+    indices, items are Stuff ids.
+    """
+    views = list(
+        ItemView.objects.filter(timestamp__gte=since, user__isnull=False)
+        .values_list('user', 'stuff_id').distinct()
+    )
+    favorites = list(Favorite.objects.filter(user__isnull=False).values_list('user', 'stuff_id').distinct())
+    pairs = views + favorites
+    if not pairs:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0)
+    _, users = np.unique(np.array([user for user, _ in pairs], dtype=object), return_inverse=True)
+    items = np.fromiter((stuff_id for _, stuff_id in pairs), dtype=np.int64, count=len(pairs))
+    weights = np.concatenate((np.ones(len(views)), np.full(len(favorites), float(favorite_weight))))
+
+    # Merge the view and the favorite of the same user and item.
+    keys, entry = np.unique(np.stack((users, items)), axis=1, return_inverse=True)
+    merged = np.zeros(keys.shape[1])
+    np.maximum.at(merged, entry.ravel(), weights)
+    return keys[0], keys[1], merged
+
+
+def co_occurrences(users, items, weights, max_items_per_user):
+    """
+    The nonzero off-diagonal entries of the item x item co-occurrence matrix
+    (rows, columns, values; rows and columns are positions in the returned
+    item ids) and the squared norm of each item's column.
+    """
+    item_ids, columns = np.unique(items, return_inverse=True)
+    order = np.argsort(users, kind='stable')
+    users, columns, weights = users[order], columns[order], weights[order]
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    sizes = np.diff(np.r_[starts, len(users)])
+    kept = sizes <= max_items_per_user
+    norms = np.bincount(columns, weights=np.where(np.repeat(kept, sizes), weights ** 2, 0), minlength=len(item_ids))
+    # Each entry is paired with every entry of its user's row: entry i
+    # repeats once per entry of its row, against the row's entries in turn.
+    size_of = np.repeat(np.where(kept, sizes, 0), sizes)
+    start_of = np.repeat(starts, sizes)
+    left = np.repeat(np.arange(len(users)), size_of)
+    offsets = np.arange(len(left)) - np.repeat(np.cumsum(size_of) - size_of, size_of)
+    right = np.repeat(start_of, size_of) + offsets
+    distinct = left != right
+    left, right = left[distinct], right[distinct]
+
+    pair_keys, pair = np.unique(columns[left] * len(item_ids) + columns[right], return_inverse=True)
+    values = np.bincount(pair.ravel(), weights=weights[left] * weights[right], minlength=len(pair_keys))
+    return item_ids, pair_keys // len(item_ids), pair_keys % len(item_ids), values, norms
+
+
+def top_related(users, items, weights, top_k, max_items_per_user):
+    """[(stuff id, related stuff id, rank, score)], the top_k most similar items of every item."""
+    item_ids, rows, cols, values, norms = co_occurrences(users, items, weights, max_items_per_user)
+    if not len(values):
+        return []
+    scores = values / np.sqrt(norms[rows] * norms[cols])
+    # Best score first within each item, ties broken by the lower id.
+    order = np.lexsort((item_ids[cols], -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    firsts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    ranks = np.arange(len(rows)) - np.repeat(firsts, np.diff(np.r_[firsts, len(rows)]))
+    best = ranks < top_k
+    return list(zip(
+        item_ids[rows[best]].tolist(), item_ids[cols[best]].tolist(), ranks[best].tolist(),
+        np.round(scores[best], 6).tolist(),
+    ))
+
+
+def build_related(top_k=None, days=None):
+    """Recompute and replace every RelatedStuff row. Returns the number of items given related items."""
+    config = related_settings()
+    top_k = config['TOP_K'] if top_k is None else top_k
+    days = config['DAYS'] if days is None else days
+    since = timezone.now() - datetime.timedelta(days=days)
+    users, items, weights = interactions(since, config['FAVORITE_WEIGHT'])
+    rows = top_related(users, items, weights, top_k, config['MAX_ITEMS_PER_USER'])
+    with transaction.atomic():
+        # Items deleted since the events were read would break the foreign keys.
+        stuff_ids = {stuff_id for stuff_id, _, _, _ in rows}
+        existing = set(Stuff.objects.filter(id__in=stuff_ids).values_list('id', flat=True))
+        rows = [row for row in rows if row[0] in existing and row[1] in existing]
+        RelatedStuff.objects.all().delete()
+        RelatedStuff.objects.bulk_create(
+            (RelatedStuff(stuff_id=stuff_id, related_id=related_id, rank=rank, score=score)
+             for stuff_id, related_id, rank, score in rows),
+            batch_size=BATCH_SIZE,
+        )
+    return len({stuff_id for stuff_id, _, _, _ in rows})
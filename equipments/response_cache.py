@@ -0,0 +1,187 @@
+"""
+Read-through cache of the catalog's most requested read responses.
+
+Views decorated with cached_response() keep the data of their 200 responses
+in a Django cache, keyed on the host, path and query parameters of the
+request, under a scope naming what the response was built from, e.g.
+'stuff:42' for an item and its management row and images. Saving or deleting
+a row invalidates the scopes that depend on it (see equipments.signals):
+every scope has a generation token that is part of its keys, and replacing
+the token orphans all of the scope's entries at once, which the backend then
+expires. Configured through the RESPONSE_CACHE setting:
+
+    RESPONSE_CACHE = {
+        'ENABLED': True,
+        'CACHE': 'responses',  # alias in CACHES: local memory, or Redis shared by the workers
+        'TIMEOUT': 300,        # seconds an entry is kept
+    }
+
+The denormalized counters (num_views, avg_rating, ...) are updated without
+signals, so a cached item shows them up to TIMEOUT seconds late.
+"""
+import functools
+import hashlib
+import string
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from . import conditional, ops
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    'TIMEOUT': 300,
+}
+
+KEY_PREFIX = 'response'
+
+
+def response_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'RESPONSE_CACHE', {})}
+
+
+class ResponseCache:
+    def __init__(self, cache, timeout=300):
+        self.cache = cache
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._stats = Counter()  # (scope kind, 'hits' | 'misses' | 'hit_ms' | 'miss_ms') -> total
+        self._invalidations = 0
+
+    def fetch(self, scope, request, compute):
+        """The cached response to request under scope, or compute()'s, cached if it is a 200."""
+        started = time.perf_counter()
+        key = self._key(scope, request)
+        entry = self.cache.get(key)
+        hit = entry is not None
+        if hit:
+            data, headers = entry
+            # Stored with its ETag and Last-Modified, so conditional requests
+            # are answered from the cache as well.
+            response = conditional.respond(request, headers, lambda: Response(data)) if headers else Response(data)
+        else:
+            response = compute()
+            if response.status_code == 200:
+                headers = {name: response[name] for name in conditional.VALIDATOR_HEADERS if response.has_header(name)}
+                self.cache.set(key, (response.data, headers), self.timeout)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        self._record(scope.split(':')[0], hit, time.perf_counter() - started)
+        return response
+
+    def invalidate(self, *scopes):
+        """Drop every entry of scopes, now and again once the current transaction commits."""
+        scopes = [scope for scope in dict.fromkeys(scopes) if scope]
+        if not scopes:
+            return
+        # The second bump discards what a concurrent request cached from the
+        # rows as they were before the commit.
+        self._bump(scopes)
+        transaction.on_commit(lambda: self._bump(scopes))
+
+    def stats(self):
+        with self._lock:
+            stats = {'hits': 0, 'misses': 0, 'invalidations': self._invalidations, 'scopes': {}}
+            for kind in sorted({kind for kind, _ in self._stats}):
+                hits, misses = self._stats[kind, 'hits'], self._stats[kind, 'misses']
+                stats['scopes'][kind] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                    'avg_hit_ms': round(self._stats[kind, 'hit_ms'] / hits, 3) if hits else 0.0,
+                    'avg_miss_ms': round(self._stats[kind, 'miss_ms'] / misses, 3) if misses else 0.0,
+                }
+                stats['hits'] += hits
+                stats['misses'] += misses
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+            return stats
+
+    def _key(self, scope, request):
+        generation_key = f'{KEY_PREFIX}:generation:{scope}'
+        generation = self.cache.get(generation_key)
+        if generation is None:
+            # A generation evicted from the cache comes back as a new one, so
+            # entries built before an invalidation can never be served again.
+            self.cache.add(generation_key, uuid.uuid4().hex, None)
+            generation = self.cache.get(generation_key)
+        params = sorted((name, value) for name, values in request.query_params.lists() for value in values)
+        digest = hashlib.sha256(repr((request.scheme, request.get_host(), request.path, params)).encode())
+        return f'{KEY_PREFIX}:{scope}:{generation}:{digest.hexdigest()}'
+
+    def _bump(self, scopes):
+        self.cache.set_many({f'{KEY_PREFIX}:generation:{scope}': uuid.uuid4().hex for scope in scopes}, None)
+        with self._lock:
+            self._invalidations += len(scopes)
+
+    def _record(self, kind, hit, seconds):
+        with self._lock:
+            self._stats[kind, 'hits' if hit else 'misses'] += 1
+            self._stats[kind, 'hit_ms' if hit else 'miss_ms'] += seconds * 1000
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """The process-wide ResponseCache, or None when RESPONSE_CACHE is disabled."""
+    global _response_cache
+    config = response_cache_settings()
+    if not config['ENABLED']:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(caches[config['CACHE']], timeout=config['TIMEOUT'])
+    return _response_cache
+
+
+def invalidate(*scopes):
+    cache = get_response_cache()
+    if cache is not None:
+        cache.invalidate(*scopes)
+
+
+def cached_response(scope):
+    """
+    Serve a read-only viewset method through the response cache. scope is a
+    template filled from the URL keyword arguments and the query parameters,
+    e.g. 'stuff:{pk}'; requests missing one of its values, or giving a
+    non-numeric one, bypass the cache.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            cache = get_response_cache()
+            name = _scope_name(scope, {**request.query_params.dict(), **kwargs})
+            if cache is None or name is None or request.method not in ('GET', 'HEAD'):
+                return method(view, request, *args, **kwargs)
+            return cache.fetch(name, request, lambda: method(view, request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def _scope_name(scope, values):
+    fields = {}
+    for name in _fields(scope):
+        value = str(values.get(name, ''))
+        if not (value.isascii() and value.isdigit()):
+            return None
+        # The same normalization as the lookups, so '042' shares the scope of '42'.
+        fields[name] = int(value)
+    return scope.format(**fields)
+
+
+@functools.lru_cache(maxsize=None)
+def _fields(scope):
+    return tuple(name for _, name, _, _ in string.Formatter().parse(scope) if name)
+
+
+ops.register('response_cache', lambda: get_response_cache().stats() if _response_cache is not None else {})
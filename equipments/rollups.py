@@ -0,0 +1,278 @@
+"""
+Rollup of the raw tracking tables into the daily statistics tables.
+
+rollup_range() recomputes SiteStat, TrafficSource, DeviceStat and CategoryStat
+for every day of a date range with one grouped pass over each source table
+(ItemView, Rental, Visitor) and bulk upserts the results, and rebuilds the
+days' unique-visitor sketches (equipments.sketches). Rerunning it is
+idempotent, so it is used both for "today" and for backfills. Days whose
+item views were removed by expire_events (equipments.partitions) only
+survive in the stat tables, so they are never recomputed.
+
+Once incremental aggregation (equipments.incremental) is running, rollups
+only read events up to its watermarks; later events are folded in by the
+next incremental run.
+"""
+import datetime
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import sketches
+from .models import (
+    CategoryStat, DeviceStat, ItemView, Rental, SeenVisitor, SiteStat, StatWatermark, Stuff,
+    TrafficSource, Visitor, VisitorSketch,
+)
+
+# Bit masks returned by GROUPING(source, device_type, category_id): a set bit
+# means the column is aggregated away in that row.
+_PER_SOURCE, _PER_DEVICE, _PER_CATEGORY, _PER_DAY = 0b011, 0b101, 0b110, 0b111
+
+# StatWatermark names of the event tables folded incrementally.
+VIEWS_MARK, RENTALS_MARK = 'itemview', 'rental'
+
+# SeenVisitor rows are only needed for days that can still receive events.
+SEEN_VISITOR_DAYS = 2
+
+# Advisory lock serializing incremental runs (exclusive) against rollups (shared).
+STATS_LOCK_ID = 0x5374617473
+
+
+def lock_stats(shared=False):
+    """Hold the stats advisory lock until the end of the current transaction."""
+    function = 'pg_advisory_xact_lock_shared' if shared else 'pg_advisory_xact_lock'
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {function}(%s)', [STATS_LOCK_ID])
+
+
+def watermarks():
+    return dict(StatWatermark.objects.values_list('name', 'last_id'))
+
+
+def _id_range(column, after_id, upto_id):
+    """SQL conditions and params restricting column to (after_id, upto_id]."""
+    conditions, params = [], []
+    if after_id is not None:
+        conditions.append(f'{column} > %s')
+        params.append(after_id)
+    if upto_id is not None:
+        conditions.append(f'{column} <= %s')
+        params.append(upto_id)
+    return conditions, params
+
+
+def day_bounds(start, end):
+    """Aware datetimes delimiting the days start..end (inclusive) in the current time zone."""
+    tz = timezone.get_current_timezone()
+    lower = timezone.make_aware(datetime.datetime.combine(start, datetime.time.min), tz)
+    upper = timezone.make_aware(datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min), tz)
+    return lower, upper
+
+
+def first_retained_day():
+    """
+    First local day whose item views are all still stored, or None when
+    ItemView is not partitioned. Expiring removes the oldest monthly
+    partitions, so every day before the oldest remaining one lost events.
+    """
+    from .partitions import month_bounds, monthly_partitions
+
+    months = monthly_partitions(ItemView)
+    if not months:
+        return None
+    first = timezone.localtime(month_bounds(next(iter(months)))[0])
+    return first.date() if first.time() == datetime.time.min else first.date() + datetime.timedelta(days=1)
+
+
+def days_between(start, end):
+    return [start + datetime.timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+def _view_rows(lower, upper, upto_id=None):
+    """
+    One scan of ItemView, grouped per day and per day x source / device /
+    category through GROUPING SETS so distinct visitors stay exact per set.
+    """
+    conditions, params = _id_range('v.id', None, upto_id)
+    sql = f"""
+        SELECT day, source, device_type, category_id,
+               GROUPING(source, device_type, category_id) AS grouping,
+               COUNT(*) AS views,
+               COUNT(DISTINCT "user") AS visitors
+        FROM (
+            SELECT (v.timestamp AT TIME ZONE %s)::date AS day,
+                   v.source, v.device_type, v.user, s.category_id
+            FROM {ItemView._meta.db_table} v
+            JOIN {Stuff._meta.db_table} s ON s.id = v.stuff_id
+            WHERE {' AND '.join(['v.timestamp >= %s', 'v.timestamp < %s'] + conditions)}
+        ) views
+        GROUP BY GROUPING SETS ((day), (day, source), (day, device_type), (day, category_id))
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [timezone.get_current_timezone_name(), lower, upper] + params)
+        return cursor.fetchall()
+
+
+def _rental_rows(lower=None, upper=None, after_id=None, upto_id=None):
+    """One pass over Rental, grouped per day, attributed source/device and category."""
+    rentals = Rental.objects.all()
+    if lower is not None:
+        rentals = rentals.filter(created_at__gte=lower, created_at__lt=upper)
+    if after_id is not None:
+        rentals = rentals.filter(id__gt=after_id)
+    if upto_id is not None:
+        rentals = rentals.filter(id__lte=upto_id)
+    return (
+        rentals.with_attribution()
+        .annotate(day=TruncDate('created_at'), category=F('stuff__category'))
+        .order_by()
+        .values('day', 'source', 'device_type', 'category')
+        .annotate(rentals=Count('id'), revenue=Sum('total_price'))
+    )
+
+
+def seen_visitors_sql(conditions):
+    """
+    INSERT recording the (day, source) and (day, device) pairs of every
+    identified user of the ItemView rows matching conditions. Parameters are
+    the time zone name followed by the conditions' parameters.
+    """
+    return f"""
+        INSERT INTO {SeenVisitor._meta.db_table} (date, dimension, value, "user")
+        SELECT DISTINCT e.day, d.dimension, d.value, e.user
+        FROM (
+            SELECT (v.timestamp AT TIME ZONE %s)::date AS day, v.source, v.device_type, v.user
+            FROM {ItemView._meta.db_table} v
+            WHERE {' AND '.join(['v.user IS NOT NULL'] + conditions)}
+        ) e
+        CROSS JOIN LATERAL (VALUES ('source', e.source), ('device', e.device_type)) AS d(dimension, value)
+        ON CONFLICT DO NOTHING
+    """
+
+
+def _rebuild_seen_visitors(start, end, upto_id):
+    start = max(start, timezone.localdate() - datetime.timedelta(days=SEEN_VISITOR_DAYS - 1))
+    if start > end:
+        return
+    lower, upper = day_bounds(start, end)
+    SeenVisitor.objects.filter(date__range=(start, end)).delete()
+    conditions, params = _id_range('v.id', None, upto_id)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            seen_visitors_sql(['v.timestamp >= %s', 'v.timestamp < %s'] + conditions),
+            [timezone.get_current_timezone_name(), lower, upper] + params,
+        )
+
+
+def _rebuild_sketches(start, end, upto_id):
+    VisitorSketch.objects.filter(date__range=(start, end)).delete()
+    lower, upper = day_bounds(start, end)
+    conditions, params = _id_range('v.id', None, upto_id)
+    sketches.add_views(['v.timestamp >= %s', 'v.timestamp < %s'] + conditions, [lower, upper] + params)
+
+
+def _visitor_rows(lower, upper):
+    return (
+        Visitor.objects.filter(last_visit__gte=lower, last_visit__lt=upper)
+        .annotate(day=TruncDate('last_visit'))
+        .order_by()
+        .values('day')
+        .annotate(visitors=Count('session_key'))
+    )
+
+
+def compute(start, end, marks=None):
+    """
+    Compute, without saving, the stat rows for start..end as unsaved model
+    instances, ignoring events past the given {mark name: last id} watermarks.
+    """
+    marks = marks or {}
+    lower, upper = day_bounds(start, end)
+    site = {day: SiteStat(date=day) for day in days_between(start, end)}
+    sources, devices, categories = {}, {}, {}
+
+    def source_row(day, source):
+        return sources.setdefault((day, source), TrafficSource(date=day, source=source))
+
+    def device_row(day, device_type):
+        return devices.setdefault((day, device_type), DeviceStat(date=day, device_type=device_type))
+
+    def category_row(day, category_id):
+        return categories.setdefault((day, category_id), CategoryStat(date=day, category_id=category_id))
+
+    for day, source, device_type, category_id, grouping, views, visitors in _view_rows(lower, upper, marks.get(VIEWS_MARK)):
+        if grouping == _PER_DAY:
+            site[day].total_page_views = views
+        elif grouping == _PER_SOURCE:
+            source_row(day, source).visitors = visitors
+        elif grouping == _PER_DEVICE:
+            device_row(day, device_type).visitors = visitors
+        elif grouping == _PER_CATEGORY and category_id is not None:
+            category_row(day, category_id).views = views
+
+    for row in _rental_rows(lower, upper, upto_id=marks.get(RENTALS_MARK)):
+        day, revenue = row['day'], row['revenue'] or 0
+        site[day].total_rentals += row['rentals']
+        site[day].total_revenue += revenue
+        targets = []
+        if row['source']:
+            targets.append(source_row(day, row['source']))
+        if row['device_type']:
+            targets.append(device_row(day, row['device_type']))
+        if row['category'] is not None:
+            targets.append(category_row(day, row['category']))
+        for target in targets:
+            target.rentals += row['rentals']
+            target.revenue += revenue
+
+    for row in _visitor_rows(lower, upper):
+        site[row['day']].total_visitors = row['visitors']
+
+    for stat in site.values():
+        stat.avg_order_value = stat.total_revenue / stat.total_rentals if stat.total_rentals else 0
+        stat.conversion_rate = stat.total_rentals / stat.total_page_views * 100 if stat.total_page_views else 0
+
+    return list(site.values()), list(sources.values()), list(devices.values()), list(categories.values())
+
+
+def _replace(model, key, rows, start, end, update_fields):
+    """Upsert rows and delete the range's rows whose key no longer has data."""
+    model.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['date', key], update_fields=update_fields,
+    )
+    fresh = {(row.date, getattr(row, key)) for row in rows}
+    existing = model.objects.filter(date__range=(start, end)).values_list('pk', 'date', key)
+    stale = [pk for pk, date, value in existing if (date, value) not in fresh]
+    if stale:
+        model.objects.filter(pk__in=stale).delete()
+
+
+@transaction.atomic
+def rollup_range(start, end, visitors=True):
+    """
+    Recompute and store every daily statistic for the days start..end
+    inclusive; with visitors=False, the stored SiteStat visitor counts of
+    days that already have one are kept. Days before first_retained_day()
+    are skipped. Returns the number of days recomputed.
+    """
+    retained = first_retained_day()
+    if retained is not None and start < retained:
+        start = retained
+    if start > end:
+        return 0
+    lock_stats(shared=True)
+    marks = watermarks()
+    site, sources, devices, categories = compute(start, end, marks)
+    update_fields = ['total_page_views', 'total_rentals', 'total_revenue', 'avg_order_value', 'conversion_rate']
+    SiteStat.objects.bulk_create(
+        site, update_conflicts=True, unique_fields=['date'],
+        update_fields=['total_visitors'] + update_fields if visitors else update_fields,
+    )
+    _replace(TrafficSource, 'source', sources, start, end, ['visitors', 'rentals', 'revenue'])
+    _replace(DeviceStat, 'device_type', devices, start, end, ['visitors', 'rentals', 'revenue'])
+    _replace(CategoryStat, 'category_id', categories, start, end, ['views', 'rentals', 'revenue'])
+    _rebuild_seen_visitors(start, end, marks.get(VIEWS_MARK))
+    _rebuild_sketches(start, end, marks.get(VIEWS_MARK))
+    return len(site)
@@ -5,6 +5,7 @@ from .models import (
     SiteStat, TrafficSource, DeviceStat, CategoryStat,Favorite
 )
 import re
+from django.core.files.storage import default_storage
 from django.http import QueryDict
 
 class ReviewsSerializer(serializers.ModelSerializer):
@@ -26,9 +27,20 @@ class TestSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 class EquipmentImageSerializer(serializers.ModelSerializer):
+    # {'thumb': url, '400w': url, ...}: the resized copies built so far.
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = EquipmentImage
-        fields = ['id', 'stuff', 'url', 'alt', 'position']
+        fields = ['id', 'stuff', 'url', 'alt', 'position', 'srcset']
+
+    def get_srcset(self, obj):
+        request = self.context.get('request')
+        srcset = {}
+        for label, entry in obj.variants.items():
+            url = default_storage.url(entry['name'])
+            srcset[label] = request.build_absolute_uri(url) if request else url
+        return srcset
 class StuffManagementSerializer(serializers.ModelSerializer):
     class Meta:
         model = StuffManagement
@@ -39,7 +51,8 @@ class StuffSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Stuff
-        fields = '__all__'
+        exclude = ('search_vector', 'change_txid', 'trending_score', 'revenue')
+        read_only_fields = ('num_views', 'num_favorites', 'num_rentals', 'num_reviews', 'rating_sum', 'avg_rating')
 
     def to_internal_value(self, data):
         if isinstance(data, QueryDict):
@@ -146,6 +159,21 @@ class StuffSerializer(serializers.ModelSerializer):
         return instance
 
 
+class StuffMetricsSerializer(serializers.ModelSerializer):
+    rentals_count = serializers.IntegerField(read_only=True)
+    revenue_total = serializers.FloatField(read_only=True)
+    rating_avg = serializers.FloatField(read_only=True)
+    views_count = serializers.IntegerField(read_only=True)
+    conversion_pct = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Stuff
+        fields = [
+            'id', 'stuffname', 'category', 'user', 'status', 'price_per_day',
+            'rentals_count', 'revenue_total', 'rating_avg', 'views_count', 'conversion_pct',
+        ]
+
+
 # ======================= New Serializers =======================
 
 class VisitorSerializer(serializers.ModelSerializer):
@@ -166,6 +194,26 @@ class CartActivitySerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('timestamp',)
 
+
+# Ingestion forms of the tracking events: foreign keys are plain ids so a whole
+# batch can be checked with one query per referenced table (see EventIngestionMixin).
+
+class ItemViewEventSerializer(serializers.ModelSerializer):
+    stuff = serializers.IntegerField(source='stuff_id')
+
+    class Meta:
+        model = ItemView
+        fields = ['stuff', 'user', 'source', 'device_type']
+
+
+class CartActivityEventSerializer(serializers.ModelSerializer):
+    visitor = serializers.CharField(source='visitor_id', max_length=40)
+    stuff = serializers.IntegerField(source='stuff_id')
+
+    class Meta:
+        model = CartActivity
+        fields = ['visitor', 'stuff', 'action']
+
     
 
 
@@ -176,6 +224,13 @@ class RentalSerializer(serializers.ModelSerializer):
         model = Rental
         fields = '__all__'
 
+    def validate(self, attrs):
+        start_date = attrs.get('start_date', getattr(self.instance, 'start_date', None))
+        end_date = attrs.get('end_date', getattr(self.instance, 'end_date', None))
+        if start_date and end_date and end_date <= start_date:
+            raise serializers.ValidationError({'end_date': 'Must be after start_date.'})
+        return attrs
+
 class SiteStatSerializer(serializers.ModelSerializer):
     class Meta:
         model = SiteStat
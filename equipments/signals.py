@@ -0,0 +1,200 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import counters, images, response_cache, storage, trending
+from .models import CartActivity, Category, EquipmentImage, Favorite, ItemView, Rental, Review, Stuff, StuffManagement
+
+# ItemView deletes are deliberately not handled here: a post_delete receiver
+# would stop Django from fast-deleting the (very large) view table when a
+# Stuff is removed. ItemViewViewSet decrements explicitly and
+# reconcile_counters repairs anything else.
+
+
+@receiver(post_save, sender=ItemView)
+def count_item_view(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(instance.stuff_id, 'num_views')
+        trending.record(instance.stuff_id, 'view', instance.timestamp)
+
+
+@receiver(post_save, sender=CartActivity)
+def score_cart_add(sender, instance, created, **kwargs):
+    if created and instance.action == 'add':
+        trending.record(instance.stuff_id, 'cart', instance.timestamp)
+
+
+@receiver(post_save, sender=Favorite)
+def count_favorite(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(instance.stuff_id, 'num_favorites')
+        trending.record(instance.stuff_id, 'favorite', instance.timestamp)
+
+
+@receiver(post_delete, sender=Favorite)
+def uncount_favorite(sender, instance, **kwargs):
+    counters.increment(instance.stuff_id, 'num_favorites', -1)
+
+
+@receiver(pre_save, sender=Rental)
+def remember_rental_price(sender, instance, **kwargs):
+    instance._stored_price = instance._stored_stuff_id = None
+    if instance.pk:
+        instance._stored_price, instance._stored_stuff_id = (
+            Rental.objects.filter(pk=instance.pk).values_list('total_price', 'stuff_id').first() or (None, None)
+        )
+
+
+@receiver(post_save, sender=Rental)
+def count_rental(sender, instance, created, **kwargs):
+    stored = getattr(instance, '_stored_price', None)
+    stored_stuff_id = getattr(instance, '_stored_stuff_id', None)
+    if created:
+        counters.increment(instance.stuff_id, 'num_rentals')
+        counters.increment(instance.stuff_id, 'revenue', instance.total_price)
+        trending.record(instance.stuff_id, 'rental', instance.created_at)
+    elif stored_stuff_id is not None and stored_stuff_id != instance.stuff_id:
+        # The rental moved to another item, which takes over its counts.
+        with transaction.atomic():
+            counters.increment_many('num_rentals', {stored_stuff_id: -1, instance.stuff_id: 1})
+            counters.increment_many('revenue', {stored_stuff_id: -stored, instance.stuff_id: instance.total_price})
+    elif stored is not None and stored != instance.total_price:
+        counters.increment(instance.stuff_id, 'revenue', instance.total_price - stored)
+
+
+@receiver(post_delete, sender=Rental)
+def uncount_rental(sender, instance, **kwargs):
+    counters.increment(instance.stuff_id, 'num_rentals', -1)
+    counters.increment(instance.stuff_id, 'revenue', -instance.total_price)
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    # Edits only need the difference with the stored rating.
+    instance._stored_rating = instance._stored_product_id = None
+    if instance.pk:
+        instance._stored_rating, instance._stored_product_id = (
+            Review.objects.filter(pk=instance.pk).values_list('rating', 'product_id').first() or (None, None)
+        )
+
+
+@receiver(post_save, sender=Review)
+def count_review(sender, instance, created, **kwargs):
+    stored = getattr(instance, '_stored_rating', None)
+    stored_product_id = getattr(instance, '_stored_product_id', None)
+    if created:
+        counters.change_rating(instance.product_id, instance.rating, 1)
+    elif stored_product_id is not None and stored_product_id != instance.product_id:
+        with transaction.atomic():
+            counters.change_rating(stored_product_id, -stored, -1)
+            counters.change_rating(instance.product_id, instance.rating, 1)
+    elif stored is not None and stored != instance.rating:
+        counters.change_rating(instance.product_id, instance.rating - stored, 0)
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review(sender, instance, **kwargs):
+    counters.change_rating(instance.product_id, -instance.rating, -1)
+
+
+@receiver(pre_save, sender=EquipmentImage)
+def remember_image_file(sender, instance, **kwargs):
+    instance._stored_url = instance._stored_stuff_id = None
+    if instance.pk:
+        instance._stored_url, instance._stored_stuff_id = (
+            EquipmentImage.objects.filter(pk=instance.pk).values_list('url', 'stuff_id').first() or (None, None)
+        )
+
+
+@receiver(post_save, sender=EquipmentImage)
+def build_image_variants(sender, instance, created, **kwargs):
+    stored = getattr(instance, '_stored_url', None)
+    if created or instance.url.name != stored:
+        storage.acquire(instance.url.name)
+        storage.release(stored)
+        image_id = instance.id
+        transaction.on_commit(lambda: images.schedule(image_id))
+
+
+@receiver(post_delete, sender=EquipmentImage)
+def delete_image_variants(sender, instance, **kwargs):
+    storage.release(instance.url.name)
+    names = [entry['name'] for entry in instance.variants.values()]
+    if names:
+        transaction.on_commit(lambda: images.delete_files(names))
+
+
+@receiver(pre_save, sender=StuffManagement)
+def remember_contract_file(sender, instance, **kwargs):
+    instance._stored_contract = None
+    if instance.pk:
+        instance._stored_contract = (
+            StuffManagement.objects.filter(pk=instance.pk).values_list('contract_required', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=StuffManagement)
+def reference_contract_file(sender, instance, created, **kwargs):
+    stored = getattr(instance, '_stored_contract', None)
+    if instance.contract_required.name != stored:
+        storage.acquire(instance.contract_required.name)
+        storage.release(stored)
+
+
+@receiver(post_delete, sender=StuffManagement)
+def release_contract_file(sender, instance, **kwargs):
+    storage.release(instance.contract_required.name)
+
+
+# Response cache invalidation (see equipments/response_cache.py), and
+# Stuff.updated_at of the items whose representation embeds the changed row.
+# A Category or StuffManagement delete sets the items' foreign key to NULL
+# before post_delete is sent, so those items are looked up in pre_delete.
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_categories(sender, instance, **kwargs):
+    response_cache.invalidate('categories')
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=StuffManagement)
+def detach_stuffs(sender, instance, **kwargs):
+    related = instance.stuffs if sender is Category else instance.managed_stuffs
+    stuff_ids = list(related.values_list('id', flat=True))
+    if stuff_ids:
+        Stuff.objects.filter(pk__in=stuff_ids).touch()
+        response_cache.invalidate(*[f'stuff:{stuff_id}' for stuff_id in stuff_ids])
+
+
+@receiver(post_save, sender=Stuff)
+@receiver(post_delete, sender=Stuff)
+def invalidate_stuff(sender, instance, **kwargs):
+    response_cache.invalidate(f'stuff:{instance.pk}')
+
+
+@receiver(post_save, sender=Rental)
+@receiver(post_delete, sender=Rental)
+def invalidate_rented_stuff(sender, instance, **kwargs):
+    # Retrieves filtered on available_from/available_to depend on the
+    # item's rentals; the representation itself does not, so no touch().
+    stuff_ids = {instance.stuff_id, getattr(instance, '_stored_stuff_id', None)} - {None}
+    response_cache.invalidate(*[f'stuff:{stuff_id}' for stuff_id in stuff_ids])
+
+
+@receiver(post_save, sender=StuffManagement)
+def touch_managed_stuffs(sender, instance, created, **kwargs):
+    if not created:
+        stuff_ids = list(instance.managed_stuffs.values_list('id', flat=True))
+        if stuff_ids:
+            Stuff.objects.filter(pk__in=stuff_ids).touch()
+            response_cache.invalidate(*[f'stuff:{stuff_id}' for stuff_id in stuff_ids])
+
+
+@receiver(post_save, sender=EquipmentImage)
+@receiver(post_delete, sender=EquipmentImage)
+def touch_image_stuff(sender, instance, **kwargs):
+    stuff_ids = {instance.stuff_id, getattr(instance, '_stored_stuff_id', None)} - {None}
+    if stuff_ids:
+        Stuff.objects.filter(pk__in=stuff_ids).touch()
+        response_cache.invalidate(*[scope for stuff_id in stuff_ids for scope in (f'stuff:{stuff_id}', f'images:{stuff_id}')])
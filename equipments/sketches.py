@@ -0,0 +1,137 @@
+"""
+Approximate unique visitors over any date range, from HyperLogLog sketches.
+
+SiteStat.total_visitors counts Visitor sessions by their last visit, and
+exact distinct users per item, source or device over a range would need a
+COUNT(DISTINCT) over all of its views. Instead, every day has a VisitorSketch
+of the users who viewed items, site-wide and per item, category, source and
+device: 2^PRECISION one-byte registers, each holding the highest rank (1 +
+leading zero bits) of the hashes of the users it received. Sketches merge by
+taking the maximum of each register, so the sketch of a range is the merge
+of its days' and its estimate is off by about 1.04 / sqrt(2^PRECISION), 1.6%.
+
+add_views() adds the users of a set of item views to the sketches; the
+incremental aggregation (equipments.incremental) calls it for the views it
+folds, and rollup_range() rebuilds the sketches of the days it recomputes.
+Views without a user are not counted. PostgreSQL compresses the registers of
+the many sparse sketches, so most take far less than 4 KB.
+"""
+import hashlib
+import math
+from collections import defaultdict
+
+import numpy as np
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ItemView, Stuff, VisitorSketch
+
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+_LOW_BITS = 64 - PRECISION
+
+# Dimensions of the sketches; 'site' has a single, empty value.
+DIMENSIONS = ('site', 'stuff', 'category', 'source', 'device')
+
+# Values whose sketches unique_visitors() merges at a time: a breakdown per
+# item has a sketch per item and day, and only this many merged ones are held.
+VALUES_PER_CHUNK = 500
+
+
+def position(user):
+    """(register, rank) of a user: the first PRECISION bits of its hash pick the register."""
+    digest = int.from_bytes(hashlib.blake2b(str(user).encode(), digest_size=8).digest(), 'big')
+    return digest >> _LOW_BITS, _LOW_BITS - (digest & ((1 << _LOW_BITS) - 1)).bit_length() + 1
+
+
+def sketch_of(positions):
+    """Registers of the users at positions, [(register, rank)]."""
+    registers = np.zeros(REGISTERS, dtype=np.uint8)
+    if positions:
+        indices, ranks = zip(*positions)
+        np.maximum.at(registers, np.array(indices, dtype=np.int64), np.array(ranks, dtype=np.uint8))
+    return registers
+
+
+def load(data):
+    return np.frombuffer(bytes(data), dtype=np.uint8)
+
+
+def estimate(registers):
+    """Number of distinct users added to registers."""
+    alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+    raw = alpha * REGISTERS ** 2 / np.sum(np.exp2(-registers.astype(np.float64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if raw <= 2.5 * REGISTERS and zeros:
+        # Small cardinalities: linear counting of the empty registers is more accurate.
+        return round(REGISTERS * math.log(REGISTERS / zeros))
+    return round(raw)
+
+
+def add_views(conditions, params):
+    """
+    Add the users of the item views matching conditions (SQL over the view
+    table aliased v, with params) to their days' sketches. Returns the
+    number of sketches written.
+    """
+    sql = f"""
+        SELECT DISTINCT (v.timestamp AT TIME ZONE %s)::date, v.user, v.stuff_id, s.category_id,
+               v.source, v.device_type
+        FROM {ItemView._meta.db_table} v
+        JOIN {Stuff._meta.db_table} s ON s.id = v.stuff_id
+        WHERE {' AND '.join(['v.user IS NOT NULL'] + conditions)}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [timezone.get_current_timezone_name()] + params)
+        rows = cursor.fetchall()
+
+    positions = {}
+    users = defaultdict(list)
+    for day, user, stuff_id, category_id, source, device_type in rows:
+        if user not in positions:
+            positions[user] = position(user)
+        keys = [('site', ''), ('stuff', str(stuff_id)), ('source', source), ('device', device_type)]
+        if category_id is not None:
+            keys.append(('category', str(category_id)))
+        for dimension, value in keys:
+            users[day, dimension, value].append(positions[user])
+    if not users:
+        return 0
+
+    sketches = {key: sketch_of(key_positions) for key, key_positions in users.items()}
+    wanted = defaultdict(list)
+    for day, dimension, value in sketches:
+        wanted[day, dimension].append(value)
+    stored_keys = Q()
+    for (day, dimension), values in wanted.items():
+        stored_keys |= Q(date=day, dimension=dimension, value__in=values)
+    for stored in VisitorSketch.objects.filter(stored_keys):
+        key = (stored.date, stored.dimension, stored.value)
+        sketches[key] = np.maximum(sketches[key], load(stored.registers))
+    VisitorSketch.objects.bulk_create(
+        [VisitorSketch(date=day, dimension=dimension, value=value, registers=registers.tobytes())
+         for (day, dimension, value), registers in sketches.items()],
+        update_conflicts=True, unique_fields=['date', 'dimension', 'value'], update_fields=['registers'],
+    )
+    return len(sketches)
+
+
+def unique_visitors(since, until, dimension='site', values=None):
+    """
+    {value: estimated distinct users} over the days since..until inclusive,
+    for every value of dimension seen then, or only those in values.
+    """
+    sketches = VisitorSketch.objects.filter(date__range=(since, until), dimension=dimension)
+    if values is None:
+        values = sketches.order_by('value').values_list('value', flat=True).distinct()
+    values = [str(value) for value in values]
+    estimates = {}
+    for offset in range(0, len(values), VALUES_PER_CHUNK):
+        merged = {}
+        rows = sketches.filter(value__in=values[offset:offset + VALUES_PER_CHUNK]).values_list('value', 'registers')
+        for value, registers in rows.iterator(chunk_size=VALUES_PER_CHUNK):
+            registers = load(registers)
+            merged[value] = np.maximum(merged[value], registers) if value in merged else registers
+        estimates.update((value, estimate(registers)) for value, registers in merged.items())
+    return estimates
@@ -0,0 +1,154 @@
+"""
+Content-addressed, deduplicated storage for uploaded files.
+
+ContentAddressedStorage hashes an upload (SHA-256) while streaming it to a
+temporary file and stores it as <upload_to>/<hash[:2]>/<hash><ext>. A file
+uploaded again resolves to the blob already on disk, so each distinct
+content is stored once. Every blob has a Blob row whose refcount is kept by
+the signals of the fields using this storage; collect_garbage() deletes the
+blobs nobody references anymore. Blob names never change content, so they
+can be cached forever.
+
+delete() leaves blobs alone, since other rows may share them: they are only
+removed by collect_garbage() (the collect_blobs command).
+"""
+import datetime
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+# <dir>/<2 hex>/<64 hex>[.ext]: the names produced by ContentAddressedStorage.
+BLOB_NAME = re.compile(r'^(?:.+/)?([0-9a-f]{2})/\1[0-9a-f]{62}(?:\.[A-Za-z0-9]+)?$')
+
+
+def is_blob(name):
+    return bool(name) and bool(BLOB_NAME.match(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    chunk_size = 1024 * 1024
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is chosen by _save() from the content, and an
+        # existing file with that name already holds the same bytes.
+        return name
+
+    def _save(self, name, content):
+        # Models live in models.py, which imports this module.
+        from .models import Blob
+
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        os.makedirs(self.path(directory or '.'), exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        handle, temp_path = tempfile.mkstemp(dir=self.path(directory or '.'), prefix='.upload-')
+        try:
+            with os.fdopen(handle, 'wb') as temp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(self.chunk_size):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    temp.write(chunk)
+            sha256 = digest.hexdigest()
+            blob_name = '/'.join(filter(None, [directory, sha256[:2], sha256 + extension]))
+            # Touching the row first makes a concurrent collect_garbage() skip
+            # the blob; if the row is gone (or never existed) write the file.
+            reused = Blob.objects.filter(name=blob_name).update(last_used_at=timezone.now())
+            if reused and self.exists(blob_name):
+                return blob_name
+            os.makedirs(os.path.dirname(self.path(blob_name)), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            os.replace(temp_path, self.path(blob_name))
+            Blob.objects.bulk_create([Blob(name=blob_name, sha256=sha256, size=size)], ignore_conflicts=True)
+            return blob_name
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def delete(self, name):
+        if not is_blob(name):
+            super().delete(name)
+
+    def delete_blob(self, name):
+        super().delete(name)
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def acquire(name, delta=1):
+    """Add delta references to the blob called name (no-op for other names)."""
+    from .models import Blob
+
+    if is_blob(name):
+        Blob.objects.filter(name=name).update(refcount=F('refcount') + delta)
+
+
+def release(name):
+    acquire(name, -1)
+
+
+def referencing_fields():
+    """(model, field name) of every file field stored in blob_storage."""
+    from django.apps import apps
+
+    return [
+        (model, field.name)
+        for model in apps.get_app_config('equipments').get_models()
+        for field in model._meta.get_fields()
+        if getattr(field, 'storage', None) is blob_storage
+    ]
+
+
+def recount():
+    """Recompute every refcount from the referencing rows. Returns the number of blobs fixed."""
+    from .models import Blob
+
+    expected = {}
+    for model, field in referencing_fields():
+        rows = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+        for name, count in rows.order_by().values_list(field).annotate(count=Count('pk')):
+            expected[name] = expected.get(name, 0) + count
+    fixed = 0
+    with transaction.atomic():
+        for blob in Blob.objects.select_for_update().only('name', 'refcount'):
+            if blob.refcount != expected.get(blob.name, 0):
+                Blob.objects.filter(name=blob.name).update(refcount=expected.get(blob.name, 0))
+                fixed += 1
+    return fixed
+
+
+def collect_garbage(grace=datetime.timedelta(hours=1)):
+    """
+    Delete the blobs left unreferenced for longer than grace, the window in
+    which a fresh upload is saved before its row is. Returns (blobs, bytes) freed.
+    """
+    from .models import Blob
+
+    cutoff = timezone.now() - grace
+    freed = [0, 0]
+    candidates = Blob.objects.filter(refcount__lte=0, last_used_at__lt=cutoff).values_list('name', flat=True)
+    for name in list(candidates):
+        with transaction.atomic():
+            blob = (
+                Blob.objects.select_for_update(skip_locked=True)
+                .filter(name=name, refcount__lte=0, last_used_at__lt=cutoff).first()
+            )
+            if blob is None:
+                continue
+            blob_storage.delete_blob(blob.name)
+            blob.delete()
+            freed[0] += 1
+            freed[1] += blob.size
+    return tuple(freed)
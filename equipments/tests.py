@@ -1,3 +1,1397 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import pika
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date
+from PIL import Image
+from rest_framework.test import APIClient
+
+from .incremental import fold_new_events
+from .ingest import EventBuffer, _count_views
+from .models import (
+    BOOKED_STATUSES, Blob, CartActivity, Category, CategoryStat, DeviceStat, EquipmentImage, Favorite, ItemView,
+    OutboxEvent, Rental, Review, SiteStat, Stuff, StuffManagement, TrafficSource, Visitor, VisitorSketch,
+)
+from .outbox import OutboxPublisher
+from .partitions import add_months, current_month, ensure_partitions, expire, month_bounds, monthly_partitions
+from .related import build_related
+from .rollups import rollup_range
+from .serializers import EquipmentImageSerializer
+from .sketches import estimate, position, sketch_of
+from .storage import collect_garbage, recount
+from .trending import rebuild as rebuild_trending, record as record_trending
+from .users import UserDirectory
+from .views import StuffViewSet
+
+
+def make_stuff(category=None, images=2, **kwargs):
+    management = StuffManagement.objects.create(name='management', rental_zone='nabeul')
+    stuff = Stuff.objects.create(
+        stuffname=kwargs.pop('stuffname', 'drill'),
+        price_per_day=kwargs.pop('price_per_day', 10),
+        detailed_description=kwargs.pop('detailed_description', 'description'),
+        category=category,
+        stuff_management=management,
+        user='owner',
+        **kwargs
+    )
+    for position in range(images):
+        EquipmentImage.objects.create(stuff=stuff, url=f'equipment_images/{position}.jpg', position=position)
+    return stuff
+
+
+class StuffQueryBudgetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='tools')
+
+    def test_list_stays_within_budget_whatever_the_page_size(self):
+        for count in (1, 25):
+            for _ in range(count):
+                make_stuff(self.category)
+            with self.assertNumQueries(StuffViewSet.query_budget['list']):
+                response = self.client.get('/api/stuffs/')
+            self.assertEqual(response.status_code, 200)
+
+    def test_filtered_list_stays_within_budget(self):
+        for _ in range(5):
+            make_stuff(self.category)
+        with self.assertNumQueries(StuffViewSet.query_budget['list']):
+            response = self.client.get('/api/stuffs/', {'category': self.category.id, 'rental_zone': 'nabeul'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_retrieve_stays_within_budget(self):
+        stuff = make_stuff(self.category, images=5)
+        with self.assertNumQueries(StuffViewSet.query_budget['retrieve']):
+            response = self.client.get(f'/api/stuffs/{stuff.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['equipment_images']), 5)
+        self.assertEqual(response.data['stuff_management']['rental_zone'], 'nabeul')
+
+    def test_metrics_stay_within_budget(self):
+        drill, saw = make_stuff(self.category), make_stuff(self.category, stuffname='saw')
+        for _ in range(3):
+            make_stuff(self.category)
+
+        def at(day):
+            return timezone.make_aware(datetime.datetime.combine(datetime.date.fromisoformat(day), datetime.time(12)))
+
+        for stuff, day, price, rating, views in (
+            (drill, '2025-05-20', 40, 2, 2),
+            (drill, '2025-06-10', 60, 4, 3),
+            (drill, '2025-06-20', None, None, 1),
+            (saw, '2025-06-10', None, None, 1),
+            (saw, '2025-06-25', 30, 5, 0),
+        ):
+            if price is not None:
+                start = at(day).date()
+                rental = Rental.objects.create(stuff=stuff, customer=1, total_price=price, start_date=start,
+                                               end_date=start + datetime.timedelta(days=1))
+                Rental.objects.filter(pk=rental.pk).update(created_at=at(day))
+                review = Review.objects.create(product=stuff, customer='alice', rating=rating)
+                Review.objects.filter(pk=review.pk).update(created_at=at(day).date())
+            created = ItemView.objects.bulk_create(
+                [ItemView(stuff=stuff, user='alice', source='direct', device_type='mobile') for _ in range(views)]
+            )
+            ItemView.objects.filter(pk__in=[view.pk for view in created]).update(timestamp=at(day))
+
+        def metrics(**params):
+            with self.assertNumQueries(StuffViewSet.query_budget['metrics']):
+                response = self.client.get('/api/stuffs/metrics/', {'ordering': '-views_count', **params})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data), 5)
+            return {
+                row['id']: (row['rentals_count'], row['revenue_total'], row['rating_avg'], row['views_count'],
+                            round(row['conversion_pct'], 2))
+                for row in response.data[:2]
+            }
+
+        self.assertEqual(metrics(), {drill.id: (2, 100.0, 3.0, 6, 33.33), saw.id: (1, 30.0, 5.0, 1, 100.0)})
+        self.assertEqual(
+            metrics(since='2025-06-01'), {drill.id: (1, 60.0, 4.0, 4, 25.0), saw.id: (1, 30.0, 5.0, 1, 100.0)},
+        )
+        # until is inclusive.
+        self.assertEqual(
+            metrics(since='2025-06-01', until='2025-06-10'),
+            {drill.id: (1, 60.0, 4.0, 3, 33.33), saw.id: (0, 0.0, 0.0, 1, 0.0)},
+        )
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.stuff = make_stuff(images=0)
+
+    def counters(self):
+        self.stuff.refresh_from_db()
+        return {field: getattr(self.stuff, field) for field in (
+            'num_views', 'num_favorites', 'num_rentals', 'num_reviews', 'rating_sum', 'avg_rating', 'revenue',
+        )}
+
+    def rent(self, total_price):
+        start = datetime.date(2025, 6, 1) + datetime.timedelta(days=3 * Rental.objects.count())
+        return Rental.objects.create(stuff=self.stuff, customer=1, total_price=total_price,
+                                     start_date=start, end_date=start + datetime.timedelta(days=2))
+
+    def test_events_increment_and_decrement_the_counters(self):
+        ItemView.objects.create(stuff=self.stuff, user='alice', source='direct', device_type='mobile')
+        favorite = Favorite.objects.create(stuff=self.stuff, user='alice')
+        rental = self.rent(30)
+        self.rent(12.5)
+        self.assertEqual(self.counters(), {
+            'num_views': 1, 'num_favorites': 1, 'num_rentals': 2, 'num_reviews': 0, 'rating_sum': 0,
+            'avg_rating': 0.0, 'revenue': 42.5,
+        })
+        rental.total_price = 40
+        rental.save()
+        self.assertEqual(self.counters()['revenue'], 52.5)
+        favorite.delete()
+        rental.delete()
+        counters = self.counters()
+        self.assertEqual((counters['num_favorites'], counters['num_rentals'], counters['revenue']), (0, 1, 12.5))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.stuff.total_revenue(), 12.5)
+
+    def test_reviews_update_the_rating(self):
+        first = Review.objects.create(product=self.stuff, customer='alice', rating=4)
+        second = Review.objects.create(product=self.stuff, customer='bob', rating=2)
+        self.assertEqual(self.counters()['avg_rating'], 3.0)
+        second.rating = 5
+        second.save()
+        counters = self.counters()
+        self.assertEqual((counters['num_reviews'], counters['rating_sum'], counters['avg_rating']), (2, 9, 4.5))
+        first.delete()
+        self.assertEqual(self.counters()['avg_rating'], 5.0)
+        second.delete()
+        counters = self.counters()
+        self.assertEqual((counters['num_reviews'], counters['rating_sum'], counters['avg_rating']), (0, 0, 0.0))
+
+    def test_moving_an_event_to_another_item_moves_its_counts(self):
+        other = make_stuff(images=0)
+        rental = self.rent(30)
+        self.rent(12.5)
+        review = Review.objects.create(product=self.stuff, customer='alice', rating=4)
+        Review.objects.create(product=self.stuff, customer='bob', rating=2)
+        rental.stuff = other
+        rental.save()
+        review.product = other
+        review.save()
+        counters = self.counters()
+        self.assertEqual(
+            (counters['num_rentals'], counters['revenue'], counters['num_reviews'], counters['avg_rating']),
+            (1, 12.5, 1, 2.0),
+        )
+        other.refresh_from_db()
+        self.assertEqual((other.num_rentals, other.revenue, other.num_reviews, other.avg_rating), (1, 30, 1, 4.0))
+        output = io.StringIO()
+        call_command('reconcile_counters', stdout=output)
+        self.assertIn('Repaired counters on 0 item(s).', output.getvalue())
+
+    def test_decrements_stop_at_zero(self):
+        # Deleted behind the signals' back, e.g. by a bulk delete of the events.
+        favorite = Favorite.objects.create(stuff=self.stuff, user='alice')
+        review = Review.objects.create(product=self.stuff, customer='alice', rating=4)
+        Stuff.objects.filter(pk=self.stuff.pk).update(num_favorites=0, num_reviews=0, rating_sum=0)
+        favorite.delete()
+        review.delete()
+        counters = self.counters()
+        self.assertEqual((counters['num_favorites'], counters['num_reviews'], counters['rating_sum']), (0, 0, 0))
+
+    def test_saving_an_item_keeps_concurrent_increments(self):
+        client = APIClient()
+        stale = Stuff.objects.get(pk=self.stuff.pk)
+        ItemView.objects.create(stuff=self.stuff, user='alice', source='direct', device_type='mobile')
+        self.rent(20)
+        stale.stuffname = 'hammer drill'
+        stale.save()
+        counters = self.counters()
+        self.assertEqual((counters['num_views'], counters['num_rentals'], counters['revenue']), (1, 1, 20.0))
+        self.assertGreater(self.stuff.trending_score, 0)
+        self.assertEqual(self.stuff.stuffname, 'hammer drill')
+
+        # The API loads the item, then saves it.
+        get_object = StuffViewSet.get_object
+
+        def get_object_then_favorite(view):
+            stuff = get_object(view)
+            Favorite.objects.create(stuff=self.stuff, user='bob')
+            return stuff
+        with mock.patch.object(StuffViewSet, 'get_object', get_object_then_favorite):
+            self.assertEqual(client.post(f'/api/stuffs/{self.stuff.id}/publish/').status_code, 200)
+        self.assertEqual(self.counters()['num_favorites'], 1)
+        self.assertEqual(self.stuff.status, 'published')
+
+    def test_reconcile_counters_repairs_drift(self):
+        ItemView.objects.bulk_create(
+            [ItemView(stuff=self.stuff, user='alice', source='direct', device_type='mobile') for _ in range(3)]
+        )
+        Review.objects.create(product=self.stuff, customer='alice', rating=4)
+        self.rent(0.1)
+        self.rent(0.2)
+        untouched = make_stuff(images=0)
+        Stuff.objects.filter(pk=self.stuff.pk).update(num_reviews=5, avg_rating=1.0)
+
+        output = io.StringIO()
+        call_command('reconcile_counters', batch_size=1, stdout=output)
+        self.assertIn('Repaired counters on 1 item(s).', output.getvalue())
+        self.assertEqual(self.counters(), {
+            'num_views': 3, 'num_favorites': 0, 'num_rentals': 2, 'num_reviews': 1, 'rating_sum': 4,
+            'avg_rating': 4.0, 'revenue': self.stuff.revenue,
+        })
+        self.assertAlmostEqual(self.stuff.revenue, 0.3)
+        untouched.refresh_from_db()
+        self.assertEqual(untouched.num_views, 0)
+        # Revenues summed in another order are not drift.
+        call_command('reconcile_counters', stdout=output)
+        self.assertIn('Repaired counters on 0 item(s).', output.getvalue())
+
+
+class BookingTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.stuff = make_stuff(images=0)
+
+    def book(self, start, end, **extra):
+        return self.client.post('/api/rentals/', {
+            'stuff': self.stuff.id, 'customer': 1, 'total_price': 10,
+            'start_date': start, 'end_date': end, **extra,
+        }, format='json')
+
+    def test_overlapping_booking_is_a_conflict(self):
+        self.assertEqual(self.book('2025-06-01', '2025-06-05').status_code, 201)
+        response = self.book('2025-06-04', '2025-06-08')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['detail'].code, 'booking_conflict')
+
+    def test_back_to_back_and_cancelled_bookings_are_allowed(self):
+        self.assertEqual(self.book('2025-06-01', '2025-06-05').status_code, 201)
+        self.assertEqual(self.book('2025-06-05', '2025-06-08').status_code, 201)
+        self.assertEqual(self.book('2025-06-02', '2025-06-03', status='cancelled').status_code, 201)
+
+    def test_end_date_must_follow_start_date(self):
+        self.assertEqual(self.book('2025-06-05', '2025-06-05').status_code, 400)
+        # An empty [start, end) period would escape the overlap constraint.
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Rental.objects.create(stuff=self.stuff, customer=1, total_price=10,
+                                  start_date=datetime.date(2025, 6, 5), end_date=datetime.date(2025, 6, 5))
+
+
+class UtilizationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.busy = make_stuff(images=0)
+        self.idle = make_stuff(images=0)
+        StuffManagement.objects.filter(pk=self.idle.stuff_management_id).update(rental_zone='tunis')
+
+    def rent(self, stuff, start, end, status='confirmed'):
+        Rental.objects.create(stuff=stuff, customer=1, total_price=10, status=status,
+                              start_date=datetime.date.fromisoformat(start), end_date=datetime.date.fromisoformat(end))
+
+    def test_report_counts_rented_days_per_item_zone_and_fleet(self):
+        # 2025-06-01..10: June 1-3 and 9-12 (clipped to 9-10) booked, the cancelled rental ignored.
+        self.rent(self.busy, '2025-06-01', '2025-06-04')
+        self.rent(self.busy, '2025-06-09', '2025-06-13')
+        self.rent(self.idle, '2025-06-02', '2025-06-06', status='cancelled')
+        with self.assertNumQueries(StuffViewSet.query_budget['utilization']):
+            response = self.client.get('/api/stuffs/utilization/', {'since': '2025-06-01', 'until': '2025-06-10'})
+        self.assertEqual(response.status_code, 200)
+        report = response.data
+        self.assertEqual(report['days'], 10)
+        self.assertEqual(report['items'][0], {'stuff': self.busy.id, 'rental_zone': 'nabeul',
+                                              'rented_days': 5, 'utilization': 50.0})
+        self.assertEqual(report['items'][1]['rented_days'], 0)
+        self.assertEqual(report['fleet']['utilization'], 25.0)
+        self.assertEqual(report['fleet']['daily_occupancy'][:4], [50.0, 50.0, 50.0, 0.0])
+        zones = {zone['rental_zone']: zone for zone in report['zones']}
+        self.assertEqual(zones['nabeul']['utilization'], 50.0)
+        self.assertEqual(zones['tunis']['daily_occupancy'], [0.0] * 10)
+
+    def test_management_utilization_rate(self):
+        self.rent(self.busy, '2025-06-01', '2025-06-04')
+        management = self.busy.stuff_management
+        rate = management.utilization_rate(datetime.date(2025, 6, 1), datetime.date(2025, 6, 6))
+        self.assertEqual(rate, 50.0)
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.rented, self.free, self.withdrawn = (make_stuff(images=0) for _ in range(3))
+        StuffManagement.objects.filter(pk=self.withdrawn.stuff_management_id).update(availability='Unavailable')
+        # Occupies June 1-4: June 5 is the return day, free for the next renter.
+        Rental.objects.create(stuff=self.rented, customer=1, total_price=10, status='confirmed',
+                              start_date=datetime.date(2025, 6, 1), end_date=datetime.date(2025, 6, 5))
+        Rental.objects.create(stuff=self.free, customer=1, total_price=10, status='cancelled',
+                              start_date=datetime.date(2025, 6, 1), end_date=datetime.date(2025, 6, 5))
+
+    def available(self, start, end):
+        response = self.client.get('/api/stuffs/', {'available_from': start, 'available_to': end})
+        self.assertEqual(response.status_code, 200)
+        return {item['id'] for item in response.data['results']}
+
+    def test_rentals_block_their_days_only(self):
+        everything = {self.rented.id, self.free.id}
+        for start, end, expected in (
+            ('2025-05-25', '2025-05-31', everything),
+            ('2025-05-25', '2025-06-01', {self.free.id}),
+            ('2025-06-02', '2025-06-03', {self.free.id}),
+            ('2025-06-04', '2025-06-04', {self.free.id}),
+            ('2025-06-05', '2025-06-09', everything),
+        ):
+            with self.subTest(start=start, end=end):
+                self.assertEqual(self.available(start, end), expected)
+        # Without dates, unavailable items are listed too.
+        self.assertEqual(len(self.client.get('/api/stuffs/').data['results']), 3)
+        self.assertEqual(
+            set(Stuff.objects.available_between(datetime.date(2025, 6, 4), datetime.date(2025, 6, 5))
+                .values_list('id', flat=True)),
+            {self.free.id},
+        )
+
+    def test_bad_dates_are_rejected(self):
+        for params in (
+            {'available_from': '2025-06-01'},
+            {'available_from': '2025-06-31', 'available_to': '2025-07-02'},
+            {'available_from': '2025-06-05', 'available_to': '2025-06-01'},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/stuffs/', params).status_code, 400)
+
+
+class EventIngestionTests(TransactionTestCase):
+    # The flusher thread writes through its own connection.
+
+    def setUp(self):
+        self.client = APIClient()
+        self.stuff = make_stuff(images=0)
+
+    def views(self, count, stuff=None):
+        # Built from ids like the API does, so deleting the item leaves them orphaned.
+        return [ItemView(stuff_id=(stuff or self.stuff).id, user='alice', source='direct', device_type='mobile')
+                for _ in range(count)]
+
+    def buffer(self, **options):
+        buffer = EventBuffer(ItemView, on_write=_count_views, **{'max_batch': 100, 'flush_interval': 60, **options})
+        self.addCleanup(buffer.stop)
+        return buffer
+
+    def wait_until_written(self, buffer, count):
+        deadline = time.monotonic() + 5
+        while buffer.stats()['written'] < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(buffer.stats()['written'], count)
+
+    def test_unbuffered_post_returns_the_created_events(self):
+        event = {'stuff': self.stuff.id, 'user': 'alice', 'source': 'direct', 'device_type': 'mobile'}
+        response = self.client.post('/api/item-views/', event, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['stuff'], self.stuff.id)
+        self.assertTrue(ItemView.objects.filter(pk=response.data['id']).exists())
+        response = self.client.post('/api/item-views/', [event, event], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 2)
+
+        self.stuff.refresh_from_db()
+        self.assertEqual(self.stuff.num_views, 3)
+        self.assertGreater(self.stuff.trending_score, 0)
+
+    def test_buffer_flushes_by_size_and_by_interval(self):
+        buffer = self.buffer(max_batch=3)
+        self.assertEqual(buffer.add(self.views(2)), 2)
+        time.sleep(0.1)
+        self.assertEqual(buffer.stats()['pending'], 2)
+        buffer.add(self.views(1))
+        self.wait_until_written(buffer, 3)
+
+        buffer = self.buffer(flush_interval=0.05)
+        buffer.add(self.views(1))
+        self.wait_until_written(buffer, 1)
+        self.stuff.refresh_from_db()
+        self.assertEqual(self.stuff.num_views, 4)
+
+    def test_overflowing_and_orphaned_events_are_dropped(self):
+        buffer = self.buffer(max_pending=3)
+        gone = make_stuff(images=0)
+        self.assertEqual(buffer.add(self.views(2) + self.views(1, stuff=gone)), 3)
+        self.assertEqual(buffer.add(self.views(1)), 0)
+        gone.delete()
+        self.assertEqual(buffer.flush(), 3)
+        stats = buffer.stats()
+        self.assertEqual((stats['written'], stats['dropped_overflow'], stats['dropped_invalid']), (2, 1, 1))
+        self.assertEqual(ItemView.objects.count(), 2)
+
+    def test_failed_flush_keeps_the_events(self):
+        buffer = self.buffer()
+        buffer.add(self.views(2))
+        with mock.patch.object(ItemView.objects, 'bulk_create', side_effect=DatabaseError('down')), \
+                self.assertLogs('equipments.ingest', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual((buffer.stats()['pending'], buffer.stats()['failed_flushes']), (2, 1))
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(ItemView.objects.count(), 2)
+        self.stuff.refresh_from_db()
+        self.assertEqual(self.stuff.num_views, 2)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        camping, tools = Category.objects.create(name='Camping'), Category.objects.create(name='Tools')
+        self.items = [make_stuff(images=0, category=camping), make_stuff(images=0, category=tools), make_stuff(images=0)]
+        self.days = [timezone.localdate() - datetime.timedelta(days=offset) for offset in (3, 2, 1)]
+        # Days before the oldest partition count as expired.
+        ensure_partitions(1, start=add_months(current_month(), -1))
+
+    def at(self, day, hour):
+        return timezone.make_aware(datetime.datetime.combine(day, datetime.time(hour)))
+
+    def seed(self):
+        sources, devices, users = ('direct', 'email', 'social'), ('mobile', 'desktop'), ('1', '2', '3', '4', None)
+        rng = random.Random(5)
+        for index, day in enumerate(self.days):
+            for hour in range(0, 24, 2):
+                view = ItemView.objects.create(
+                    stuff=rng.choice(self.items), user=rng.choice(users), source=rng.choice(sources),
+                    device_type=rng.choice(devices),
+                )
+                ItemView.objects.filter(pk=view.pk).update(timestamp=self.at(day, hour))
+            for customer in range(1, 4):
+                start = datetime.date(2025, 1, 1) + datetime.timedelta(days=10 * (index * 3 + customer))
+                rental = Rental.objects.create(
+                    stuff=rng.choice(self.items), customer=customer, total_price=10 * customer,
+                    start_date=start, end_date=start + datetime.timedelta(days=2),
+                )
+                Rental.objects.filter(pk=rental.pk).update(created_at=self.at(day, 12 + customer))
+            for number in range(index + 1):
+                Visitor.objects.create(session_key=f'{day}-{number}', ip_address='127.0.0.1', user_agent='test')
+                Visitor.objects.filter(session_key=f'{day}-{number}').update(last_visit=self.at(day, 8))
+
+    def raw(self, day):
+        """Every statistic of day, counted straight from the event tables."""
+        views = ItemView.objects.filter(timestamp__date=day)
+        rentals = Rental.objects.filter(created_at__date=day).with_attribution().values(
+            'source', 'device_type', 'stuff__category', 'total_price',
+        )
+        site = (
+            Visitor.objects.filter(last_visit__date=day).count(), views.count(),
+            len(rentals), sum(rental['total_price'] for rental in rentals),
+        )
+        grouped = {'source': {}, 'device_type': {}, 'stuff__category': {}}
+        for column, stats in grouped.items():
+            counted = Count('id') if column == 'stuff__category' else Count('user', distinct=True)
+            for row in views.exclude(**{f'{column}__isnull': True}).values(column).annotate(count=counted):
+                stats[row[column]] = [row['count'], 0, 0.0]
+            for rental in rentals:
+                if rental[column] is not None:
+                    stat = stats.setdefault(rental[column], [0, 0, 0.0])
+                    stat[1] += 1
+                    stat[2] += rental['total_price']
+        return site, grouped
+
+    def stored(self, day):
+        site = SiteStat.objects.get(date=day)
+        return (site.total_visitors, site.total_page_views, site.total_rentals, site.total_revenue), {
+            'source': {row.source: [row.visitors, row.rentals, row.revenue]
+                       for row in TrafficSource.objects.filter(date=day)},
+            'device_type': {row.device_type: [row.visitors, row.rentals, row.revenue]
+                            for row in DeviceStat.objects.filter(date=day)},
+            'stuff__category': {row.category_id: [row.views, row.rentals, row.revenue]
+                                for row in CategoryStat.objects.filter(date=day)},
+        }
+
+    def snapshot(self):
+        return [list(model.objects.order_by('pk').values()) for model in (SiteStat, TrafficSource, DeviceStat, CategoryStat)]
+
+    def test_rollup_matches_the_event_tables_and_is_idempotent(self):
+        self.seed()
+        self.assertEqual(rollup_range(self.days[0], self.days[-1]), 3)
+        for day in self.days:
+            self.assertEqual(self.stored(day), self.raw(day))
+        # Rentals are attributed to the source and device of a view.
+        self.assertTrue(TrafficSource.objects.filter(rentals__gt=0).exists())
+
+        snapshot = self.snapshot()
+        rollup_range(self.days[0], self.days[-1])
+        self.assertEqual(self.snapshot(), snapshot)
+
+        # Deleted events drop out of the stats on the next run.
+        ItemView.objects.filter(timestamp__date=self.days[1], source='email').delete()
+        rollup_range(self.days[1], self.days[1])
+        self.assertEqual(self.stored(self.days[1]), self.raw(self.days[1]))
+
+
+class IncrementalFoldTests(TestCase):
+    def setUp(self):
+        camping = Category.objects.create(name='Camping')
+        self.items = [make_stuff(images=0, category=camping), make_stuff(images=0)]
+        # Past SETTLE_SECONDS, one second apart so the attribution of rentals
+        # does not depend on the batch their views were folded in.
+        self.clock = timezone.now() - datetime.timedelta(minutes=10)
+        ensure_partitions(1, start=add_months(current_month(), -1))
+
+    def tick(self):
+        self.clock += datetime.timedelta(seconds=1)
+        return self.clock
+
+    def add_events(self, seed):
+        rng = random.Random(seed)
+        for _ in range(8):
+            view = ItemView.objects.create(
+                stuff=rng.choice(self.items), user=rng.choice(('1', '2', '3', None)),
+                source=rng.choice(('direct', 'email')), device_type=rng.choice(('mobile', 'desktop')),
+            )
+            ItemView.objects.filter(pk=view.pk).update(timestamp=self.tick())
+        for customer in (1, 2):
+            start = datetime.date(2025, 1, 1) + datetime.timedelta(days=10 * Rental.objects.count())
+            rental = Rental.objects.create(
+                stuff=rng.choice(self.items), customer=customer, total_price=15 * customer,
+                start_date=start, end_date=start + datetime.timedelta(days=2),
+            )
+            Rental.objects.filter(pk=rental.pk).update(created_at=self.tick())
+        Visitor.objects.create(session_key=f'session-{seed}', ip_address='127.0.0.1', user_agent='test')
+
+    def stats(self):
+        def rows(model, key):
+            return {
+                (row['date'], row[key]): {
+                    field: round(value, 6) if isinstance(value, float) else value
+                    for field, value in row.items() if field not in ('id', 'date', key)
+                }
+                for row in model.objects.values()
+            }
+        return [rows(SiteStat, 'date'), rows(TrafficSource, 'source'), rows(DeviceStat, 'device_type'),
+                rows(CategoryStat, 'category_id')]
+
+    def test_folding_in_batches_matches_a_full_rollup(self):
+        self.add_events(1)
+        self.assertEqual(fold_new_events(), {})  # The first run rolls the recent days up.
+        self.add_events(2)
+        self.assertEqual(fold_new_events(), {'itemview': 8, 'rental': 2})
+        self.add_events(3)
+        self.assertEqual(fold_new_events(), {'itemview': 8, 'rental': 2})
+        self.assertEqual(fold_new_events(), {'itemview': 0, 'rental': 0})
+        folded = self.stats()
+        self.assertEqual(sum(stat['total_page_views'] for stat in folded[0].values()), 24)
+
+        for model in (SiteStat, TrafficSource, DeviceStat, CategoryStat):
+            model.objects.all().delete()
+        today = timezone.localdate()
+        rollup_range(today - datetime.timedelta(days=1), today)
+        self.assertEqual(self.stats(), folded)
+
+
+class ReviewOutboxTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.stuff = make_stuff(images=0)
+
+    def test_review_creation_records_the_event(self):
+        response = self.client.post('/api/reviews/', {'product': self.stuff.id, 'customer': 'c1', 'rating': 4},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.event_type, 'review.created')
+        self.assertEqual(event.payload, {'review_id': response.data['id'], 'product_id': self.stuff.id,
+                                         'owner': 'owner'})
+
+    def test_unreachable_broker_keeps_events_without_charging_attempts(self):
+        event = OutboxEvent.objects.create(event_type='review.created', payload={'review_id': 1, 'owner': 'owner'})
+        publisher = OutboxPublisher(HOST='127.0.0.1', PORT=1)
+        with self.assertRaises(pika.exceptions.AMQPError):
+            publisher.run(once=True)
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('pending', 0))
+
+    def _publish(self, handler):
+        directory = UserDirectory('http://users.test', transport=httpx.MockTransport(handler))
+        self.addCleanup(directory.close)
+        publisher = OutboxPublisher()
+        channel = mock.Mock()
+        with mock.patch('equipments.users.get_directory', return_value=directory), \
+                mock.patch.object(publisher, '_open_channel', return_value=channel):
+            publisher.publish_batch()
+        return channel
+
+    def test_user_service_outage_defers_events_without_charging_attempts(self):
+        review = Review.objects.create(product=self.stuff, customer='c1', rating=4)
+        event = OutboxEvent.objects.create(event_type='review.created',
+                                           payload={'review_id': review.id, 'owner': 'owner'})
+
+        def unreachable(request):
+            raise httpx.ConnectTimeout('timed out', request=request)
+
+        delays = []
+        with self.assertLogs('equipments.users', 'WARNING'):
+            for _ in range(OutboxPublisher().config['MAX_ATTEMPTS'] + 2):
+                OutboxEvent.objects.filter(pk=event.pk).update(next_attempt_at=timezone.now())
+                channel = self._publish(unreachable)
+                channel.basic_publish.assert_not_called()
+                event.refresh_from_db()
+                self.assertEqual((event.status, event.attempts), ('pending', 0))
+                delays.append(event.next_attempt_at - timezone.now())
+        self.assertTrue(all(delay > datetime.timedelta(0) for delay in delays))
+        self.assertIn('DependencyUnavailable', event.last_error)
+
+        OutboxEvent.objects.filter(pk=event.pk).update(next_attempt_at=timezone.now())
+        channel = self._publish(lambda request: httpx.Response(200, json={'email': 'owner@example.com'}))
+        body = json.loads(channel.basic_publish.call_args.kwargs['body'])
+        self.assertEqual(body['payload'], {'email': 'owner@example.com', 'review_id': review.id})
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_event_of_a_deleted_review_fails_at_once(self):
+        review = Review.objects.create(product=self.stuff, customer='c1', rating=4)
+        event = OutboxEvent.objects.create(event_type='review.created',
+                                           payload={'review_id': review.id, 'owner': 'owner'})
+        review.delete()
+        with self.assertLogs('equipments.outbox', 'ERROR'):
+            channel = self._publish(lambda request: httpx.Response(200, json={'email': 'owner@example.com'}))
+        channel.basic_publish.assert_not_called()
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('failed', 1))
+
+
+class UserDirectoryTests(TestCase):
+    def setUp(self):
+        self.requests = []
+        self.release = threading.Event()
+        self.release.set()
+
+        def handler(request):
+            self.requests.append(request.url.path)
+            self.release.wait(5)
+            keycloak_id = request.url.path.rstrip('/').rsplit('/', 1)[-1]
+            if keycloak_id.startswith('missing'):
+                return httpx.Response(404)
+            if keycloak_id.startswith('broken'):
+                return httpx.Response(500)
+            return httpx.Response(200, json={'email': f'{keycloak_id}@example.com'})
+
+        self.directory = UserDirectory('http://users.test', cache_size=2, transport=httpx.MockTransport(handler))
+
+    def tearDown(self):
+        self.directory.close()
+
+    def test_hits_and_negative_results_are_cached_but_errors_are_not(self):
+        with self.assertLogs('equipments.users', 'WARNING'):
+            for _ in range(3):
+                self.assertEqual(self.directory.get('u1'), {'email': 'u1@example.com'})
+                self.assertIsNone(self.directory.get('missing1'))
+                self.assertIsNone(self.directory.get('broken1'))
+        self.assertEqual(len(self.requests), 5)
+        stats = self.directory.stats()
+        self.assertEqual((stats['hits'], stats['negative_hits'], stats['errors']), (2, 2, 3))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.directory.get_many(['u1', 'u2'])
+        self.directory.get('u1')
+        self.directory.get('u3')
+        self.directory.get('u1')
+        self.directory.get('u2')
+        self.assertEqual(self.requests.count('/user/user-details/u2/'), 2)
+        self.assertEqual(self.requests.count('/user/user-details/u1/'), 1)
+
+    def test_concurrent_lookups_of_one_user_share_a_request(self):
+        self.release.clear()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.directory.get('u1'))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while self.directory.stats()['coalesced'] < 4:
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.requests, ['/user/user-details/u1/'])
+        self.assertEqual(results, [{'email': 'u1@example.com'}] * 5)
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        overrides = override_settings(MEDIA_ROOT=self.media_root, IMAGE_VARIANTS={'ASYNC': False})
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.stuff = make_stuff(images=0)
+
+    def upload(self, size):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'orange').save(buffer, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            return EquipmentImage.objects.create(
+                stuff=self.stuff, position=0, url=SimpleUploadedFile('drill.png', buffer.getvalue()),
+            )
+
+    def test_upload_builds_thumbnail_and_smaller_widths(self):
+        image = self.upload((1000, 500))
+        image.refresh_from_db()
+        self.assertEqual(set(image.variants), {'thumb', '400w', '800w'})
+        self.assertEqual((image.variants['thumb']['width'], image.variants['thumb']['height']), (200, 200))
+        self.assertEqual(image.variants['400w']['height'], 200)
+        srcset = EquipmentImageSerializer(image).data['srcset']
+        self.assertTrue(srcset['800w'].endswith('_800w.webp'))
+        with Image.open(os.path.join(self.media_root, image.variants['400w']['name'])) as variant:
+            self.assertEqual((variant.format, variant.size), ('WEBP', (400, 200)))
+
+    def test_deleting_the_image_deletes_its_variants(self):
+        image = self.upload((300, 300))
+        image.refresh_from_db()
+        path = os.path.join(self.media_root, image.variants['thumb']['name'])
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(os.path.exists(path))
+
+
+class BlobStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        overrides = override_settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def management(self, content, name='contract.pdf'):
+        return StuffManagement.objects.create(name='m', contract_required=SimpleUploadedFile(name, content))
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.management(b'%PDF same bytes')
+        second = self.management(b'%PDF same bytes', name='contract (1).pdf')
+        other = self.management(b'%PDF other bytes')
+        self.assertEqual(first.contract_required.name, second.contract_required.name)
+        self.assertNotEqual(first.contract_required.name, other.contract_required.name)
+        self.assertRegex(first.contract_required.name, r'^contracts/[0-9a-f]{2}/[0-9a-f]{64}\.pdf$')
+        self.assertEqual(Blob.objects.get(name=first.contract_required.name).refcount, 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'contracts', first.contract_required.name[10:12]))), 1)
+
+    def test_unreferenced_blobs_are_collected(self):
+        first = self.management(b'%PDF shared')
+        second = self.management(b'%PDF shared')
+        path = first.contract_required.path
+        first.delete()
+        self.assertEqual(collect_garbage(datetime.timedelta(0)), (0, 0))
+        second.contract_required = SimpleUploadedFile('new.pdf', b'%PDF replaced')
+        second.save()
+        self.assertEqual(collect_garbage(datetime.timedelta(0)), (1, len(b'%PDF shared')))
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(second.contract_required.path))
+
+    def test_recount_repairs_drift(self):
+        management = self.management(b'%PDF drift')
+        Blob.objects.update(refcount=5)
+        self.assertEqual(recount(), 1)
+        self.assertEqual(Blob.objects.get(name=management.contract_required.name).refcount, 1)
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        overrides = override_settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.content = bytes(range(256)) * 40
+        management = StuffManagement.objects.create(
+            name='m', contract_required=SimpleUploadedFile('contract.pdf', self.content),
+        )
+        self.url = '/' + management.contract_required.name
+
+    def test_blob_is_served_with_immutable_caching_and_revalidated(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-0')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+        validators = self.client.get(self.url)
+        last_modified = validators['Last-Modified']
+        later = http_date(parse_http_date(last_modified) + 1)
+        for if_range, status in ((validators['ETag'], 206), ('W/' + validators['ETag'], 200),
+                                 (last_modified, 206), (later, 200)):
+            response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=if_range)
+            self.assertEqual(response.status_code, status, if_range)
+
+        # Files outside the blob store only have a weak ETag, never a range validator.
+        os.makedirs(os.path.join(self.media_root, 'equipment_images'))
+        with open(os.path.join(self.media_root, 'equipment_images', 'photo.jpg'), 'wb') as handle:
+            handle.write(self.content)
+        etag = self.client.get('/equipment_images/photo.jpg')['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        response = self.client.get('/equipment_images/photo.jpg', HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_only_upload_directories_are_served(self):
+        with open(os.path.join(self.media_root, 'settings.py'), 'w') as handle:
+            handle.write('SECRET_KEY = 1')
+        self.assertEqual(self.client.get('/settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/contracts/../settings.py').status_code, 404)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def walk(self, url, params):
+        ids, pages, response = [], 0, self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(row['id'] for row in response.data['results'])
+            pages += 1
+            if not response.data['next']:
+                return ids, pages, response
+            response = self.client.get(response.data['next'])
+
+    def test_pages_cover_ties_and_nulls_exactly_once(self):
+        stuffs = [make_stuff(images=0, price_per_day=price) for price in (5, 5, 5, 7, 7, 9, 9, 9)]
+        # Pre-existing listings may have no creation date.
+        Stuff.objects.filter(pk__in=[stuffs[0].pk, stuffs[3].pk]).update(created_at=None)
+        for ordering in ('-created_at', 'price_per_day', '-price_per_day'):
+            expected = list(Stuff.objects.order_by(ordering, '-id').values_list('id', flat=True))
+            ids, pages, last = self.walk('/api/stuffs/', {'ordering': ordering, 'page_size': 3})
+            self.assertEqual(ids, expected, ordering)
+            self.assertEqual(pages, 3)
+            previous = self.client.get(last.data['previous'])
+            self.assertEqual([row['id'] for row in previous.data['results']], expected[3:6])
+
+    def test_page_query_does_not_depend_on_depth(self):
+        stuff = make_stuff(images=0)
+        ItemView.objects.bulk_create([ItemView(stuff=stuff, user='u') for _ in range(30)])
+        ids, pages, _ = self.walk('/api/item-views/', {'page_size': 7})
+        self.assertEqual(ids, list(ItemView.objects.order_by('-timestamp', '-id').values_list('id', flat=True)))
+        self.assertEqual(pages, 5)
+        response = self.client.get('/api/item-views/', {'page_size': 7})
+        with self.assertNumQueries(1):
+            self.client.get(response.data['next'])
+
+    def test_cursor_is_checked(self):
+        make_stuff(images=0)
+        make_stuff(images=0)
+        cursor = self.client.get('/api/stuffs/', {'page_size': 1}).data['next'].split('cursor=')[1]
+        self.assertEqual(self.client.get('/api/stuffs/', {'cursor': 'garbage'}).status_code, 404)
+        self.assertEqual(
+            self.client.get('/api/stuffs/', {'cursor': cursor, 'ordering': 'price_per_day'}).status_code, 404,
+        )
+
+
+class CatalogSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.tools = Category.objects.create(name='Outillage')
+        self.drill = make_stuff(self.tools, images=0, stuffname='Perceuse Bosch', brand='Bosch')
+        self.saw = make_stuff(self.tools, images=0, stuffname='Scie circulaire', detailed_description='lame pour perceuse')
+        self.tent = make_stuff(images=0, stuffname='Tente 4 places', brand='Quechua')
+
+    def search(self, **params):
+        response = self.client.get('/api/stuffs/', params)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_prefix_search_ranks_name_matches_first(self):
+        self.assertEqual(self.search(q='perc'), [self.drill.id, self.saw.id])
+        self.assertEqual(self.search(q='bosch perceuse'), [self.drill.id])
+        self.assertEqual(self.search(q='outil'), sorted([self.drill.id, self.saw.id], reverse=True))
+        self.assertEqual(self.search(q='  '), [self.tent.id, self.saw.id, self.drill.id])
+
+    def test_search_combines_with_filters_and_pagination(self):
+        self.assertEqual(self.search(q='perceuse', rental_zone='nowhere'), [])
+        first = self.client.get('/api/stuffs/', {'q': 'perceuse', 'page_size': 1})
+        second = self.client.get(first.data['next'])
+        self.assertEqual([row['id'] for row in first.data['results'] + second.data['results']],
+                         [self.drill.id, self.saw.id])
+        self.assertNotIn('search_vector', first.data['results'][0])
+
+    def test_vector_follows_edits_and_category_renames(self):
+        self.tent.detailed_description = 'Camping familial'
+        self.tent.save()
+        self.tools.name = 'Bricolage'
+        self.tools.save()
+        self.assertEqual(self.search(q='camping'), [self.tent.id])
+        self.assertEqual(self.search(q='bricolage', ordering='created_at'), [self.saw.id, self.drill.id])
+        self.assertEqual(self.search(q='outillage'), [])
+
+
+class CatalogFacetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.tools = Category.objects.create(name='Outillage')
+        self.camping = Category.objects.create(name='Camping')
+        make_stuff(self.tools, images=0, stuffname='Perceuse', brand='Bosch', price_per_day=8)
+        make_stuff(self.tools, images=0, stuffname='Scie', brand='Bosch', price_per_day=30, state='used')
+        make_stuff(self.tools, images=0, stuffname='Ponceuse', price_per_day=30)
+        make_stuff(self.camping, images=0, stuffname='Tente', brand='Quechua', price_per_day=300)
+
+    def facets(self, **params):
+        with self.assertNumQueries(StuffViewSet.query_budget['facets']):
+            response = self.client.get('/api/stuffs/facets/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_counts_every_dimension_in_one_query(self):
+        facets = self.facets()
+        self.assertEqual(facets['total'], 4)
+        self.assertEqual(facets['category'], [
+            {'value': self.tools.id, 'label': 'Outillage', 'count': 3},
+            {'value': self.camping.id, 'label': 'Camping', 'count': 1},
+        ])
+        self.assertEqual(facets['brand'], [
+            {'value': 'Bosch', 'count': 2}, {'value': 'Quechua', 'count': 1}, {'value': None, 'count': 1},
+        ])
+        self.assertEqual(facets['rental_zone'], [{'value': 'nabeul', 'count': 4}])
+        self.assertEqual(facets['state'], [{'value': 'open', 'count': 3}, {'value': 'used', 'count': 1}])
+        self.assertEqual(facets['price'], [
+            {'value': 0, 'min': 0, 'max': 10, 'count': 1},
+            {'value': 2, 'min': 25, 'max': 50, 'count': 2},
+            {'value': 5, 'min': 250, 'max': None, 'count': 1},
+        ])
+
+    def test_facets_follow_the_list_filters(self):
+        facets = self.facets(category=self.tools.id, min_price=10, max_price=30)
+        self.assertEqual(facets['total'], 2)
+        self.assertEqual(facets['brand'], [{'value': 'Bosch', 'count': 1}, {'value': None, 'count': 1}])
+        self.assertEqual(self.facets(q='tente')['category'], [{'value': self.camping.id, 'label': 'Camping', 'count': 1}])
+        self.assertEqual(self.client.get('/api/stuffs/facets/', {'q': '***'}).data['total'], 0)
+
+        response = self.client.get('/api/stuffs/', {'min_price': 25, 'max_price': 300})
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(self.client.get('/api/stuffs/', {'min_price': 'cheap'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/stuffs/', {'min_price': 50, 'max_price': 10}).status_code, 400)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        caches['responses'].clear()
+        self.stuff = make_stuff(images=1)
+
+    def get(self, url, params=None, cache='HIT'):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('X-Cache'), cache)
+        return response.data
+
+    def test_item_is_served_from_the_cache_until_it_or_a_child_changes(self):
+        url = f'/api/stuffs/{self.stuff.id}/'
+        self.get(url, cache='MISS')
+        with self.assertNumQueries(0):
+            self.get(url)
+        self.get(url, {'category': ''}, cache='MISS')
+
+        self.client.post(f'{url}publish/')
+        self.assertEqual(self.get(url, cache='MISS')['status'], 'published')
+        self.client.post(f'/api/stuffmanagment/{self.stuff.stuff_management_id}/available/')
+        self.assertEqual(self.get(url, cache='MISS')['stuff_management']['availability'], 'Available')
+        EquipmentImage.objects.create(stuff=self.stuff, url='equipment_images/9.jpg', position=1)
+        self.assertEqual(len(self.get(url, cache='MISS')['equipment_images']), 2)
+        self.get(url)
+
+        other = make_stuff(images=0)
+        self.get(url)
+        self.get(f'/api/stuffs/{other.id}/', cache='MISS')
+
+    def test_availability_filtered_item_follows_its_rentals(self):
+        url = f'/api/stuffs/{self.stuff.id}/'
+        period = {'available_from': '2025-06-01', 'available_to': '2025-06-05'}
+        self.get(url, period, cache='MISS')
+        self.get(url, period)
+        rental = Rental.objects.create(stuff=self.stuff, customer=1, total_price=10, status='confirmed',
+                                       start_date=datetime.date(2025, 6, 3), end_date=datetime.date(2025, 6, 4))
+        self.assertEqual(self.client.get(url, period).status_code, 404)
+        rental.delete()
+        self.get(url, period, cache='MISS')
+
+    def test_categories_and_image_listings(self):
+        Category.objects.create(name='Outillage')
+        self.assertEqual(len(self.get('/api/categories/', cache='MISS')), 1)
+        self.get('/api/categories/')
+        Category.objects.create(name='Camping')
+        self.assertEqual(len(self.get('/api/categories/', cache='MISS')), 2)
+
+        self.get('/api/images/', {'stuff': self.stuff.id}, cache='MISS')
+        self.get('/api/images/', {'stuff': self.stuff.id})
+        self.get('/api/images/', cache=None)
+        self.stuff.equipment_images.first().delete()
+        self.assertEqual(self.get('/api/images/', {'stuff': self.stuff.id}, cache='MISS'), [])
+
+        stats = self.client.get('/api/ops/stats/').data['response_cache']
+        self.assertGreaterEqual(stats['scopes']['images']['hits'], 1)
+        self.assertGreaterEqual(stats['scopes']['images']['misses'], 2)
+        self.assertIn('avg_hit_ms', stats['scopes']['categories'])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        caches['responses'].clear()
+        self.stuff = make_stuff(images=1)
+        self.url = f'/api/stuffs/{self.stuff.id}/'
+
+    def revalidate(self, url, etag, queries, status=304, **params):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status)
+        return response
+
+    def test_item_is_not_modified_until_it_or_a_child_changes(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertIn('Last-Modified', response)
+        self.revalidate(self.url, etag, 0)
+        caches['responses'].clear()
+        self.revalidate(self.url, etag, 1)
+
+        for change in (
+            lambda: EquipmentImage.objects.create(stuff=self.stuff, url='equipment_images/9.jpg', position=1),
+            lambda: self.client.post(f'/api/stuffmanagment/{self.stuff.stuff_management_id}/available/'),
+        ):
+            change()
+            response = self.revalidate(self.url, etag, 2, status=200)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+
+        # Counters move with every event and are left out of the validators.
+        Favorite.objects.create(stuff=self.stuff, user='visitor')
+        caches['responses'].clear()
+        self.revalidate(self.url, etag, 1)
+
+        last_modified = response['Last-Modified']
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_lists_are_not_modified_until_a_row_changes(self):
+        etag = self.client.get('/api/stuffs/')['ETag']
+        self.revalidate('/api/stuffs/', etag, 1)
+        extra = make_stuff(images=0)
+        response = self.revalidate('/api/stuffs/', etag, StuffViewSet.query_budget['list'], status=200)
+        etag = response['ETag']
+        self.revalidate('/api/stuffs/', etag, 1)
+        # Deleting a row would not move the newest updated_at of the others,
+        # so lists only answer If-None-Match.
+        self.assertNotIn('Last-Modified', response)
+        extra.delete()
+        since = http_date(time.time() + 60)
+        self.assertEqual(self.client.get('/api/stuffs/', HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+        self.revalidate('/api/stuffs/', etag, StuffViewSet.query_budget['list'], status=200)
+
+        Category.objects.create(name='Outillage')
+        etag = self.client.get('/api/categories/')['ETag']
+        self.revalidate('/api/categories/', etag, 0)
+        Category.objects.create(name='Camping')
+        self.revalidate('/api/categories/', etag, 1, status=200)
+
+
+class ChangeFeedTests(TransactionTestCase):
+    # Rows only enter the feed once their transaction has finished.
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def sync(self, since=None, **params):
+        if since:
+            params['since'] = since
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/stuffs/changes/', params)
+        self.assertLessEqual(len(queries), StuffViewSet.query_budget['changes'])
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_sync_returns_each_change_once_with_tombstones(self):
+        with override_settings(IMAGE_VARIANTS={'ASYNC': False}), self.assertLogs('equipments.images', 'WARNING'):
+            drill, saw, tent = (make_stuff(images=1, stuffname=name) for name in ('drill', 'saw', 'tent'))
+        first = self.sync(limit=2)
+        self.assertTrue(first['has_more'])
+        second = self.sync(first['next'], limit=2)
+        self.assertFalse(second['has_more'])
+        self.assertEqual([change['id'] for change in first['results'] + second['results']], [drill.id, saw.id, tent.id])
+        self.assertEqual(len(first['results'][0]['stuff']['equipment_images']), 1)
+        self.assertEqual(self.sync(second['next'])['results'], [])
+
+        self.client.post(f'/api/stuffs/{saw.id}/draft/')
+        self.client.post(f'/api/stuffs/{saw.id}/publish/')
+        drill_id = drill.id
+        drill.delete()
+        changes = self.sync(second['next'])
+        self.assertEqual(
+            [(change['id'], change['deleted']) for change in changes['results']], [(saw.id, False), (drill_id, True)],
+        )
+        self.assertEqual(changes['results'][0]['stuff']['status'], 'published')
+        self.assertNotIn('stuff', changes['results'][1])
+        # A first sync never sees tombstones.
+        self.assertEqual([change['id'] for change in self.sync()['results']], [tent.id, saw.id])
+
+    def test_tracking_events_do_not_put_items_back_in_the_feed(self):
+        drill = make_stuff(images=0, stuffname='drill')
+        token = self.sync()['next']
+        with override_settings(EVENT_INGESTION={'BUFFERED': False}):
+            response = self.client.post(
+                '/api/item-views/', {'stuff': drill.id, 'user': 'alice', 'source': 'direct', 'device_type': 'mobile'},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        drill.refresh_from_db()
+        self.assertEqual(drill.num_views, 1)
+        self.assertGreater(drill.trending_score, 0)
+        self.assertEqual(self.sync(token)['results'], [])
+        # An edit of the item itself still does.
+        self.client.post(f'/api/stuffs/{drill.id}/draft/')
+        self.assertEqual([change['id'] for change in self.sync(token)['results']], [drill.id])
+
+    def test_invalid_token_is_rejected(self):
+        response = self.client.get('/api/stuffs/changes/', {'since': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+
+class EventRetentionTests(TestCase):
+    def view_at(self, stuff, when):
+        view = ItemView.objects.create(stuff=stuff, user='alice', source='direct', device_type='mobile')
+        ItemView.objects.filter(pk=view.pk).update(timestamp=when)
+
+    def test_expired_month_is_rolled_up_then_dropped(self):
+        stuff = make_stuff(images=0)
+        month = add_months(current_month(), -20)
+        # Views of a month without a partition land in the default one, and
+        # move to the partition once it is created.
+        day = month_bounds(month)[0] + datetime.timedelta(days=10, hours=12)
+        self.view_at(stuff, day)
+        self.view_at(stuff, day)
+        self.assertEqual(ensure_partitions(0, start=month), [
+            f'{ItemView._meta.db_table}_p{month:%Y_%m}', f'{CartActivity._meta.db_table}_p{month:%Y_%m}',
+        ])
+        self.assertIn(month, monthly_partitions(ItemView))
+        self.assertEqual(ItemView.objects.filter(timestamp=day).count(), 2)
+
+        self.assertEqual(expire(13, dry_run=True)[0], (f'{ItemView._meta.db_table}_p{month:%Y_%m}', 'expired'))
+        self.assertIn(month, monthly_partitions(ItemView))
+        report = dict(expire(13))
+        self.assertEqual(report[f'{ItemView._meta.db_table}_p{month:%Y_%m}'], 'dropped')
+        self.assertNotIn(month, monthly_partitions(ItemView))
+        self.assertFalse(ItemView.objects.filter(timestamp=day).exists())
+        self.assertEqual(SiteStat.objects.get(date=timezone.localtime(day).date()).total_page_views, 2)
+        # The current months are kept.
+        self.assertIn(current_month(), monthly_partitions(ItemView))
+
+        # Only the stats are left of the expired month: backfills leave them alone.
+        sketch = VisitorSketch.objects.get(date=timezone.localtime(day).date(), dimension='site')
+        start, end = timezone.localtime(month_bounds(month)[0]).date(), timezone.localtime(day).date()
+        self.assertEqual(rollup_range(start, end), 0)
+        output = io.StringIO()
+        call_command('rollup_stats', '--from', str(start), '--to', str(end), stdout=output)
+        self.assertIn('Rolled up 0 day(s)', output.getvalue())
+        self.assertEqual(SiteStat.objects.get(date=timezone.localtime(day).date()).total_page_views, 2)
+        self.assertEqual(VisitorSketch.objects.get(pk=sketch.pk).registers, sketch.registers)
+
+
+class RelatedItemsTests(TestCase):
+    def test_related_items_come_from_co_views_and_co_favorites(self):
+        drill, saw, tent, lamp = (make_stuff(images=1, stuffname=name) for name in ('drill', 'saw', 'tent', 'lamp'))
+        for user, items in (('alice', [drill, saw, tent]), ('bob', [drill, saw]), ('carol', [tent, lamp])):
+            for stuff in items:
+                ItemView.objects.create(stuff=stuff, user=user, source='direct', device_type='mobile')
+        Favorite.objects.create(stuff=lamp, user='alice')
+        self.assertEqual(build_related(), 4)
+
+        with self.assertNumQueries(StuffViewSet.query_budget['related']):
+            response = self.client.get(f'/api/stuffs/{drill.id}/related/')
+        # alice's favorite counts more than carol's view.
+        self.assertEqual([item['id'] for item in response.data], [saw.id, lamp.id, tent.id])
+        self.assertEqual(len(response.data[0]['equipment_images']), 1)
+        response = self.client.get(f'/api/stuffs/{tent.id}/related/', {'limit': 1})
+        self.assertEqual([item['id'] for item in response.data], [lamp.id])
+        # Rebuilding replaces the previous rows.
+        self.assertEqual(build_related(top_k=1), 4)
+        self.assertEqual(self.client.get(f'/api/stuffs/{drill.id}/related/').data[0]['id'], saw.id)
+        self.assertEqual(len(self.client.get(f'/api/stuffs/{drill.id}/related/').data), 1)
+
+
+class TrendingTests(TestCase):
+    def test_recent_activity_ranks_first_and_rebuild_agrees(self):
+        camping = Category.objects.create(name='Camping')
+        drill, saw = make_stuff(images=0, stuffname='drill'), make_stuff(images=0, stuffname='saw')
+        tent = make_stuff(images=0, stuffname='tent', category=camping)
+        # Three views ten days ago weigh less than one now, with a 48 hour half-life.
+        long_ago = timezone.now() - datetime.timedelta(days=10)
+        ItemView.objects.bulk_create(
+            [ItemView(stuff=drill, user='alice', source='direct', device_type='mobile') for _ in range(3)]
+        )
+        ItemView.objects.filter(stuff=drill).update(timestamp=long_ago)
+        for _ in range(3):
+            record_trending(drill.id, 'view', long_ago)
+        # Scored by the signals.
+        ItemView.objects.create(stuff=saw, user='alice', source='direct', device_type='mobile')
+        Favorite.objects.create(stuff=tent, user='alice')
+        incremental = dict(Stuff.objects.values_list('id', 'trending_score'))
+
+        def trending(**params):
+            response = self.client.get('/api/stuffs/', {'ordering': 'trending', **params})
+            return [item['id'] for item in response.data['results']]
+        self.assertEqual(trending(), [tent.id, saw.id, drill.id])
+        self.assertEqual(trending(category=camping.id), [tent.id])
+
+        self.assertEqual(rebuild_trending(), 3)
+        for stuff_id, score in Stuff.objects.values_list('id', 'trending_score'):
+            self.assertAlmostEqual(score, incremental[stuff_id], places=4)
+
+
+class FunnelTests(TestCase):
+    def test_stage_counts_and_ratios_per_dimension(self):
+        tools = Category.objects.create(name='Tools')
+        drill, saw = make_stuff(images=0, category=tools), make_stuff(images=0, stuffname='saw', category=tools)
+        tent = make_stuff(images=0, stuffname='tent')
+        visitor = Visitor.objects.create(session_key='session', ip_address='127.0.0.1', user_agent='test')
+        for stuff, user, source in ((drill, '1', 'organic'), (drill, '2', 'email'), (saw, '3', 'organic'),
+                                    (tent, '1', 'organic')):
+            ItemView.objects.create(stuff=stuff, user=user, source=source, device_type='mobile')
+        CartActivity.objects.create(visitor=visitor, stuff=drill, action='add')
+        CartActivity.objects.create(visitor=visitor, stuff=drill, action='remove')
+        today = timezone.localdate()
+        Rental.objects.create(stuff=drill, customer=2, total_price=10, status='confirmed',
+                              start_date=today, end_date=today + datetime.timedelta(days=1))
+        Rental.objects.create(stuff=saw, customer=3, total_price=10, status='cancelled',
+                              start_date=today, end_date=today + datetime.timedelta(days=1))
+
+        with self.assertNumQueries(StuffViewSet.query_budget['funnel']):
+            report = self.client.get('/api/stuffs/funnel/', {'by': 'category'}).data
+        self.assertEqual(report['totals'], {
+            'views': 4, 'cart_adds': 1, 'rentals': 1, 'cart_rate': 0.25, 'rental_rate': 1.0, 'conversion_rate': 0.25,
+        })
+        tools_row, uncategorized = report['results']
+        self.assertEqual((tools_row['value'], tools_row['label'], tools_row['views']), (tools.id, 'Tools', 3))
+        self.assertEqual((tools_row['conversion_rate'], tools_row['share']), (0.3333, 0.75))
+        self.assertEqual((uncategorized['value'], uncategorized['rentals'], uncategorized['cart_rate']), (None, 0, 0.0))
+
+        # The rental is attributed to the email view of customer 2.
+        sources = self.client.get('/api/stuffs/funnel/', {'by': 'source', 'limit': 1}).data
+        self.assertEqual(
+            [(row['value'], row['views'], row['rentals']) for row in sources['results']], [('organic', 3, 0)],
+        )
+        self.assertIsNone(sources['results'][0]['cart_adds'])
+        self.assertEqual(sources['totals']['rentals'], 1)
+        by_item = self.client.get('/api/stuffs/funnel/', {'by': 'stuff', 'category': tools.id}).data
+        self.assertEqual([row['label'] for row in by_item['results']], ['drill', 'saw'])
+        self.assertEqual(self.client.get('/api/stuffs/funnel/', {'by': 'zone'}).status_code, 400)
+
+
+class VisitorSketchTests(TestCase):
+    def view(self, stuff, user, source='direct'):
+        view = ItemView.objects.create(stuff=stuff, user=user, source=source, device_type='mobile')
+        # Old enough for the incremental aggregation to fold it.
+        ItemView.objects.filter(pk=view.pk).update(timestamp=timezone.now() - datetime.timedelta(minutes=1))
+
+    def test_estimates_are_close(self):
+        for count in (10, 1000, 50000):
+            users = sketch_of([position(f'user-{index}') for index in range(count)])
+            self.assertAlmostEqual(estimate(users), count, delta=count * 0.05)
+
+    def test_sketches_follow_the_incremental_aggregation(self):
+        drill, saw = make_stuff(images=0), make_stuff(images=0, stuffname='saw')
+        self.view(drill, 'alice')
+        self.view(drill, 'bob', source='email')
+        fold_new_events()  # The first run rolls the recent days up.
+        self.view(drill, 'alice')
+        self.view(saw, 'alice')
+        self.view(saw, 'carol')
+        self.view(saw, None)
+        self.assertEqual(fold_new_events()['itemview'], 4)
+
+        def visitors(**params):
+            response = self.client.get('/api/site-stats/unique-visitors/', params)
+            return [(row['value'], row['visitors']) for row in response.data['results']]
+        self.assertEqual(visitors(), [(None, 3)])
+        self.assertEqual(visitors(by='stuff'), [(drill.id, 2), (saw.id, 2)])
+        self.assertEqual(visitors(by='source', value='email'), [('email', 1)])
+        self.assertEqual(visitors(by='stuff', limit=1), [(drill.id, 2)])
+        with mock.patch('equipments.sketches.VALUES_PER_CHUNK', 1):
+            self.assertEqual(visitors(by='stuff'), [(drill.id, 2), (saw.id, 2)])
+        self.assertEqual(self.client.get('/api/site-stats/unique-visitors/', {'by': 'zone'}).status_code, 400)
+        since = (timezone.localdate() - datetime.timedelta(days=365)).isoformat()
+        response = self.client.get('/api/site-stats/unique-visitors/', {'by': 'stuff', 'since': since})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(visitors(by='stuff', since=since, value=saw.id), [(saw.id, 2)])
+
+
+class BookingContentionBenchmark(TransactionTestCase):
+    """
+    Many threads booking random, heavily overlapping periods on a few items.
+    Reports throughput and conflict rate, and checks that every request was
+    either booked or rejected with 409 and that no booked periods overlap.
+    """
+    threads = 8
+    attempts_per_thread = 40
+    items = 3
+
+    def test_concurrent_bookings(self):
+        stuff_ids = [make_stuff(images=0).id for _ in range(self.items)]
+        first_day = datetime.date(2025, 6, 1)
+        outcomes = []
+        lock = threading.Lock()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            client = APIClient()
+            try:
+                for _ in range(self.attempts_per_thread):
+                    start = first_day + datetime.timedelta(days=rng.randrange(60))
+                    response = client.post('/api/rentals/', {
+                        'stuff': rng.choice(stuff_ids), 'customer': seed, 'total_price': 10,
+                        'start_date': start.isoformat(),
+                        'end_date': (start + datetime.timedelta(days=rng.randint(1, 7))).isoformat(),
+                    }, format='json')
+                    with lock:
+                        outcomes.append(response.status_code)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(self.threads)]
+        started = time.monotonic()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        booked, conflicts = outcomes.count(201), outcomes.count(409)
+        self.assertEqual(booked + conflicts, self.threads * self.attempts_per_thread)
+        sys.stderr.write(
+            f"\nbooking benchmark: {len(outcomes)} requests from {self.threads} threads in {elapsed:.2f}s, "
+            f"{booked / elapsed:.1f} bookings/s, {len(outcomes) / elapsed:.1f} requests/s, "
+            f"conflict rate {conflicts / len(outcomes):.1%}\n"
+        )
+
+        rentals = list(Rental.objects.filter(status__in=BOOKED_STATUSES).order_by('stuff', 'start_date'))
+        self.assertEqual(len(rentals), booked)
+        for previous, current in zip(rentals, rentals[1:]):
+            if previous.stuff_id == current.stuff_id:
+                self.assertLessEqual(previous.end_date, current.start_date)
@@ -0,0 +1,130 @@
+"""
+Trending score of the items: their views, cart adds, favorites and rentals,
+each weighted and decayed exponentially with its age.
+
+The decay multiplies every item's sum by the same factor as time passes, so
+it never changes their order; each event is instead counted with a weight
+growing with its time (forward decay), weight * exp((t - EPOCH) / tau), and
+stored scores never need refreshing. Those weights soon outgrow any float,
+so Stuff.trending_score holds ln(1 + sum) and an event is added to it with
+a log-sum-exp in one UPDATE, like the counters (equipments.counters): no row
+is read back and concurrent writers lose nothing. ?ordering=trending is then
+an index scan. rebuild() recomputes every score from the event tables, e.g.
+after changing the settings. Configured through the TRENDING setting:
+
+    TRENDING = {
+        'HALF_LIFE_HOURS': 48,
+        'WEIGHTS': {'view': 1, 'cart': 3, 'favorite': 5, 'rental': 10},
+        'REBUILD_HALF_LIVES': 20,  # events older than this are left out by rebuild()
+    }
+"""
+import datetime
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Abs, Exp, Greatest, Least, Ln
+from django.utils import timezone
+
+from .models import CartActivity, Favorite, ItemView, Rental, Stuff
+
+DEFAULTS = {
+    'HALF_LIFE_HOURS': 48,
+    'WEIGHTS': {'view': 1, 'cart': 3, 'favorite': 5, 'rental': 10},
+    'REBUILD_HALF_LIVES': 20,
+}
+
+EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+# exp(-MAX_GAP) is negligible next to 1, and PostgreSQL's exp() rejects underflows.
+MAX_GAP = 50.0
+
+
+def trending_settings():
+    return {**DEFAULTS, **getattr(settings, 'TRENDING', {})}
+
+
+def _rate(config):
+    """1 / tau, per second."""
+    return math.log(2) / (config['HALF_LIFE_HOURS'] * 3600)
+
+
+def _log_add(current, value):
+    """ln(exp(current) + exp(value)), without overflowing."""
+    return Greatest(current, value) + Ln(Value(1.0) + Exp(-Least(Abs(current - value), Value(MAX_GAP))))
+
+
+def record(stuff_id, kind, at=None):
+    """Add one event of kind ('view', 'cart', 'favorite' or 'rental') at at (default: now) to an item's score."""
+    record_many(kind, [(stuff_id, at)])
+
+
+def record_many(kind, events):
+    """Add (stuff_id, time or None for now) events of one kind to the scores, in one UPDATE."""
+    config = trending_settings()
+    weight = config['WEIGHTS'].get(kind, 0)
+    if weight <= 0:
+        return
+    now, rate = timezone.now(), _rate(config)
+    exponents = defaultdict(list)
+    for stuff_id, at in events:
+        exponents[stuff_id].append(math.log(weight) + ((at or now) - EPOCH).total_seconds() * rate)
+    if not exponents:
+        return
+    # The events of each item are summed first, in the log domain as well.
+    added = {}
+    for stuff_id, values in exponents.items():
+        top = max(values)
+        added[stuff_id] = top + math.log(sum(math.exp(value - top) for value in values))
+    increment = Case(
+        *(When(pk=stuff_id, then=Value(value)) for stuff_id, value in added.items()),
+        output_field=FloatField(),
+    )
+    Stuff.objects.filter(pk__in=added).update(trending_score=_log_add(F('trending_score'), increment))
+
+
+def rebuild():
+    """Recompute every item's score from the event tables, in one UPDATE. Returns the number of items."""
+    config = trending_settings()
+    now, rate = timezone.now(), _rate(config)
+    since = now - datetime.timedelta(hours=config['HALF_LIFE_HOURS'] * config['REBUILD_HALF_LIVES'])
+    sources = [
+        ('view', ItemView, 'timestamp', ''),
+        ('cart', CartActivity, 'timestamp', "AND action = 'add'"),
+        ('favorite', Favorite, 'timestamp', ''),
+        ('rental', Rental, 'created_at', ''),
+    ]
+    selects, params = [], []
+    for kind, model, column, condition in sources:
+        weight = config['WEIGHTS'].get(kind, 0)
+        if weight <= 0:
+            continue
+        # Decayed relative to now, so factors stay within [2^-REBUILD_HALF_LIVES, 1].
+        selects.append(
+            f'SELECT stuff_id, %s * EXP(EXTRACT(EPOCH FROM "{column}" - %s) * %s) AS weight '
+            f'FROM {model._meta.db_table} WHERE "{column}" >= %s {condition}'
+        )
+        params += [float(weight), now, rate, since]
+    if not selects:
+        selects.append('SELECT NULL::bigint AS stuff_id, NULL::float8 AS weight WHERE false')
+    table = Stuff._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH totals AS (
+                SELECT stuff_id, LN(SUM(weight)) + %s AS score
+                FROM ({' UNION ALL '.join(selects)}) events
+                GROUP BY stuff_id
+            )
+            UPDATE {table} s
+            SET trending_score = COALESCE(
+                GREATEST(t.score, 0) + LN(1 + EXP(-LEAST(ABS(t.score), %s))), 0
+            )
+            FROM {table} item LEFT JOIN totals t ON t.stuff_id = item.id
+            WHERE s.id = item.id
+            """,
+            [(now - EPOCH).total_seconds() * rate, *params, MAX_GAP],
+        )
+        return cursor.rowcount
@@ -2,11 +2,13 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     StuffViewSet, CategoryViewSet, ReviewViewSet, ImageViewSet, StuffManagementViewSet, testviewset,
     VisitorViewSet, ItemViewViewSet, CartActivityViewSet, RentalViewSet,
-    SiteStatViewSet, TrafficSourceViewSet, DeviceStatViewSet, CategoryStatViewSet,WishViewSet
+    SiteStatViewSet, TrafficSourceViewSet, DeviceStatViewSet, CategoryStatViewSet,WishViewSet,
+    OpsStatsView
 )
+from django.urls import path
 router = DefaultRouter()
 urlpatterns = [
-    
+    path('ops/stats/', OpsStatsView.as_view(), name='ops-stats'),
 ]
 router.register(r'stuffs', StuffViewSet, basename='stuffs')
 router.register(r'stuffmanagment', StuffManagementViewSet, basename='stuffmanagment')
@@ -0,0 +1,215 @@
+"""
+Lookups against the user service, which owns the accounts behind the
+Keycloak ids stored in Stuff.user and Review.customer.
+
+All lookups of a process go through one UserDirectory: a pooled httpx
+client with keep-alive connections in front of an LRU cache whose entries
+expire after TTL seconds. Unknown ids (404) are cached for NEGATIVE_TTL
+seconds only, and errors are not cached: lookups return None for both unless
+asked to raise UserServiceError on errors. Concurrent lookups of the same id
+share a single request. Configured through the USER_DIRECTORY setting:
+
+    USER_DIRECTORY = {
+        'URL': 'http://192.168.1.120:8000',
+        'TIMEOUT': 5,
+        'MAX_CONNECTIONS': 20,
+        'CACHE_SIZE': 10000,     # entries kept, least recently used evicted first
+        'TTL': 300,              # seconds a found user is served from the cache
+        'NEGATIVE_TTL': 30,      # seconds an unknown id is
+        'BULK_CONCURRENCY': 8,   # parallel requests of get_users()
+    }
+"""
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import httpx
+from django.conf import settings
+
+from . import ops
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'URL': 'http://192.168.1.120:8000',
+    'TIMEOUT': 5,
+    'MAX_CONNECTIONS': 20,
+    'CACHE_SIZE': 10000,
+    'TTL': 300,
+    'NEGATIVE_TTL': 30,
+    'BULK_CONCURRENCY': 8,
+}
+
+
+def directory_settings():
+    return {**DEFAULTS, **getattr(settings, 'USER_DIRECTORY', {})}
+
+
+class UserServiceError(Exception):
+    """The user service failed or timed out; the user may well exist."""
+
+
+class UserDirectory:
+    def __init__(self, url, timeout=5, max_connections=20, cache_size=10000, ttl=300, negative_ttl=30,
+                 bulk_concurrency=8, transport=None):
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.bulk_concurrency = bulk_concurrency
+        self._client = httpx.Client(
+            base_url=url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+        self._cache = OrderedDict()  # keycloak id -> (expires at, user info or None)
+        self._inflight = {}          # keycloak id -> Future of (user info, error) of the request being made
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = Counter()
+
+    def get(self, keycloak_id, raise_errors=False):
+        """
+        The user's details, or None if the user is unknown or the service
+        failed. With raise_errors a failure raises UserServiceError instead.
+        """
+        with self._lock:
+            entry = self._cache.get(keycloak_id)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._cache.move_to_end(keycloak_id)
+                    self._stats['hits' if entry[1] is not None else 'negative_hits'] += 1
+                    return entry[1]
+                del self._cache[keycloak_id]
+            future = self._inflight.get(keycloak_id)
+            leader = future is None
+            if leader:
+                future = self._inflight[keycloak_id] = Future()
+                self._stats['misses'] += 1
+            else:
+                self._stats['coalesced'] += 1
+        if leader:
+            info, ttl = None, 0
+            try:
+                info, ttl = self._fetch(keycloak_id)
+                with self._lock:
+                    if ttl:
+                        self._store(keycloak_id, info, ttl)
+            finally:
+                with self._lock:
+                    del self._inflight[keycloak_id]
+                future.set_result((info, not ttl))
+        info, failed = future.result()
+        if failed and raise_errors:
+            raise UserServiceError(f"User service lookup of {keycloak_id} failed")
+        return info
+
+    def get_many(self, keycloak_ids):
+        """{keycloak id: details or None} for every id, fetching the misses in parallel."""
+        keycloak_ids = list(dict.fromkeys(keycloak_ids))
+        if len(keycloak_ids) <= 1:
+            return {keycloak_id: self.get(keycloak_id) for keycloak_id in keycloak_ids}
+        return dict(zip(keycloak_ids, self._pool().map(self.get, keycloak_ids)))
+
+    def invalidate(self, keycloak_id):
+        with self._lock:
+            self._cache.pop(keycloak_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['negative_hits'] + self._stats['misses'] + self._stats['coalesced']
+            return {
+                'size': len(self._cache),
+                'hits': self._stats['hits'],
+                'negative_hits': self._stats['negative_hits'],
+                'misses': self._stats['misses'],
+                'coalesced': self._stats['coalesced'],
+                'errors': self._stats['errors'],
+                'evictions': self._stats['evictions'],
+                'hit_rate': round((lookups - self._stats['misses']) / lookups, 4) if lookups else 0.0,
+                'avg_fetch_ms': (
+                    round(self._stats['fetch_ms_total'] / self._stats['misses'], 3) if self._stats['misses'] else 0.0
+                ),
+            }
+
+    def close(self):
+        self._client.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def _fetch(self, keycloak_id):
+        """Request one user. Returns (details or None, seconds to cache the answer, 0 for not at all)."""
+        started = time.monotonic()
+        try:
+            response = self._client.get(f'/user/user-details/{keycloak_id}/')
+        except httpx.RequestError as exc:
+            logger.warning("User service request for %s failed: %s", keycloak_id, exc)
+            result = None, 0
+        else:
+            if response.status_code == 200:
+                result = response.json(), self.ttl
+            elif response.status_code == 404:
+                result = None, self.negative_ttl
+            else:
+                logger.warning("User service returned %s for %s", response.status_code, keycloak_id)
+                result = None, 0
+        with self._lock:
+            self._stats['fetch_ms_total'] += (time.monotonic() - started) * 1000
+            if not result[1]:
+                self._stats['errors'] += 1
+        return result
+
+    def _store(self, keycloak_id, info, ttl):
+        self._cache[keycloak_id] = (time.monotonic() + ttl, info)
+        self._cache.move_to_end(keycloak_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.bulk_concurrency, thread_name_prefix='user-directory')
+        return self._executor
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_directory():
+    """The process-wide UserDirectory, created on first use."""
+    global _directory
+    if _directory is None:
+        with _directory_lock:
+            if _directory is None:
+                config = directory_settings()
+                _directory = UserDirectory(
+                    config['URL'],
+                    timeout=config['TIMEOUT'],
+                    max_connections=config['MAX_CONNECTIONS'],
+                    cache_size=config['CACHE_SIZE'],
+                    ttl=config['TTL'],
+                    negative_ttl=config['NEGATIVE_TTL'],
+                    bulk_concurrency=config['BULK_CONCURRENCY'],
+                )
+    return _directory
+
+
+def get_user_info(keycloak_id, raise_errors=False):
+    """
+    The user service's details for keycloak_id, or None if it cannot tell.
+    With raise_errors, None means unknown and failures raise UserServiceError.
+    """
+    return get_directory().get(keycloak_id, raise_errors=raise_errors)
+
+
+def get_users(keycloak_ids):
+    """{keycloak id: details or None} for many ids at once."""
+    return get_directory().get_many(keycloak_ids)
+
+
+ops.register('user_directory', lambda: get_directory().stats() if _directory is not None else {})
@@ -0,0 +1,103 @@
+"""
+Fleet utilization: how many of the days in a period each item was rented.
+
+All rental intervals overlapping the period are loaded with one query and
+turned into an items x days occupancy matrix with NumPy (a difference array
+per item, then a cumulative sum), so the cost does not depend on a Python
+loop per rental day.
+"""
+import datetime
+
+import numpy as np
+from django.db.models import Value
+
+from .models import DateRange, Rental, Stuff, rental_period
+
+
+def _percent(numerator, denominator):
+    return np.round(np.divide(numerator * 100.0, denominator, out=np.zeros_like(numerator, dtype=float),
+                              where=denominator > 0), 2)
+
+
+def occupancy_matrix(item_ids, start, end):
+    """
+    Boolean matrix of shape (len(item_ids), days) telling which items were
+    rented (in any non-cancelled rental) on each day of start..end.
+    """
+    days = (end - start).days + 1
+    index = {item_id: position for position, item_id in enumerate(item_ids)}
+    intervals = list(
+        Rental.objects.exclude(status='cancelled')
+        .alias(period=rental_period())
+        .filter(stuff__in=item_ids, period__overlap=DateRange(Value(start), Value(end), Value('[]')))
+        .values_list('stuff_id', 'start_date', 'end_date')
+    )
+    diff = np.zeros((len(item_ids), days + 1), dtype=np.int32)
+    if intervals:
+        stuff_ids, starts, ends = zip(*intervals)
+        rows = np.fromiter((index[stuff_id] for stuff_id in stuff_ids), dtype=np.int64, count=len(intervals))
+        origin = np.datetime64(start, 'D')
+        first = np.clip((np.array(starts, dtype='datetime64[D]') - origin).astype(np.int64), 0, days)
+        last = np.clip((np.array(ends, dtype='datetime64[D]') - origin).astype(np.int64), 0, days)
+        np.add.at(diff, (rows, first), 1)
+        np.add.at(diff, (rows, last), -1)
+    return np.cumsum(diff[:, :-1], axis=1) > 0
+
+
+def fleet_utilization(start, end, stuffs=None):
+    """
+    Utilization of every item of stuffs (default: the whole catalog) over the
+    days start..end inclusive, per item, per rental zone and for the fleet,
+    with daily occupancy curves for the zones and the fleet.
+    """
+    stuffs = Stuff.objects.all() if stuffs is None else stuffs
+    items = list(stuffs.order_by('id').values_list('id', 'stuff_management__rental_zone'))
+    item_ids = [item_id for item_id, _ in items]
+    zones = [zone or '' for _, zone in items]
+    days = (end - start).days + 1
+
+    occupied = occupancy_matrix(item_ids, start, end)
+    rented_days = occupied.sum(axis=1)
+
+    zone_names, zone_of_item = np.unique(np.array(zones, dtype=object), return_inverse=True)
+    zone_items = np.bincount(zone_of_item, minlength=len(zone_names))
+    if len(item_ids):
+        # Rows grouped by zone, then summed per contiguous block; every zone has at least one item.
+        by_zone = occupied[np.argsort(zone_of_item, kind='stable')].astype(np.int32)
+        zone_daily = np.add.reduceat(by_zone, np.concatenate(([0], np.cumsum(zone_items)[:-1])), axis=0)
+    else:
+        zone_daily = np.zeros((0, days), dtype=np.int32)
+    fleet_daily = occupied.sum(axis=0)
+
+    return {
+        'since': start,
+        'until': end,
+        'days': days,
+        'dates': [start + datetime.timedelta(days=offset) for offset in range(days)],
+        'fleet': {
+            'items': len(item_ids),
+            'utilization': float(_percent(np.array(rented_days.sum()), np.array(len(item_ids) * days))),
+            'daily_occupancy': _percent(fleet_daily, np.full(days, len(item_ids))).tolist(),
+        },
+        'zones': [
+            {
+                'rental_zone': name or None,
+                'items': int(zone_items[position]),
+                'utilization': float(_percent(np.array(zone_daily[position].sum()),
+                                              np.array(zone_items[position] * days))),
+                'daily_occupancy': _percent(zone_daily[position], np.full(days, zone_items[position])).tolist(),
+            }
+            for position, name in enumerate(zone_names)
+        ],
+        'items': [
+            {
+                'stuff': item_id,
+                'rental_zone': zone or None,
+                'rented_days': int(rented),
+                'utilization': float(percent),
+            }
+            for item_id, zone, rented, percent in zip(
+                item_ids, zones, rented_days, _percent(rented_days, np.full(len(item_ids), days))
+            )
+        ],
+    }
@@ -2,27 +2,81 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets
 from .models import (
     Stuff, Category, EquipmentImage, Review, StuffManagement, test,
-    Visitor, ItemView, CartActivity, Rental,
-    SiteStat, TrafficSource, DeviceStat, CategoryStat,Favorite
+    Visitor, ItemView, CartActivity, Rental, StuffTombstone,
+    SiteStat, TrafficSource, DeviceStat, CategoryStat,Favorite, STUFF_METRICS, FUNNEL_DIMENSIONS
 )
 from rest_framework.views import APIView
 from .serializers import (
     StuffSerializer, CategorySerializer, ReviewsSerializer, EquipmentImageSerializer,
     StuffManagementSerializer, TestSerializer,
     VisitorSerializer, ItemViewSerializer, CartActivitySerializer, RentalSerializer,
-    SiteStatSerializer, TrafficSourceSerializer, DeviceStatSerializer, CategoryStatSerializer,WishSerializer
+    SiteStatSerializer, TrafficSourceSerializer, DeviceStatSerializer, CategoryStatSerializer,WishSerializer,
+    StuffMetricsSerializer, ItemViewEventSerializer, CartActivityEventSerializer
 )
-import pika
 from rest_framework.permissions import AllowAny
 from django_filters import rest_framework as filters
 from rest_framework.parsers import MultiPartParser, FormParser
 import requests 
 import json 
+import datetime
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from .models import StuffManagement
 from .serializers import StuffManagementSerializer
+from . import counters, ingest, ops, outbox, sketches
+from .changes import InvalidToken, read_changes
+from .conditional import list_validators, object_validators, respond
+from .response_cache import cached_response
+from .pagination import CatalogPagination, EventPagination, KeysetPagination, RentalPagination
+from .utilization import fleet_utilization
+
+
+def parse_date_param(request, name):
+    """Read an optional YYYY-MM-DD query parameter, rejecting malformed values."""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: 'Expected a date in YYYY-MM-DD format.'})
+    return parsed
+
+
+def parse_int_param(request, name, default=None, minimum=1, maximum=None):
+    """Read an optional positive integer query parameter, clamped to maximum."""
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        parsed = int(value)
+    except ValueError:
+        raise ValidationError({name: 'Expected an integer.'})
+    if parsed < minimum:
+        raise ValidationError({name: f'Must be at least {minimum}.'})
+    return min(parsed, maximum) if maximum else parsed
+
+
+def parse_number_param(request, name, minimum=0):
+    """Read an optional non-negative number query parameter."""
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        parsed = float(value)
+    except ValueError:
+        raise ValidationError({name: 'Expected a number.'})
+    if not parsed >= minimum:
+        raise ValidationError({name: f'Must be at least {minimum}.'})
+    return parsed
 
 # Define a filter class for Stuff
 class StuffFilter(filters.FilterSet):
@@ -41,9 +95,35 @@ class StuffViewSet(viewsets.ModelViewSet):
     permission_classes = [AllowAny]
     parser_classes = [MultiPartParser, FormParser]
     filterset_class = StuffFilter  # DjangoFilterBackend filter class
+    pagination_class = CatalogPagination
+    # Maximum number of SQL queries each read endpoint may issue, whatever the
+    # page size. Enforced by the tests in tests.py.
+    query_budget = {
+        'list': 2, 'retrieve': 2, 'metrics': 1, 'utilization': 2, 'facets': 1, 'changes': 4, 'related': 2, 'funnel': 1,
+    }
+    # Longest period accepted by the utilization report.
+    max_utilization_days = 3 * 366
+    # Longest period accepted by the funnel report.
+    max_funnel_days = 366
+    # Changes returned by one call of the change feed, by default and at most.
+    changes_page_size = 100
+    changes_max_page_size = 1000
+    # Prefetched for the serialized items; list, retrieve and related load them only
+    # once the conditional GET checks passed.
+    deferred_prefetch = ('equipment_images',)
+    # Catalog sort keys accepted by ?ordering=, optionally prefixed with '-'.
+    ordering_fields = (
+        'created_at', 'price_per_day', 'num_views', 'num_favorites', 'num_rentals', 'avg_rating', 'trending',
+    )
+    # Sort keys standing for another field: ?ordering=trending lists the hottest items first.
+    ordering_aliases = {'trending': '-trending_score', '-trending': 'trending_score'}
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        # Load the nested management row with a join and all images in one
+        # extra query instead of two lookups per serialized item.
+        queryset = super().get_queryset().select_related('stuff_management')
+        if self.action not in ('list', 'retrieve', 'related'):
+            queryset = queryset.prefetch_related(*self.deferred_prefetch)
         category = self.request.query_params.get('category')
         user = self.request.query_params.get('user')
         rental_zone = self.request.query_params.get('rental_zone')
@@ -55,8 +135,176 @@ class StuffViewSet(viewsets.ModelViewSet):
         if rental_zone:
             queryset = queryset.filter(stuff_management__rental_zone=rental_zone)
 
+        min_price = parse_number_param(self.request, 'min_price')
+        max_price = parse_number_param(self.request, 'max_price')
+        if min_price is not None and max_price is not None and max_price < min_price:
+            raise ValidationError({'max_price': 'Must not be below min_price.'})
+        if min_price is not None:
+            queryset = queryset.filter(price_per_day__gte=min_price)
+        if max_price is not None:
+            queryset = queryset.filter(price_per_day__lte=max_price)
+
+        available_from = parse_date_param(self.request, 'available_from')
+        available_to = parse_date_param(self.request, 'available_to')
+        if available_from or available_to:
+            if not (available_from and available_to):
+                raise ValidationError({'available_from': 'available_from and available_to must be given together.'})
+            if available_to < available_from:
+                raise ValidationError({'available_to': 'Must not be before available_from.'})
+            queryset = queryset.available_between(available_from, available_to)
+
+        search = self.request.query_params.get('q', '').strip()
+        if search:
+            queryset = queryset.search(search)
+
+        ordering = self.request.query_params.get('ordering')
+        if ordering and self.action == 'list':
+            if ordering.lstrip('-') not in self.ordering_fields:
+                raise ValidationError({'ordering': f"Choose one of {', '.join(self.ordering_fields)}, optionally prefixed with '-'."})
+            queryset = queryset.order_by(self.ordering_aliases.get(ordering, ordering), '-id')
+        elif search and self.action == 'list':
+            queryset = queryset.order_by('-search_rank', '-id')
+
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        paginator = self.paginator
+
+        def build():
+            prefetch_related_objects(page, *self.deferred_prefetch)
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return respond(request, list_validators(page, paginator.has_next, paginator.has_previous), build)
+
+    @cached_response('stuff:{pk}')
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+
+        def build():
+            prefetch_related_objects([instance], *self.deferred_prefetch)
+            return Response(self.get_serializer(instance).data)
+        return respond(request, object_validators(instance), build)
+
+    @action(detail=False, methods=['get'], url_path='metrics')
+    def metrics(self, request):
+        """
+        Rentals, revenue, rating, views and conversion per item over an optional
+        [since, until] date range, e.g. ?since=2025-06-01&ordering=-revenue_total&limit=10.
+        """
+        since = parse_date_param(request, 'since')
+        until = parse_date_param(request, 'until')
+        ordering = request.query_params.get('ordering', '-revenue_total')
+        if ordering.lstrip('-') not in STUFF_METRICS:
+            raise ValidationError({'ordering': f"Choose one of {', '.join(STUFF_METRICS)}, optionally prefixed with '-'."})
+        limit = parse_int_param(request, 'limit')
+
+        # `until` is inclusive for callers, with_metrics() takes an exclusive bound.
+        if until is not None:
+            until += datetime.timedelta(days=1)
+        queryset = self.get_queryset().select_related(None).prefetch_related(None)
+        queryset = queryset.with_metrics(since=since, until=until).order_by(ordering, 'id')
+        if limit:
+            queryset = queryset[:limit]
+        serializer = StuffMetricsSerializer(queryset, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='utilization')
+    def utilization(self, request):
+        """
+        Share of the days in [since, until] (default: the last 365 days) each
+        item, rental zone and the whole fleet was rented, with daily occupancy
+        curves. Accepts the list filters; ?limit= keeps the most used items only.
+        """
+        until = parse_date_param(request, 'until') or timezone.localdate()
+        since = parse_date_param(request, 'since') or until - datetime.timedelta(days=364)
+        if until < since:
+            raise ValidationError({'until': 'Must not be before since.'})
+        if (until - since).days >= self.max_utilization_days:
+            raise ValidationError({'since': f'The period may span at most {self.max_utilization_days} days.'})
+        limit = parse_int_param(request, 'limit')
+
+        queryset = self.get_queryset().select_related(None).prefetch_related(None)
+        report = fleet_utilization(since, until, queryset)
+        report['items'].sort(key=lambda item: (-item['utilization'], item['stuff']))
+        if limit:
+            report['items'] = report['items'][:limit]
+        return Response(report, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='facets')
+    def facets(self, request):
+        """
+        Number of items per category, brand, rental zone, state and price
+        bucket among those the list filters (including ?q=, ?min_price= and
+        ?max_price=) select, e.g. ?q=drill&rental_zone=Tunis.
+        """
+        queryset = self.get_queryset().select_related(None).prefetch_related(None)
+        return Response(queryset.facets(), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='funnel')
+    def funnel(self, request):
+        """
+        Views, cart adds and rentals over [since, until] (default: the last
+        30 days), with the conversion ratios between them, per ?by=category,
+        stuff, source or device. Accepts the list filters; ?limit= keeps the
+        most viewed groups only.
+        """
+        until = parse_date_param(request, 'until') or timezone.localdate()
+        since = parse_date_param(request, 'since') or until - datetime.timedelta(days=29)
+        if until < since:
+            raise ValidationError({'until': 'Must not be before since.'})
+        if (until - since).days >= self.max_funnel_days:
+            raise ValidationError({'since': f'The period may span at most {self.max_funnel_days} days.'})
+        by = request.query_params.get('by', 'category')
+        if by not in FUNNEL_DIMENSIONS:
+            raise ValidationError({'by': f"Choose one of {', '.join(FUNNEL_DIMENSIONS)}."})
+        limit = parse_int_param(request, 'limit')
+
+        queryset = self.get_queryset().select_related(None).prefetch_related(None)
+        # `until` is inclusive for callers, funnel() takes an exclusive bound.
+        report = queryset.funnel(since, until + datetime.timedelta(days=1), by=by, limit=limit)
+        return Response({'since': since, 'until': until, 'by': by, **report}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='changes')
+    def changes(self, request):
+        """
+        The items created, changed or deleted since ?since=<token> (the whole
+        catalog without one), oldest change first, each item once. Call again
+        with the returned next token: right away while has_more is true, later
+        on otherwise.
+        """
+        limit = parse_int_param(request, 'limit', default=self.changes_page_size, maximum=self.changes_max_page_size)
+        stuffs = Stuff.objects.select_related('stuff_management').prefetch_related(*self.deferred_prefetch)
+        try:
+            changes, next_token, has_more = read_changes(request.query_params.get('since'), limit, stuffs)
+        except InvalidToken:
+            raise ValidationError({'since': 'Invalid change token.'})
+
+        items = iter(self.get_serializer([change for change in changes if isinstance(change, Stuff)], many=True).data)
+        results = [
+            {'id': change.pk, 'deleted': True, 'deleted_at': change.deleted_at}
+            if isinstance(change, StuffTombstone) else {'id': change.pk, 'deleted': False, 'stuff': next(items)}
+            for change in changes
+        ]
+        return Response({'next': next_token, 'has_more': has_more, 'results': results}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='related')
+    def related(self, request, pk=None):
+        """
+        The items most often viewed or favorited by the users of this one,
+        closest first, as precomputed by the build_related command. Accepts
+        the list filters, e.g. ?rental_zone=Tunis, and ?limit=.
+        """
+        if not pk.isdigit():
+            raise NotFound()
+        limit = parse_int_param(request, 'limit')
+        queryset = self.get_queryset().filter(related_to__stuff_id=pk).order_by('related_to__rank')
+        items = list(queryset[:limit] if limit else queryset)
+
+        def build():
+            prefetch_related_objects(items, *self.deferred_prefetch)
+            return Response(self.get_serializer(items, many=True).data)
+        return respond(request, list_validators(items), build)
+
     @action(detail=True, methods=['post'], url_path='draft')
     def set_draft(self, request, pk=None):
         """Set the product status to 'draft'."""
@@ -79,6 +327,18 @@ class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [AllowAny]
+
+    @cached_response('categories')
+    def list(self, request, *args, **kwargs):
+        categories = list(self.filter_queryset(self.get_queryset()))
+        return respond(request, list_validators(categories),
+                       lambda: Response(self.get_serializer(categories, many=True).data))
+
+    @cached_response('categories')
+    def retrieve(self, request, *args, **kwargs):
+        category = self.get_object()
+        return respond(request, object_validators(category), lambda: Response(self.get_serializer(category).data))
+
 class WishViewSet(viewsets.ModelViewSet):
     queryset = Favorite.objects.all()
     serializer_class = WishSerializer
@@ -95,6 +355,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewsSerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
     def get_queryset(self):
         product_id = self.request.query_params.get('product', None)
         if product_id:
@@ -102,78 +363,18 @@ class ReviewViewSet(viewsets.ModelViewSet):
         return self.queryset
 
     def perform_create(self, serializer):
-        review = serializer.save()
-
-        try:
-            stuff = review.product
-            keycloak_id = stuff.user  # make sure you have this field
+        # The owner is notified by the publish_events command once the review
+        # is committed, so neither RabbitMQ nor the user service is on this
+        # request's path (see equipments/outbox.py).
+        with transaction.atomic():
+            review = serializer.save()
+            outbox.enqueue('review.created', {
+                'review_id': review.id,
+                'product_id': review.product_id,
+                'owner': review.product.user,
+            })
 
-            # Call external API to get user info
-            user_info = self.get_user_info_httpx(keycloak_id)
-            if user_info is None:
-                print(f"User with keycloak_id {keycloak_id} not found via API")
-                return
 
-            user_email = user_info.get('email')
-            if not user_email:
-                print(f"Email not found in user info for keycloak_id {keycloak_id}")
-                return
-
-            event_type = 'review.created'
-            self.publish_rabbitmq_event(event_type, user_email, review.id)
-
-        except Exception as e:
-            print(f"Error processing review create event: {e}")
-    
-
-    def get_user_info_httpx(self, keycloak_id):
-        url = f"http://192.168.1.120:8000/user/user-details/{keycloak_id}/"
-        try:
-            with httpx.Client(timeout=5) as client:
-                response = client.get(url)
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    print(f"Failed to get user info from API: {response.status_code}")
-                    return None
-        except httpx.RequestError as e:
-            print(f"HTTPX request error: {e}")
-            return None
-
-    def publish_rabbitmq_event(self, event_type, email, review_id):
-        try:
-            connection = pika.BlockingConnection(
-                pika.ConnectionParameters(
-                    host='host.docker.internal',  # adjust if needed in Docker env
-                    port=5672,
-                    heartbeat=600,
-                    blocked_connection_timeout=300
-                )
-            )
-            channel = connection.channel()
-            exchange_name = 'review_events'
-            channel.exchange_declare(exchange=exchange_name, exchange_type='topic', durable=True)
-            message = {
-                'event': event_type,
-                'payload': {
-                    'email': email,
-                    'review_id': review_id
-                }
-            }
-            channel.basic_publish(
-                exchange=exchange_name,
-                routing_key=event_type,
-                body=json.dumps(message),
-                properties=pika.BasicProperties(delivery_mode=2)
-            )
-            print(f"Published {event_type} for {email}")
-        except Exception as e:
-            print(f"Failed to publish message: {e}")
-        finally:
-            if 'connection' in locals() and connection.is_open:
-                connection.close()
-
-   
 class ImageViewSet(viewsets.ModelViewSet):
     serializer_class = EquipmentImageSerializer
     permission_classes = [AllowAny]
@@ -187,6 +388,10 @@ class ImageViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    @cached_response('images:{stuff}')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 class StuffManagementViewSet(viewsets.ModelViewSet):
     queryset = StuffManagement.objects.all()
     serializer_class = StuffManagementSerializer
@@ -257,25 +462,147 @@ class VisitorViewSet(viewsets.ModelViewSet):
 
 
 
-class ItemViewViewSet(viewsets.ModelViewSet):
+class EventIngestionMixin:
+    """
+    Accept one event object or an array of them on POST and hand them to the
+    ingestion pipeline (equipments/ingest.py) instead of saving each row.
+    Written synchronously, the created events are returned with a 201 like
+    any create; buffered, the response is a 202 with {accepted, dropped}.
+    """
+    ingest_serializer_class = None
+    # Foreign keys checked in bulk: serializer source attribute -> model.
+    ingest_references = {}
+    max_events_per_request = 1000
+
+    def create(self, request, *args, **kwargs):
+        many = isinstance(request.data, list)
+        if many:
+            serializer = self.ingest_serializer_class(data=request.data, many=True, max_length=self.max_events_per_request)
+        else:
+            serializer = self.ingest_serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        rows = serializer.validated_data if many else [serializer.validated_data]
+
+        for attribute, model in self.ingest_references.items():
+            wanted = {row[attribute] for row in rows}
+            found = set(model.objects.filter(pk__in=wanted).values_list('pk', flat=True))
+            missing = wanted - found
+            if missing:
+                field = attribute[:-len('_id')]
+                raise ValidationError({field: [f'Invalid pk "{pk}" - object does not exist.' for pk in sorted(missing)]})
+
+        model = self.get_queryset().model
+        events = [model(**row) for row in rows]
+        accepted = ingest.ingest(model, events)
+        if ingest.ingestion_settings()['BUFFERED']:
+            return Response({'accepted': accepted, 'dropped': len(events) - accepted}, status=status.HTTP_202_ACCEPTED)
+        serializer = self.get_serializer(events if many else events[0], many=many)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class OpsStatsView(APIView):
+    """Per-process operational counters registered through equipments.ops."""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return Response(ops.collect())
+
+
+class ItemViewViewSet(EventIngestionMixin, viewsets.ModelViewSet):
     queryset = ItemView.objects.all()
     serializer_class = ItemViewSerializer
     permission_classes = [AllowAny]
+    pagination_class = EventPagination
+    ingest_serializer_class = ItemViewEventSerializer
+    ingest_references = {'stuff_id': Stuff}
 
-class CartActivityViewSet(viewsets.ModelViewSet):
+    def perform_destroy(self, instance):
+        # Not a post_delete signal, see equipments/signals.py.
+        super().perform_destroy(instance)
+        counters.increment(instance.stuff_id, 'num_views', -1)
+
+class CartActivityViewSet(EventIngestionMixin, viewsets.ModelViewSet):
     queryset = CartActivity.objects.all()
     serializer_class = CartActivitySerializer
     permission_classes = [AllowAny]
+    pagination_class = EventPagination
+    ingest_serializer_class = CartActivityEventSerializer
+    ingest_references = {'stuff_id': Stuff, 'visitor_id': Visitor}
+
+class BookingConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'This item is already booked for some of the requested dates.'
+    default_code = 'booking_conflict'
+
 
 class RentalViewSet(viewsets.ModelViewSet):
     queryset = Rental.objects.all()
     serializer_class = RentalSerializer
     permission_classes = [AllowAny]
+    pagination_class = RentalPagination
+
+    # Double bookings are rejected by the rental_no_overlap exclusion
+    # constraint, so concurrent bookings need no application-level lock.
+
+    def perform_create(self, serializer):
+        self._save_booking(serializer)
+
+    def perform_update(self, serializer):
+        self._save_booking(serializer)
+
+    def _save_booking(self, serializer):
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError as exc:
+            if getattr(getattr(exc.__cause__, 'diag', None), 'constraint_name', None) == 'rental_no_overlap':
+                raise BookingConflict()
+            raise
 
 class SiteStatViewSet(viewsets.ModelViewSet):
     queryset = SiteStat.objects.all()
     serializer_class = SiteStatSerializer
     permission_classes = [AllowAny]
+    # Longest periods accepted by the unique visitors report, overall and
+    # for a breakdown of every item, which reads a sketch per item and day.
+    max_visitor_days = 3 * 366
+    max_item_visitor_days = 92
+
+    @action(detail=False, methods=['get'], url_path='unique-visitors')
+    def unique_visitors(self, request):
+        """
+        Estimated distinct users who viewed items over [since, until]
+        (default: the last 30 days), site-wide or per ?by=stuff, category,
+        source or device, most visited first. ?value= keeps one item,
+        category, source or device; ?limit= the most visited ones. Without
+        ?value=, a breakdown per item covers at most max_item_visitor_days.
+        """
+        until = parse_date_param(request, 'until') or timezone.localdate()
+        since = parse_date_param(request, 'since') or until - datetime.timedelta(days=29)
+        if until < since:
+            raise ValidationError({'until': 'Must not be before since.'})
+        if (until - since).days >= self.max_visitor_days:
+            raise ValidationError({'since': f'The period may span at most {self.max_visitor_days} days.'})
+        by = request.query_params.get('by', 'site')
+        if by not in sketches.DIMENSIONS:
+            raise ValidationError({'by': f"Choose one of {', '.join(sketches.DIMENSIONS)}."})
+        value = request.query_params.get('value')
+        if by == 'stuff' and value is None and (until - since).days >= self.max_item_visitor_days:
+            raise ValidationError(
+                {'since': f'A breakdown per item may span at most {self.max_item_visitor_days} days; pass value.'}
+            )
+        limit = parse_int_param(request, 'limit')
+
+        estimates = sketches.unique_visitors(since, until, by, None if value is None or by == 'site' else [value])
+        numeric = by in ('stuff', 'category')
+        results = sorted(
+            ({'value': (int(key) if numeric else key) if by != 'site' else None, 'visitors': visitors}
+             for key, visitors in estimates.items()),
+            key=lambda row: (-row['visitors'], row['value'] or ''),
+        )
+        if limit:
+            results = results[:limit]
+        return Response({'since': since, 'until': until, 'by': by, 'results': results}, status=status.HTTP_200_OK)
 
 class TrafficSourceViewSet(viewsets.ModelViewSet):
     queryset = TrafficSource.objects.all()